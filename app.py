@@ -1,32 +1,288 @@
+import dataclasses
+import functools
 import logging
-import random
+import math
+import os
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from datetime import timedelta
-from io import BytesIO
 
-import qrcode
+from flask import abort
+from flask import before_render_template
 from flask import Flask
+from flask import g
+from flask import jsonify
 from flask import make_response
 from flask import redirect
 from flask import render_template
 from flask import request
+from flask import Response
+from flask import session
+from flask import template_rendered
 from flask import url_for
 
+from pyscripts import metrics
+from pyscripts.auth import Authenticator
+from pyscripts.auth import HashingBusy
+from pyscripts.auth import LoginThrottled
+from pyscripts.engine import recommend_for_group
+from pyscripts.drinker_contexts import DrinkerContext
+from pyscripts.measurements import MeasurementJob
+from pyscripts.measurements import MeasurementJobs
+from pyscripts.measurements import wait_seconds
 from pyscripts.objects import Drinker
+from pyscripts.objects import drinker_contexts
+from pyscripts.objects import get_catalog
 from pyscripts.objects import get_drink_candidates_for_drive_time
 from pyscripts.objects import get_drink_candidates_less_than_max_alcohol
-from pyscripts.objects import get_max_potentiometer_value
 from pyscripts.objects import Session
+from pyscripts.profiler import RecentProfiles
+from pyscripts.profiler import SamplingProfiler
+from pyscripts.qr_codes import get_qr_code_image
+from pyscripts.ranking import default_strategy
+from pyscripts.ranking import rank_drinks
+from pyscripts.ranking import strategies
+from pyscripts.sensor import stop_all_sensor_readers
+from pyscripts.sensor_hub import SensorHub
+from pyscripts.storage import create_storage
+from pyscripts.storage import get_storage
+from pyscripts.storage import set_storage
+from pyscripts.storage import UsernameTaken
+from pyscripts.unit_of_work import begin_unit_of_work
+from pyscripts.unit_of_work import CountingStorage
+from pyscripts.unit_of_work import end_unit_of_work
+from pyscripts.unit_of_work import remember
+from pyscripts.unit_of_work import StorageReadStats
 
 # To run the app, run the following command in the terminal: flask run
+# To serve it in production, with the measurement routes served asynchronously, run: python asgi.py
 
 # Choose the measurement method for the BAC sensor
 bac_measurement_method = "manual"  # "potentiometer" or "manual"
 
-# Port name for Arduino serial connection. This is likely to be different on your computer.
-serial_port_name = "COM7"
+# Breathalyzer stations, mapping a station name to the port name of its Arduino serial connection. The port names are
+# likely to be different on your computer.
+serial_port_names = {"station-1": "COM7"}
+# Number of seconds the BAC sensor is read for per measurement
+measurement_window = 5.0
+# The longest a request for a measurement's progress may wait for it to finish (with ?wait=), in seconds
+max_measurement_wait = 30
+
+# Choose where users, sessions and beverages are stored: "json" (the files in databases/) or "sqlite". Run
+# "python -m pyscripts.migrate_json_to_sqlite" once to copy the JSON databases into SQLite before switching.
+storage_backend = "json"
+sqlite_database_path = "databases/breathalyzer.sqlite3"
+# Storage reads are counted per request, see /stats/storage_reads
+set_storage(
+    CountingStorage(create_storage(storage_backend, sqlite_path=sqlite_database_path))
+)
+
+# The URL put into the QR code on the welcome page. Insert the IP address of the server here. This may need to be the
+# IP of your router (as it is below). Can also be set with the BREATHALYZER_SERVER_URL environment variable.
+server_url = os.environ.get("BREATHALYZER_SERVER_URL", "http://192.168.1.121:5000")
+qr_code_box_size = 10
+qr_code_border = 5
+qr_code_formats = ("png", "svg")
+# Number of seconds clients may reuse a QR code before checking whether it has changed
+qr_code_max_age = 300
+
+# Number of drinks shown on the recommendation page, unless the request asks for a different number
+number_of_recommendations = 3
+# The most drinkers one request to /recommendations may ask about
+max_group_size = 100
+# User ids of the bar staff's accounts. Staff may get recommendations for any drinker from /recommendations, so they can
+# score a whole table in one request; everyone else only for themselves. Can also be set with the
+# BREATHALYZER_STAFF_USER_IDS environment variable, as ids separated by commas.
+staff_user_ids = {
+    int(user_id)
+    for user_id in os.environ.get("BREATHALYZER_STAFF_USER_IDS", "").split(",")
+    if user_id.strip()
+}
+
+# Passwords are hashed with scrypt in this many worker processes, so logins don't hold up the request threads
+password_hashing_workers = 2
+# Number of seconds a successful login is remembered, so logging in again within it doesn't hash the password again
+login_cache_ttl = 300
+
+# Signs the session cookie that keeps users logged in. Set BREATHALYZER_SECRET_KEY to keep users logged in when the
+# app restarts and to share logins between processes; otherwise a new key is made each time the app starts.
+secret_key = os.environ.get("BREATHALYZER_SECRET_KEY") or secrets.token_hex(32)
+# Number of hours a login lasts
+login_hours = 12
+# The most logged in drinkers kept in memory. Drinkers that haven't been seen for a while are loaded again when needed.
+max_cached_drinkers = 10_000
+
+# Request, storage, sensor, recommendation and rendering timings are served on /metrics for Prometheus
+metrics_enabled = True
+metrics.registry.enabled = metrics_enabled
+# Allows profiling a single request by adding "?profile=1" to its URL. The profile is linked from the response's
+# X-Profile-URL header. Leave off in production, as anyone can turn it on.
+profiling_enabled = False
+profiling_interval = 0.002
 
 app = Flask(__name__)
+app.secret_key = secret_key
+drinker_contexts.ttl = login_hours * 3600
+drinker_contexts.max_drinkers = max_cached_drinkers
+
+# The stations' ports are only opened when the first measurement is requested
+sensor_hub = SensorHub(serial_port_names, window=measurement_window)
+# BAC measurements started from the potentiometer page
+measurement_jobs = MeasurementJobs()
+# Hashes and checks passwords, and throttles login attempts
+authenticator = Authenticator(
+    workers=password_hashing_workers, cache_ttl=login_cache_ttl
+)
+# Logs finished measurements to the drinkers' sessions, so the stations' reader threads don't wait on the storage
+measurement_logger = ThreadPoolExecutor(
+    max_workers=2, thread_name_prefix="measurement-log"
+)
+
+# Render the QR codes now, so the first request for them doesn't have to
+for qr_code_format in qr_code_formats:
+    get_qr_code_image(
+        server_url,
+        box_size=qr_code_box_size,
+        border=qr_code_border,
+        image_format=qr_code_format,
+    )
+
+
+# Number of storage reads made by each route
+storage_read_stats = StorageReadStats()
+# Profiles of the most recent profiled requests
+recent_profiles = RecentProfiles()
+
+
+@app.before_request
+def start_unit_of_work():
+    """
+    Gives each request its own unit of work, so that each drinker, session and catalog is only loaded once per request
+    """
+    g.unit_of_work, g.unit_of_work_token = begin_unit_of_work()
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if profiling_enabled and request.args.get("profile") == "1":
+        g.profiler = SamplingProfiler(interval=profiling_interval)
+        g.profiler.start()
+
+
+@app.after_request
+def record_request_metrics(response: Response) -> Response:
+    route = request.endpoint or "unknown"
+    if "request_started" in g:
+        metrics.request_seconds.observe(
+            time.perf_counter() - g.request_started, route, request.method
+        )
+    metrics.requests.inc(route, request.method, str(response.status_code))
+
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.stop()
+        profile_id = recent_profiles.add(profiler, f"{request.method} {request.path}")
+        response.headers["X-Profile-URL"] = url_for("profile", profile_id=profile_id)
+    return response
+
+
+@app.teardown_request
+def finish_unit_of_work(exception=None):
+    # The profiler is still running if the request failed before after_request
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.stop()
+    if "unit_of_work_token" not in g:
+        return
+    storage_read_stats.record(
+        request.endpoint or "unknown", g.unit_of_work.storage_reads
+    )
+    end_unit_of_work(g.unit_of_work_token)
+
+
+@before_render_template.connect_via(app)
+def start_render_timer(sender, template, context, **extra):
+    g.render_started = time.perf_counter()
+
+
+@template_rendered.connect_via(app)
+def record_render_time(sender, template, context, **extra):
+    if "render_started" in g:
+        metrics.render_seconds.observe(
+            time.perf_counter() - g.pop("render_started"), template.name
+        )
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_page():
+    """
+    Returns the metrics in the Prometheus text format
+    """
+    return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/profiles/<int:profile_id>", methods=["GET"])
+def profile(profile_id):
+    """
+    Returns the profile of a request made with "?profile=1" as folded stacks, which can be turned into a flame graph
+    with flamegraph.pl or opened in speedscope
+    """
+    found = recent_profiles.get(profile_id)
+    if found is None:
+        abort(404)
+    description, profiler = found
+    header = (
+        f"# {description}: {sum(profiler.stacks.values())} samples over "
+        f"{profiler.seconds * 1000:.1f} ms\n"
+    )
+    return Response(header + profiler.folded(), mimetype="text/plain")
+
+
+def drinker_context_for(login: dict) -> DrinkerContext or None:
+    """
+    Returns the logged in drinker for a session cookie's contents, or None if the cookie isn't for a login that is still
+    valid. Used by login_required, and by the routes asgi.py serves itself.
+    """
+    context = drinker_contexts.get(login["token"]) if "token" in login else None
+    if context is None and "user_id" in login:
+        # Logged in by another worker process, or before a restart. The session cookie is signed, so its token can be
+        # trusted, and resume() checks that it hasn't been logged out of since.
+        drinker_contexts.resume(login["token"], login["user_id"], login["expires_at"])
+        context = drinker_contexts.get(login["token"])
+    return context
+
+
+def login_required(view):
+    """
+    Makes a route only for logged in users. The logged in drinker is put in g.drinker_context. Users who aren't logged
+    in are sent to the login page, or get a 401 if they sent JSON.
+    """
+
+    @functools.wraps(view)
+    def check_login(*args, **kwargs):
+        context = drinker_context_for(session)
+        if context is None:
+            session.clear()
+            if request.is_json:
+                abort(401)
+            return redirect(url_for("account_login"))
+        g.drinker_context = context
+        # Code that asks for the drinker by id during the request gets the cached one instead of reading storage
+        remember("drinker", context.user_id, context.drinker)
+        return view(*args, **kwargs)
+
+    return check_login
+
+
+@app.route("/stats/storage_reads", methods=["GET"])
+def storage_reads():
+    """
+    Returns the number of storage reads per request, per route and table
+    """
+    return jsonify(storage_read_stats.summary())
 
 
 @app.route("/")
@@ -40,27 +296,29 @@ def qr_code():
     Returns a QR code image that contains the server URL. By default Flask only listens to requests from the local
     machine, so for the QR code to generate a url that can connect, Flask needs to be run with "--host=0.0.0.0" flag to
     allow it to on all available network interfaces and accept requests from any IP address.
+
+    The image is rendered once and cached. Pass "?format=svg" for an SVG instead of a PNG. Clients that send back the
+    ETag or Last-Modified date they were given get an empty 304 response if the image hasn't changed.
     """
-    # Insert the IP address of the server into the QR code. This may need to be the IP of your router (as it is below)
-    server_url = "http://192.168.1.121:5000"
-    qr = qrcode.QRCode(version=1, box_size=10, border=5)
-    qr.add_data(server_url)
-    qr.make(fit=True)
-    # Create an image in PIL.Image.Image format
-    img = qr.make_image(fill_color="black", back_color="white")
-
-    # Convert the image to a byte buffer. Flask can only accept byte or string http responses
-    img_buffer = BytesIO()
-    img.save(img_buffer, "PNG")
-    # Move the pointer to the beginning of the buffer
-    img_buffer.seek(0)
-
-    # Create a Flask response object that contains the image
-    response = make_response(img_buffer.getvalue())
-    # Set the content type to image/png (the default is text/html)
-    response.headers["Content-Type"] = "image/png"
+    image_format = request.args.get("format", "png")
+    if image_format not in qr_code_formats:
+        abort(400)
+    image = get_qr_code_image(
+        server_url,
+        box_size=qr_code_box_size,
+        border=qr_code_border,
+        image_format=image_format,
+    )
 
-    return response
+    response = make_response(image.body)
+    response.headers["Content-Type"] = image.content_type
+    response.set_etag(image.etag)
+    response.last_modified = image.last_modified
+    # Screens polling the QR code can keep it for a while, but should check back in case the server URL changes
+    response.cache_control.public = True
+    response.cache_control.max_age = qr_code_max_age
+    # Turns the response into a 304 if the client's copy is still current
+    return response.make_conditional(request)
 
 
 @app.route("/register", methods=["GET", "POST"])
@@ -81,15 +339,23 @@ def register():
         if Drinker.get_drinker_from_db(username=username):
             return f"Username {username} already exists!"
 
-        # Create new drinker object
+        # Create new drinker object. Only a hash of the password is stored.
+        try:
+            password_hash = authenticator.hash(password)
+        except HashingBusy as error:
+            return str(error), 503
         new_drinker = Drinker(
             username=username,
-            password=password,
+            password=password_hash,
             dob=datetime.strptime(request.form.get("dob"), "%Y-%m-%d"),
             sex=request.form.get("sex").strip(),
             weight=int(request.form.get("weight")),
         )
-        new_drinker.save_to_db()
+        try:
+            new_drinker.save_to_db(new=True)
+        except UsernameTaken:
+            # Registered by someone else since the check above
+            return f"Username {username} already exists!"
 
         # Redirect to login page with username
         return redirect("/login?username=" + username)
@@ -110,14 +376,29 @@ def account_login():
         username = request.form["username"]
         password = request.form["password"]
 
-        logging.info(f"Username: {username}, Password: {password}")
-
-        # Validate username and password against JSON data
-        drinker = Drinker.get_drinker_from_db(username=username)
-        if drinker and drinker.password == password:
+        logging.info(f"Login attempt for username: {username}")
+
+        try:
+            authenticator.throttle(username, request.remote_addr)
+            # Validate username and password against the stored password hash
+            drinker = Drinker.get_drinker_from_db(username=username)
+            verified = drinker is not None and authenticator.verify(drinker, password)
+        except LoginThrottled as error:
+            logging.info(f"Login throttled for username: {username}")
+            response = make_response(str(error), 429)
+            response.headers["Retry-After"] = str(math.ceil(error.retry_after))
+            return response
+        except HashingBusy as error:
+            return str(error), 503
+        if verified:
             logging.info("Valid username and password")
-            return redirect(url_for("account_home", user_id=drinker.id))
-        elif drinker and drinker.password != password:
+            session.clear()
+            session["token"], session["expires_at"] = drinker_contexts.log_in(drinker)
+            session["user_id"] = drinker.id
+            # Look up the current session now, so the first page view doesn't have to
+            drinker.get_current_session()
+            return redirect(url_for("account_home"))
+        elif drinker:
             logging.info("Invalid username and/or password")
             return "Invalid password"
 
@@ -125,18 +406,28 @@ def account_login():
     return render_template("login_page.html")
 
 
-@app.route("/account/<int:user_id>", methods=["GET"])
-def account_home(user_id):
+@app.route("/logout", methods=["GET", "POST"])
+def logout():
     """
-    Displays the account home page for the given user.
+    Logs the user out and sends them to the login page
     """
-    logging.info(f"Account page accessed for {user_id}")
+    if "token" in session:
+        drinker_contexts.log_out(session["token"], session.get("expires_at"))
+    session.clear()
+    return redirect(url_for("account_login"))
+
 
-    # Get the current drinker (user) from the database
-    drinker = Drinker.get_drinker_from_db(user_id=user_id)
+@app.route("/account", methods=["GET"])
+@login_required
+def account_home():
+    """
+    Displays the account home page for the logged in user.
+    """
+    drinker = g.drinker_context.drinker
+    logging.info(f"Account page accessed for {drinker.id}")
 
     # Get the current session for the user. If there is no current session, then current_session will be None
-    current_session = drinker.get_current_session()
+    current_session = g.drinker_context.current_session
     logging.info(f"Drinker: {drinker.username}, current session: {current_session}")
 
     context = {
@@ -147,11 +438,12 @@ def account_home(user_id):
 
 
 @app.route("/create_new_session", methods=["GET", "POST"])
+@login_required
 def create_new_session():
     """
-    Starts a new session for the given user
+    Starts a new session for the logged in user
     """
-    user_id = request.args.get("user_id", None)
+    user_id = g.drinker_context.user_id
 
     logging.info(
         "Create new session page accessed, user: {} and method: {}".format(
@@ -160,7 +452,6 @@ def create_new_session():
     )
     if request.method == "POST":
         # Get form data
-        user_id = request.form.get("user_id")
         drive_time = request.form.get("drive_time", None)
 
         # Convert drive time to datetime object
@@ -182,37 +473,79 @@ def create_new_session():
             start_time=datetime.now(),
             drive_time=drive_time,
         )
-        new_session.save_to_db()
+        new_session.save_to_db(new=True)
         logging.info("New session created for user: {}".format(user_id))
 
-        return redirect(url_for("account_home", user_id=user_id))
+        return redirect(url_for("account_home"))
 
     # GET request
     logging.info("GET request for create new session page")
-    return render_template("create_new_session.html", user_id=user_id)
+    return render_template("create_new_session.html")
 
 
 @app.route("/measure_bac", methods=["GET"])
+@login_required
 def measure_bac():
     """
     Redirects to the appropriate page for measuring the user's BAC.
     """
-    user_id = request.args.get("user_id", None)
-    logging.info("Measure_bac page accessed, user: {}".format(user_id))
+    logging.info(
+        "Measure_bac page accessed, user: {}".format(g.drinker_context.user_id)
+    )
 
     # Route to correct view based on the bac_measurement_method (e.g. "manual", "potentiometer")
     if bac_measurement_method == "potentiometer":
-        return redirect(url_for("get_bac_from_potentiometre", user_id=user_id))
+        return redirect(url_for("get_bac_from_potentiometre"))
     elif bac_measurement_method == "manual":
-        return redirect(url_for("measure_bac_manually", user_id=user_id))
+        return redirect(url_for("measure_bac_manually"))
+
+
+def log_measurement(user_id: int or str, bac: float):
+    """
+    Logs a measured BAC to the user's current session, so the session's BAC estimate starts again from it
+    """
+    drinker = Drinker.get_drinker_from_db(user_id=int(user_id))
+    current_session = drinker.get_current_session() if drinker else None
+    if current_session is not None:
+        current_session.log_measurement(bac)
+
+
+def start_measurement(user_id: int, station: str = None) -> MeasurementJob:
+    """
+    Starts measuring the user's BAC at the given station (the first free one if None) and returns straight away. If all
+    stations are busy, the measurement waits in the hub's queue. The reading is logged to the user's session once it is
+    done, even if nobody asks for it.
+    """
+    future = sensor_hub.submit(station_name=station)
+
+    def log_reading(done):
+        if done.exception() is None:
+            measurement_logger.submit(log_measurement, user_id, done.result().bac)
+
+    future.add_done_callback(log_reading)
+    job = measurement_jobs.start(future, window=measurement_window, user_id=user_id)
+    logging.info("Started measurement {}".format(job.id))
+    return job
+
+
+def measurement_links(job: MeasurementJob, build_url=url_for) -> dict:
+    """
+    Returns the response to starting a measurement: its id and where to follow it. `build_url` works like url_for.
+    """
+    return {
+        "measurement_id": job.id,
+        "status_url": build_url("measurement_status", measurement_id=job.id),
+        "events_url": build_url("measurement_events", measurement_id=job.id),
+    }
 
 
 @app.route("/measure_bac_manually", methods=["GET", "POST"])
+@login_required
 def measure_bac_manually():
     """
     Allows the user to manually enter their BAC. Used only during development.
     """
-    user_id = request.args.get("user_id", None)
+    user_id = g.drinker_context.user_id
     logging.info(
         "Measure_bac_manually page accessed, method: {}, user: {}".format(
             request.method, user_id
@@ -221,82 +554,281 @@ def measure_bac_manually():
     if request.method == "POST":
         # Get form data
         current_bac = request.form.get("current_bac")
-        user_id = request.form.get("user_id")
 
         logging.info("Current bac: {}".format(current_bac))
+        log_measurement(user_id, float(current_bac))
 
-        return redirect(
-            url_for(
-                "recommendation", user_id=str(user_id), current_bac=str(current_bac)
-            )
-        )
+        return redirect(url_for("recommendation", current_bac=str(current_bac)))
     # GET request
-    return render_template("input_bac_manually.html", user_id=user_id)
+    return render_template("input_bac_manually.html")
 
 
 @app.route("/get_bac_from_potentiometer", methods=["GET", "POST"])
+@login_required
 def get_bac_from_potentiometre():
     """
     Gets the user's BAC from the potentiometer.
     """
-    user_id = request.args.get("user_id", None)
+    user_id = g.drinker_context.user_id
+    # The station the user is standing at. Without one, the first free station is used.
+    station = request.args.get("station", None)
 
     logging.info(
-        "Get bac from potentiometer page accessed, method: {}, user: {}".format(
-            request.method, user_id
+        "Get bac from potentiometer page accessed, method: {}, user: {}, station: {}".format(
+            request.method, user_id, station
         )
     )
 
     if request.method == "POST":
-        # Get max potentiometer value
-        current_bac = get_max_potentiometer_value(serial_port_name=serial_port_name)
-
-        # Round to 3 decimal places and return
-        return str(round(current_bac, 3))
+        if station is not None and station not in sensor_hub.stations:
+            abort(404)
+        # The page follows the measurement through measurement_events
+        job = start_measurement(user_id, station)
+        return jsonify(measurement_links(job)), 202
 
     # GET request
-    return render_template("input_bac_with_potetiometer.html", user_id=user_id)
+    return render_template("input_bac_with_potetiometer.html", station=station)
+
+
+@app.route("/stations", methods=["GET"])
+@login_required
+def stations():
+    """
+    Returns the throughput and latency of each breathalyzer station, and how many measurements are queued, as JSON.
+    """
+    return jsonify(sensor_hub.stats())
+
+
+@app.route("/measurements/<measurement_id>", methods=["GET"])
+@login_required
+def measurement_status(measurement_id):
+    """
+    Returns the progress of one of the user's measurements as JSON, and the BAC once it is done. With ?wait=<seconds>,
+    waits up to that long (at most max_measurement_wait) for the measurement to finish first (long polling).
+    """
+    job = measurement_jobs.get(measurement_id, user_id=g.drinker_context.user_id)
+    if job is None:
+        abort(404)
+    try:
+        wait = wait_seconds(request.args.get("wait"), max_measurement_wait)
+    except ValueError:
+        return jsonify(error="wait must be a number of seconds"), 400
+    if wait > 0:
+        job.wait(timeout=wait)
+    return jsonify(job.to_dict())
+
+
+@app.route("/measurements/<measurement_id>/events", methods=["GET"])
+@login_required
+def measurement_events(measurement_id):
+    """
+    Streams the progress of one of the user's measurements as server-sent events: "progress" events while measuring,
+    then a "result" or "failed" event with the final status.
+    """
+    job = measurement_jobs.get(measurement_id, user_id=g.drinker_context.user_id)
+    if job is None:
+        abort(404)
+
+    def events():
+        while not job.wait(timeout=0.5):
+            yield job.to_event(final=False)
+        yield job.to_event(final=True)
+
+    return Response(
+        events(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
 
 
-@app.route("/<int:user_id>/recommendation/<current_bac>", methods=["GET"])
-def recommendation(user_id, current_bac=None):
+@app.route("/recommendation", methods=["GET"])
+@app.route("/recommendation/<current_bac>", methods=["GET"])
+@login_required
+def recommendation(current_bac=None):
     """
-    Displays drink recommendations for the user.
+    Displays drink recommendations for the user, for the given BAC. Without a BAC, the estimate from the session's
+    drink log is used, so no measurement is needed. If nothing has been logged for the session yet, the user is sent to
+    measure their BAC. Users without a current session are sent to start one.
     """
+    # Get drinker and current session
+    drinker = g.drinker_context.drinker
+    current_session = g.drinker_context.current_session
+
     logging.info(
         "Recommendation page accessed, user: {}, method: {}, current_bac: {}".format(
-            user_id, request.method, current_bac
+            drinker.id, request.method, current_bac
         )
     )
 
-    # Convert current_bac to float
-    current_bac = float(current_bac) if current_bac else None
+    if current_session is None:
+        return redirect(url_for("create_new_session"))
 
-    # Get drinker and current session
-    drinker = Drinker.get_drinker_from_db(user_id=user_id)
-    current_session = drinker.get_current_session()
+    if current_bac is not None:
+        current_bac = float(current_bac)
+    else:
+        current_bac = current_session.estimate_bac(drinker)
+        if current_bac is None:
+            return redirect(url_for("measure_bac"))
+        logging.info("Estimated bac: {}".format(current_bac))
 
     # Get drink recommendations
-    if current_session.drive_time:
-        # Based on drive time. The drinker's max alcohol is taken into account.
-        recommendations = get_drink_candidates_for_drive_time(
-            drinker=drinker, current_bac=current_bac
+    with metrics.recommendation_seconds.time("candidates"):
+        if current_session.drive_time:
+            # Based on drive time. The drinker's max alcohol is taken into account.
+            recommendations = get_drink_candidates_for_drive_time(
+                drinker=drinker,
+                current_bac=current_bac,
+                current_session=current_session,
+            )
+        else:
+            # Based on a user's max alcohol preference (not drive time)
+            recommendations = get_drink_candidates_less_than_max_alcohol(
+                drinker=drinker,
+                current_bac=current_bac,
+                current_session=current_session,
+            )
+
+    # Pick the best few. "?k=", "?strategy=" and "?seed=" change how many there are and how they are picked, see
+    # pyscripts/ranking.py.
+    k = request.args.get("k", number_of_recommendations, type=int)
+    strategy = request.args.get("strategy", default_strategy)
+    seed = request.args.get("seed", type=int)
+    if k < 1 or strategy not in strategies:
+        abort(400)
+    with metrics.recommendation_seconds.time("rank"):
+        recommendations = rank_drinks(
+            drinker=drinker,
+            session=current_session,
+            current_bac=current_bac,
+            drinks=recommendations,
+            k=k,
+            strategy=strategy,
+            seed=seed,
         )
-    else:
-        # Based on a user's max alcohol preference (not drive time)
-        recommendations = get_drink_candidates_less_than_max_alcohol(
-            drinker=drinker, current_bac=current_bac
+
+    return render_template(
+        "recommendation.html",
+        recommendations=recommendations,
+        current_bac=current_bac,
+    )
+
+
+@app.route("/drinks", methods=["GET", "POST"])
+@login_required
+def drink_log():
+    """
+    Logs a drink to the user's current session (POST), or returns the session's drink log (GET). A drink is posted as
+    JSON like {"drink_id": 3, "time": "2023-06-01T21:30:00"} ("time" is optional and defaults to now), or as a form
+    with a drink_id, which redirects back to the recommendations. Returns the estimated BAC after the drink as JSON.
+    """
+    drinker = g.drinker_context.drinker
+    current_session = g.drinker_context.current_session
+    if current_session is None:
+        return jsonify(error="No current session"), 404
+
+    if request.method == "GET":
+        # Read the log first, so the estimate uses its last entry instead of reading it again
+        entries = current_session.get_drink_log()
+        return jsonify(
+            session_id=current_session.id,
+            estimated_bac=current_session.estimate_bac(drinker),
+            entries=entries,
         )
 
-    # Randomize the order of the recommendations
-    random.shuffle(recommendations)
+    body = request.get_json(silent=True) or request.form
+    try:
+        drink = get_catalog().drinks_by_id.get(int(body["drink_id"]))
+        time = datetime.fromisoformat(body["time"]) if body.get("time") else None
+    except (KeyError, TypeError, ValueError):
+        return jsonify(error="Expected a drink_id and an optional ISO time"), 400
+    if drink is None:
+        return jsonify(error="Unknown drink"), 400
+
+    estimated_bac = current_session.log_drink(drinker, drink, time=time)
+    logging.info("Logged {} for user {}".format(drink.name, drinker.id))
+    if not request.is_json:
+        return redirect(url_for("recommendation"))
+    return jsonify(session_id=current_session.id, estimated_bac=estimated_bac), 201
+
+
+@app.route("/recommendations", methods=["POST"])
+@login_required
+def group_recommendations():
+    """
+    Returns drink recommendations for several drinkers (or BACs) at once. Takes JSON like
+    {"drinkers": [{"user_id": 1, "current_bac": 0.02}, ...], "k": 3, "strategy": "balanced", "seed": 1}. k (the most
+    drinks to return per drinker, default all of them), strategy and seed are optional and work like on the
+    recommendation page. Returns the ranked candidates for each drinker in the order given, or an error for drinkers
+    that can't be scored.
+
+    Recommendations are worked out from the drinkers' sessions, so only drinkers the logged in user may see can be
+    asked for (see can_see_drinker). user_id defaults to the logged in user's.
+    """
+    viewer_id = g.drinker_context.user_id
+    body = request.get_json(silent=True) or {}
+    drinkers = body.get("drinkers")
+    k = body.get("k")
+    strategy = body.get("strategy", default_strategy)
+    seed = body.get("seed")
+    try:
+        drinker_bacs = [
+            (int(drinker.get("user_id", viewer_id)), float(drinker["current_bac"]))
+            for drinker in drinkers
+        ]
+        k = None if k is None else int(k)
+        seed = None if seed is None else int(seed)
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return jsonify(error="Expected drinkers with a current_bac"), 400
+    hidden = [
+        user_id
+        for user_id, _ in drinker_bacs
+        if not can_see_drinker(viewer_id, user_id)
+    ]
+    if hidden:
+        return jsonify(error=f"Not allowed to see drinkers {hidden}"), 403
+    if len(drinker_bacs) > max_group_size:
+        return jsonify(error=f"At most {max_group_size} drinkers per request"), 400
+    if (k is not None and k < 1) or strategy not in strategies:
+        return jsonify(error="Invalid k or strategy"), 400
+
+    with metrics.recommendation_seconds.time("group"):
+        recommendations = recommend_for_group(
+            drinker_bacs, k=k, strategy=strategy, seed=seed
+        )
+    return jsonify(
+        recommendations=[
+            {
+                "user_id": recommendation.user_id,
+                "current_bac": recommendation.current_bac,
+                "drinks": [
+                    dataclasses.asdict(drink) for drink in recommendation.drinks
+                ],
+            }
+            | ({"error": recommendation.error} if recommendation.error else {})
+            for recommendation in recommendations
+        ]
+    )
 
-    # Limit the number of recommendations
-    number_of_recommendations = 3
-    if len(recommendations) > number_of_recommendations:
-        recommendations = recommendations[:number_of_recommendations]
 
-    return render_template("recommendation.html", recommendations=recommendations)
+def can_see_drinker(viewer_id: int, user_id: int) -> bool:
+    """
+    Returns True if the logged in user with id `viewer_id` may see the session and recommendations of the drinker with
+    id `user_id`. Bar staff (see staff_user_ids) can see every drinker, other users only themselves.
+    """
+    return viewer_id == user_id or viewer_id in staff_user_ids
+
+
+def shutdown():
+    """
+    Stops the sensor stations and closes their serial ports, finishes logging their readings, stops the password
+    hashing processes and closes the storage. Measurements still in progress fail.
+    """
+    logging.info("Shutting down")
+    sensor_hub.stop()
+    stop_all_sensor_readers()
+    measurement_logger.shutdown()
+    authenticator.close()
+    get_storage().close()
 
 
 if __name__ == "__main__":
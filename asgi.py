@@ -0,0 +1,288 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+import urllib.parse
+
+import uvicorn
+from asgiref.sync import ThreadSensitiveContext
+from asgiref.wsgi import WsgiToAsgi
+
+import app as app_module
+from pyscripts import metrics
+from pyscripts.async_storage import AsyncStorage
+from pyscripts.measurements import MeasurementJob
+from pyscripts.measurements import wait_seconds
+
+# Serves the app over ASGI, for production. Run with: python asgi.py [--workers 1] [--host 0.0.0.0] [--port 5000]
+# The measurement routes are served on the event loop, so a request waiting for a measurement doesn't hold a thread
+# and one process can wait on hundreds of them. The other routes are Flask's, run on threads. Both share the Flask
+# app's login check and measurement jobs.
+
+# Most Flask routes run at once, each on a thread of its own
+flask_threads = 32
+# Number of threads that read storage for the routes served on the event loop
+storage_threads = 8
+# Number of seconds to let requests in progress finish when shutting down, before the serial ports are closed
+graceful_shutdown_seconds = 10
+
+measurement_path = re.compile(r"^/measurements/(?P<measurement_id>[^/]+)$")
+measurement_events_path = re.compile(
+    r"^/measurements/(?P<measurement_id>[^/]+)/events$"
+)
+
+async_storage = AsyncStorage(max_threads=storage_threads)
+
+
+class FlaskBridge(WsgiToAsgi):
+    """
+    Serves the Flask app to the ASGI server with asgiref's WsgiToAsgi. On its own, WsgiToAsgi runs every request on the
+    one thread asgiref keeps for thread sensitive code, so only one Flask route would run at a time. Each request gets a
+    thread of its own instead, and at most `threads` run at once.
+    """
+
+    def __init__(self, wsgi_application, threads: int):
+        super().__init__(wsgi_application)
+        self._slots = asyncio.Semaphore(threads)
+
+    async def __call__(self, scope: dict, receive, send):
+        async with self._slots, ThreadSensitiveContext():
+            await super().__call__(scope, receive, send)
+
+
+async def read_body(receive) -> bytes:
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def send_json(send, status: int, data: dict):
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json")],
+        }
+    )
+    await send({"type": "http.response.body", "body": json.dumps(data).encode()})
+
+
+def query_parameters(scope: dict) -> dict[str, str]:
+    return dict(urllib.parse.parse_qsl(scope["query_string"].decode("latin1")))
+
+
+async def logged_in_user_id(scope: dict) -> int or None:
+    """
+    Returns the id of the user logged in with the request's session cookie, or None if they aren't logged in. The
+    cookie is opened by the Flask app's session interface and checked with app.drinker_context_for, like
+    app.login_required does.
+    """
+    flask_app = app_module.app
+    cookies = ";".join(
+        value.decode("latin1") for name, value in scope["headers"] if name == b"cookie"
+    )
+    request = flask_app.request_class({"HTTP_COOKIE": cookies})
+    login = flask_app.session_interface.open_session(flask_app, request)
+    if login is None:
+        return None
+    # Checking whether the token was logged out of, and loading the drinker if it isn't cached, read storage
+    context = await async_storage.run(app_module.drinker_context_for, login)
+    return None if context is None else context.user_id
+
+
+async def start_measurement(scope: dict, receive, send):
+    """
+    Starts a BAC measurement for the logged in user, like app.get_bac_from_potentiometre
+    """
+    await read_body(receive)
+    user_id = await logged_in_user_id(scope)
+    if user_id is None:
+        await send_json(send, 401, {"error": "Not logged in"})
+        return
+    station = query_parameters(scope).get("station")
+    if station is not None and station not in app_module.sensor_hub.stations:
+        await send_json(send, 404, {"error": f"Unknown station: {station}"})
+        return
+
+    job = app_module.start_measurement(user_id, station)
+    urls = app_module.app.url_map.bind("", script_name=scope.get("root_path") or None)
+    await send_json(
+        send,
+        202,
+        app_module.measurement_links(
+            job, build_url=lambda endpoint, **values: urls.build(endpoint, values)
+        ),
+    )
+
+
+async def measurement_status(scope: dict, send, job: MeasurementJob):
+    """
+    Returns the progress of a measurement as JSON, like app.measurement_status, waiting for it on the event loop
+    """
+    try:
+        wait = wait_seconds(
+            query_parameters(scope).get("wait"), app_module.max_measurement_wait
+        )
+    except ValueError:
+        await send_json(send, 400, {"error": "wait must be a number of seconds"})
+        return
+    if wait > 0:
+        await job.wait_async(timeout=wait)
+    await send_json(send, 200, job.to_dict())
+
+
+async def measurement_events(send, job: MeasurementJob):
+    """
+    Streams the progress of a measurement as server-sent events, like app.measurement_events
+    """
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream; charset=utf-8"),
+                (b"cache-control", b"no-cache"),
+            ],
+        }
+    )
+    while not await job.wait_async(timeout=0.5):
+        await send(
+            {
+                "type": "http.response.body",
+                "body": job.to_event(final=False).encode(),
+                "more_body": True,
+            }
+        )
+    await send(
+        {"type": "http.response.body", "body": job.to_event(final=True).encode()}
+    )
+
+
+async def serve_measurement_route(scope: dict, receive, send) -> str or None:
+    """
+    Serves the request if it is for one of the measurement routes, and returns the name of the route. Returns None
+    for any other request.
+    """
+    path, method = scope["path"], scope["method"]
+    if path == "/get_bac_from_potentiometer" and method == "POST":
+        await start_measurement(scope, receive, send)
+        return "get_bac_from_potentiometre"
+
+    for route, pattern in [
+        ("measurement_status", measurement_path),
+        ("measurement_events", measurement_events_path),
+    ]:
+        match = pattern.match(path)
+        if match is None or method != "GET":
+            continue
+        await read_body(receive)
+        user_id = await logged_in_user_id(scope)
+        if user_id is None:
+            await send_json(send, 401, {"error": "Not logged in"})
+            return route
+        job = app_module.measurement_jobs.get(match["measurement_id"], user_id=user_id)
+        if job is None:
+            await send_json(send, 404, {"error": "Unknown measurement"})
+        elif route == "measurement_status":
+            await measurement_status(scope, send, job)
+        else:
+            await measurement_events(send, job)
+        return route
+    return None
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            # The server has stopped taking requests and let the ones in progress finish
+            await asyncio.get_running_loop().run_in_executor(None, shutdown)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+def shutdown():
+    """
+    Closes the serial ports and storage, and stops the threads and processes the app started
+    """
+    app_module.shutdown()
+    async_storage.close()
+
+
+flask_bridge = FlaskBridge(app_module.app, threads=flask_threads)
+
+
+async def application(scope: dict, receive, send):
+    """
+    The ASGI application
+    """
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    started = time.perf_counter()
+    status = {}
+
+    async def send_and_record_status(message: dict):
+        if message["type"] == "http.response.start":
+            status["code"] = message["status"]
+        await send(message)
+
+    route = await serve_measurement_route(scope, receive, send_and_record_status)
+    if route is None:
+        # The Flask app records the metrics of its own routes
+        await flask_bridge(scope, receive, send)
+        return
+    metrics.request_seconds.observe(
+        time.perf_counter() - started, route, scope["method"]
+    )
+    metrics.requests.inc(route, scope["method"], str(status.get("code", 500)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves the app with uvicorn")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes. One process can wait on many measurements, as they are served "
+        "asynchronously, so more are only needed for the other routes.",
+    )
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        # Checked here, as the workers import the app themselves
+        if app_module.bac_measurement_method == "potentiometer":
+            parser.error(
+                "Only one process can open the sensor stations' serial ports, so use one worker with the potentiometer"
+            )
+        if not os.environ.get("BREATHALYZER_SECRET_KEY"):
+            parser.error(
+                "Set BREATHALYZER_SECRET_KEY, so that all workers accept the same session cookies"
+            )
+
+    logging.basicConfig(level=logging.INFO)
+    uvicorn.run(
+        "asgi:application",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        lifespan="on",
+        timeout_graceful_shutdown=graceful_shutdown_seconds,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+Benchmark for many users waiting on BAC measurements at once. Each client starts a measurement with
+/get_bac_from_potentiometer and then long polls /measurements/<id>?wait=30 until it is done, with the sensor hub
+reading from simulated serial devices. The same clients are run:
+
+- through Flask's test client, with a thread per client, as the WSGI server would need a thread per waiting request
+- through the ASGI app in asgi.py, called in-process from one event loop, where the waiting is done on the loop
+
+For each, the latency from starting a measurement to getting its result, the wall time and the most threads running
+at once are reported.
+
+Run from the project root with: python -m benchmarks.bench_async_measurements [number of clients] [stations]
+"""
+import asyncio
+import json
+import sys
+import tempfile
+import threading
+import time
+from typing import Callable
+
+from benchmarks.load_test import drive
+from benchmarks.load_test import log_in
+from benchmarks.load_test import summarize
+from benchmarks.synthetic_data import write_databases
+from pyscripts import repository
+from pyscripts.fake_serial import SimulatedSerialDevice
+from pyscripts.sensor_hub import SensorHub
+from pyscripts.storage import JsonStorage
+from pyscripts.storage import set_storage
+from pyscripts.unit_of_work import CountingStorage
+
+measurement_window = 0.05
+logged_in_users = 50
+
+
+class ThreadCounter:
+    """
+    Samples the number of running threads from a thread of its own, and keeps the highest
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self) -> "ThreadCounter":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.peak = max(self.peak, threading.active_count())
+
+
+async def call_asgi(
+    application: Callable, method: str, path: str, cookie: str
+) -> tuple[int, bytes]:
+    """
+    Makes one HTTP request to the ASGI app and returns the status and body of the response
+    """
+    path, _, query = path.partition("?")
+    scope = {
+        "type": "http",
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "root_path": "",
+        "query_string": query.encode(),
+        "headers": [(b"host", b"localhost"), (b"cookie", f"session={cookie}".encode())],
+        "client": ("127.0.0.1", 50000),
+        "server": ("localhost", 80),
+    }
+    response = {"body": b""}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message: dict):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        else:
+            response["body"] += message.get("body", b"")
+
+    await application(scope, receive, send)
+    return response["status"], response["body"]
+
+
+def run_threads(app_module, cookies: list[str]) -> tuple[dict, int]:
+    def measure(cookie: str):
+        def call(client):
+            client.set_cookie("session", cookie)
+            started = client.post("/get_bac_from_potentiometer")
+            if started.status_code != 202:
+                return started
+            return client.get(started.get_json()["status_url"] + "?wait=30")
+
+        return call
+
+    with ThreadCounter() as threads:
+        stats = drive(
+            app_module.app, [measure(cookie) for cookie in cookies], len(cookies)
+        )
+    return stats, threads.peak
+
+
+def run_async(asgi_module, cookies: list[str]) -> tuple[dict, int]:
+    async def measure(cookie: str) -> tuple[float, bool]:
+        started = time.perf_counter()
+        status, body = await call_asgi(
+            asgi_module.application, "POST", "/get_bac_from_potentiometer", cookie
+        )
+        if status == 202:
+            status_url = json.loads(body)["status_url"] + "?wait=30"
+            status, body = await call_asgi(
+                asgi_module.application, "GET", status_url, cookie
+            )
+            failed = json.loads(body)["status"] != "done"
+        else:
+            failed = True
+        return time.perf_counter() - started, failed
+
+    async def measure_all() -> list[tuple[float, bool]]:
+        return await asyncio.gather(*(measure(cookie) for cookie in cookies))
+
+    with ThreadCounter() as threads:
+        started = time.perf_counter()
+        results = asyncio.run(measure_all())
+        wall_seconds = time.perf_counter() - started
+    stats = summarize(
+        [latency for latency, _ in results],
+        wall_seconds,
+        errors=sum(failed for _, failed in results),
+    )
+    return stats, threads.peak
+
+
+def print_stats(name: str, stats: dict, peak_threads: int):
+    print(
+        f"{name:<28} p50 {stats['p50_ms']:8.1f} ms  p99 {stats['p99_ms']:8.1f} ms  "
+        f"wall {stats['calls'] / stats['throughput_per_second']:6.2f} s  "
+        f"{peak_threads:4} threads at most  {stats['errors']} failed"
+    )
+
+
+def main():
+    number_of_clients = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    number_of_stations = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+
+    # Imported here, as importing the app sets up its storage and sensor hub
+    import app as app_module
+    import asgi as asgi_module
+
+    devices = [
+        SimulatedSerialDevice(values=[1500, 2000, 2500], interval=0.01).start()
+        for _ in range(number_of_stations)
+    ]
+    with tempfile.TemporaryDirectory() as directory:
+        write_databases(directory, users=logged_in_users, beverages=10)
+        repository.database_directory = directory
+        set_storage(CountingStorage(JsonStorage()))
+        cookies = list(
+            log_in(app_module.app, list(range(1, logged_in_users + 1))).values()
+        )
+        cookies = [cookies[i % len(cookies)] for i in range(number_of_clients)]
+        print(
+            f"{number_of_clients} clients, {number_of_stations} stations, "
+            f"{measurement_window}s per measurement"
+        )
+
+        for name, run in [
+            ("thread per request (WSGI)", run_threads),
+            ("event loop (ASGI)", run_async),
+        ]:
+            app_module.sensor_hub = SensorHub(
+                {f"station-{i}": device.port_name for i, device in enumerate(devices)},
+                window=measurement_window,
+            )
+            try:
+                print_stats(
+                    name, *run(asgi_module if run is run_async else app_module, cookies)
+                )
+            finally:
+                app_module.sensor_hub.stop()
+
+    for device in devices:
+        device.stop()
+
+
+if __name__ == "__main__":
+    main()
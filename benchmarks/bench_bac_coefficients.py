@@ -0,0 +1,81 @@
+"""
+Microbenchmark for the per-drink BAC math. Compares the cost of scoring one drink (BAC after the drink plus seconds
+until the drinker can drive) when the coefficients are worked out on every call, as Drinker used to do, with the cost
+when they come from the drinker's cached BacCoefficients.
+
+Run from the project root with: python -m benchmarks.bench_bac_coefficients
+"""
+import math
+import timeit
+
+from pyscripts.objects import bac_increase_coefficients
+from pyscripts.objects import Drink
+from pyscripts.objects import Drinker
+from pyscripts.objects import legal_driving_limit
+from pyscripts.objects import metabolism_coefficients
+from pyscripts.objects import standard_drink_ml
+
+number_of_calls = 200_000
+
+
+def score_drink_without_cache(drinker: Drinker, drink: Drink, current_bac: float):
+    """
+    Scores a drink the way Drinker did before the coefficients were cached
+    """
+    sex = "male" if drinker.sex == "male" else "female"
+    a, b = bac_increase_coefficients[sex]
+    bac_after_drink = current_bac + (
+        a * math.exp(b * drinker.weight) * (drink.alcohol_content / standard_drink_ml)
+    )
+    if bac_after_drink <= legal_driving_limit:
+        return bac_after_drink, 0
+    a1, a2 = bac_increase_coefficients[sex]
+    b1, b2 = metabolism_coefficients[sex]
+    bac_increase_per_drink = a1 * math.exp(a2 * drinker.weight)
+    seconds_to_metabolize_one_drink = (b1 * math.exp(b2 * drinker.weight)) * 3600
+    bac_metabolized_per_second = (
+        1 / seconds_to_metabolize_one_drink
+    ) * bac_increase_per_drink
+    return (
+        bac_after_drink,
+        (bac_after_drink - legal_driving_limit) / bac_metabolized_per_second,
+    )
+
+
+def score_drink_with_cache(drinker: Drinker, drink: Drink, current_bac: float):
+    bac_after_drink = drinker.bac_after_drink(drink=drink, current_bac=current_bac)
+    return bac_after_drink, drinker.number_seconds_until_can_drive(bac_after_drink)
+
+
+def main():
+    drinker = Drinker(
+        id=1, username="bench", password="", dob=None, sex="male", weight=80
+    )
+    drink = Drink(
+        name="IPA",
+        type="Beer",
+        alcohol_content=21.45,
+        ingredients=(),
+        image_path="",
+        id=1,
+    )
+    current_bac = 0.04
+
+    before, after = [
+        min(
+            timeit.repeat(
+                lambda: score(drinker, drink, current_bac),
+                number=number_of_calls,
+                repeat=5,
+            )
+        )
+        / number_of_calls
+        for score in [score_drink_without_cache, score_drink_with_cache]
+    ]
+    print(f"Per-drink cost without coefficient cache: {before * 1e9:.0f} ns")
+    print(f"Per-drink cost with coefficient cache:    {after * 1e9:.0f} ns")
+    print(f"Speed-up: {before / after:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Benchmark for BacTimelines. Builds timelines for thousands of drinkers with hundreds of planned drinks each, then
+times the BAC curve on a one minute grid and the latest time each catalog drink can be had before the drive time.
+Compares the curve with a step-by-step simulation in plain Python for a few drinkers, which also checks that both
+give the same BAC.
+
+Run from the project root with: python -m benchmarks.bench_bac_timeline
+"""
+import time
+from datetime import datetime
+from datetime import timedelta
+
+import numpy as np
+
+from pyscripts.objects import get_bac_coefficients
+from pyscripts.objects import get_catalog
+from pyscripts.timeline import BacTimelines
+
+number_of_drinkers = 2_000
+drinks_per_drinker = 300
+session_hours = 12
+grid_step_seconds = 60
+simulated_drinkers = 20
+
+
+def make_timelines(rng: np.random.Generator) -> BacTimelines:
+    sexes = rng.choice(["male", "female"], number_of_drinkers)
+    weights = rng.integers(50, 120, number_of_drinkers)
+    coefficients = [
+        get_bac_coefficients(str(sex), int(weight))
+        for sex, weight in zip(sexes, weights)
+    ]
+    start_times = np.full(number_of_drinkers, datetime.now().timestamp())
+    return BacTimelines(
+        bac_per_standard_drink=[c.bac_per_standard_drink for c in coefficients],
+        bac_metabolized_per_second=[c.bac_metabolized_per_second for c in coefficients],
+        start_times=start_times,
+        drink_times=start_times[:, np.newaxis]
+        + rng.uniform(
+            0, session_hours * 3600, (number_of_drinkers, drinks_per_drinker)
+        ),
+        # Mostly sips, so the BAC goes up and down over the session
+        alcohol_contents=rng.exponential(1.0, (number_of_drinkers, drinks_per_drinker)),
+    )
+
+
+def simulate(timelines: BacTimelines, row: int, times: np.ndarray) -> list[float]:
+    """
+    Steps through the drinker's drinks and the grid in time order, one sample at a time
+    """
+    rate = timelines.rate[row]
+    drink_times = timelines.drink_times[row] + timelines.start_times[row]
+    jumps = timelines.jumps[row]
+    bacs = []
+    bac = timelines.initial_bacs[row]
+    last_time = timelines.start_times[row]
+    next_drink = 0
+    for sample_time in times:
+        while next_drink < len(drink_times) and drink_times[next_drink] <= sample_time:
+            bac = max(bac - rate * (drink_times[next_drink] - last_time), 0)
+            bac += jumps[next_drink]
+            last_time = drink_times[next_drink]
+            next_drink += 1
+        bac = max(bac - rate * (sample_time - last_time), 0)
+        last_time = sample_time
+        bacs.append(bac)
+    return bacs
+
+
+def main():
+    rng = np.random.default_rng(0)
+    timelines = make_timelines(rng)
+    end_time = datetime.now() + timedelta(hours=session_hours)
+    print(
+        f"{number_of_drinkers:,} drinkers with {drinks_per_drinker} drinks each, "
+        f"{session_hours} hours at one sample every {grid_step_seconds} seconds"
+    )
+
+    started = time.perf_counter()
+    times, bacs = timelines.bac_curve(end_time, step_seconds=grid_step_seconds)
+    curve_seconds = time.perf_counter() - started
+    print(
+        f"BAC curves, vectorized: {curve_seconds * 1e3:8.1f} ms "
+        f"({bacs.size / curve_seconds / 1e6:.1f}M samples/s)"
+    )
+
+    started = time.perf_counter()
+    simulated = [simulate(timelines, row, times) for row in range(simulated_drinkers)]
+    simulate_seconds = (time.perf_counter() - started) / simulated_drinkers
+    print(
+        f"BAC curves, simulated:  {simulate_seconds * number_of_drinkers * 1e3:8.1f} ms "
+        f"(estimated from {simulated_drinkers} drinkers)"
+    )
+    difference = np.abs(np.array(simulated) - bacs[:simulated_drinkers]).max()
+    print(f"Largest difference between the two: {difference:.2e}")
+
+    drinks = list(get_catalog().drinks)
+    drive_times = np.full(
+        number_of_drinkers, (end_time + timedelta(hours=2)).timestamp()
+    )
+    started = time.perf_counter()
+    latest = timelines.latest_drink_times(
+        [drink.alcohol_content for drink in drinks], drive_times
+    )
+    latest_seconds = time.perf_counter() - started
+    print(
+        f"Latest time for each of {len(drinks)} drinks: {latest_seconds * 1e3:.1f} ms, "
+        f"{np.mean(~np.isnan(latest)):.0%} of (drinker, drink) pairs can still drive"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Benchmark for the drink log. Logs drinks to one session and times logging a drink and estimating the BAC as the log
+grows, against estimating the BAC by replaying the whole log. Uses a temporary copy of the databases.
+
+Run from the project root with: python -m benchmarks.bench_drink_log
+"""
+
+import itertools
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime
+from datetime import timedelta
+
+from pyscripts import repository
+from pyscripts.objects import Drinker
+from pyscripts.objects import get_catalog
+from pyscripts.objects import Session
+from pyscripts.objects import standard_drink_ml
+from pyscripts.storage import get_storage
+from pyscripts.storage import JsonStorage
+from pyscripts.storage import set_storage
+
+log_lengths = [10, 100, 1000, 5000]
+repeats = 20
+
+
+def replay_log(drinker: Drinker, session: Session, at: datetime) -> float:
+    """
+    Estimates the BAC by going through every entry in the log, the way it would be done without the running estimate
+    """
+    rate = drinker.coefficients.bac_metabolized_per_second
+    bac = 0.0
+    last_time = None
+    for entry in get_storage().get_drink_log(session.id):
+        entry_time = datetime.fromisoformat(entry["time"])
+        if last_time is not None:
+            bac = max(bac - rate * (entry_time - last_time).total_seconds(), 0)
+        if entry["kind"] == "measurement":
+            bac = entry["bac"]
+        else:
+            bac += (
+                drinker.coefficients.bac_per_standard_drink
+                * entry["alcohol_content"]
+                / standard_drink_ml
+            )
+        last_time = entry_time
+    return max(bac - rate * (at - last_time).total_seconds(), 0)
+
+
+def best_time(function) -> float:
+    times = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        shutil.copy(
+            os.path.join(repository.database_directory, "beverages.json"), directory
+        )
+        repository.database_directory = directory
+        set_storage(JsonStorage())
+
+        drinker = Drinker(
+            username="benchmark", password="", dob=None, sex="female", weight=70, id=1
+        )
+        started_at = datetime.now() - timedelta(days=1)
+        session = Session(
+            user_id=1, start_time=started_at, max_alcohol=0.25, drive_time=None, id=1
+        )
+        drink = get_catalog().drinks[0]
+
+        # Spread the drinks over the day, so the estimate goes up and down
+        drink_times = (
+            started_at + timedelta(seconds=15 * count) for count in itertools.count()
+        )
+
+        print(f"{'Log length':>10} {'Log a drink':>12} {'Estimate':>12} {'Replay':>12}")
+        for log_length in log_lengths:
+            while len(get_storage().get_drink_log(session.id)) < log_length:
+                session.log_drink(drinker, drink, time=next(drink_times))
+            log_seconds = best_time(
+                lambda: session.log_drink(drinker, drink, time=next(drink_times))
+            )
+            now = datetime.now()
+            estimate_seconds = best_time(lambda: session.estimate_bac(drinker, now))
+            replay_seconds = best_time(lambda: replay_log(drinker, session, now))
+            assert (
+                abs(
+                    session.estimate_bac(drinker, now)
+                    - replay_log(drinker, session, now)
+                )
+                < 1e-9
+            )
+            print(
+                f"{log_length:>10} {log_seconds * 1e3:>10.3f}ms {estimate_seconds * 1e6:>10.1f}us "
+                f"{replay_seconds * 1e3:>10.3f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
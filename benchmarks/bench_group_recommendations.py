@@ -0,0 +1,116 @@
+"""
+Benchmark for group recommendations. Compares recommending drinks for a group of N drinkers with N separate
+lookups (drinker, current session and candidate drinks, each in its own unit of work like separate page views) with
+one call to recommend_for_group. Uses a temporary copy of the databases with randomly generated drinkers.
+
+Run from the project root with: python -m benchmarks.bench_group_recommendations
+"""
+
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime
+from datetime import timedelta
+
+from pyscripts import repository
+from pyscripts.engine import recommend_for_group
+from pyscripts.objects import Drinker
+from pyscripts.objects import get_drink_candidates_for_drive_time
+from pyscripts.objects import get_drink_candidates_less_than_max_alcohol
+from pyscripts.objects import Session
+from pyscripts.storage import get_storage
+from pyscripts.storage import JsonStorage
+from pyscripts.storage import set_storage
+from pyscripts.unit_of_work import begin_unit_of_work
+from pyscripts.unit_of_work import end_unit_of_work
+
+group_sizes = [1, 10, 100, 1000]
+repeats = 5
+
+
+def create_drinkers(count: int):
+    """
+    Saves `count` drinkers, each with a session that started an hour ago
+    """
+    rng = random.Random(0)
+    storage = get_storage()
+    for user_id in range(1, count + 1):
+        storage.add_user(
+            user_id,
+            {
+                "username": f"drinker{user_id}",
+                "password": "",
+                "dob": "1990-01-01T00:00:00",
+                "sex": rng.choice(["male", "female"]),
+                "weight": str(rng.randrange(50, 120)),
+            },
+        )
+        drive_time = datetime.now() + timedelta(hours=rng.randrange(1, 8))
+        storage.add_session(
+            user_id,
+            {
+                "user_id": user_id,
+                "max_alcohol": rng.choice(list(Session.qualitative_to_bac.values())),
+                "start_time": (datetime.now() - timedelta(hours=1)).isoformat(),
+                "drive_time": drive_time.isoformat() if rng.random() < 0.5 else None,
+            },
+        )
+
+
+def recommend_one_by_one(drinker_bacs: list[tuple[int, float]]):
+    for user_id, current_bac in drinker_bacs:
+        _, token = begin_unit_of_work()
+        drinker = Drinker.get_drinker_from_db(user_id=user_id)
+        current_session = drinker.get_current_session()
+        if current_session.drive_time:
+            get_drink_candidates_for_drive_time(drinker, current_bac, current_session)
+        else:
+            get_drink_candidates_less_than_max_alcohol(
+                drinker, current_bac, current_session
+            )
+        end_unit_of_work(token)
+
+
+def recommend_together(drinker_bacs: list[tuple[int, float]]):
+    _, token = begin_unit_of_work()
+    recommend_for_group(drinker_bacs)
+    end_unit_of_work(token)
+
+
+def best_time(recommend, drinker_bacs: list[tuple[int, float]]) -> float:
+    times = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        recommend(drinker_bacs)
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        shutil.copy(
+            os.path.join(repository.database_directory, "beverages.json"), directory
+        )
+        repository.database_directory = directory
+        set_storage(JsonStorage())
+        create_drinkers(max(group_sizes))
+
+        rng = random.Random(1)
+        print(f"{'Group size':>10} {'One by one':>12} {'Together':>12} {'Speed-up':>9}")
+        for group_size in group_sizes:
+            drinker_bacs = [
+                (user_id, rng.uniform(0, 0.08))
+                for user_id in rng.sample(range(1, max(group_sizes) + 1), group_size)
+            ]
+            one_by_one = best_time(recommend_one_by_one, drinker_bacs)
+            together = best_time(recommend_together, drinker_bacs)
+            print(
+                f"{group_size:>10} {one_by_one * 1e3:>10.2f}ms {together * 1e3:>10.2f}ms "
+                f"{one_by_one / together:>8.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
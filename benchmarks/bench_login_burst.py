@@ -0,0 +1,124 @@
+"""
+Benchmark for logins under a burst. Generates users with plain text passwords (as the databases used to have), then
+sends bursts of concurrent logins to /login through Flask's test client and reports the latency and throughput of:
+
+- the first login of each user, which checks the plain text password and replaces it with a scrypt hash
+- logging in again, which checks the hash, with hashing on the request threads and in the process pool
+- logging in again within the cache TTL, which doesn't hash at all
+- the account page, requested while the logins that hash are running, to see whether they hold up other requests
+- a burst of wrong passwords for one username, which is throttled after the first few
+
+Run from the project root with: python -m benchmarks.bench_login_burst [number of users] [concurrency]
+"""
+
+import concurrent.futures
+import os
+import sys
+import tempfile
+
+from benchmarks.load_test import drive
+from benchmarks.load_test import log_in
+from benchmarks.synthetic_data import address_for
+from benchmarks.synthetic_data import password_for
+from benchmarks.synthetic_data import username_for
+from benchmarks.synthetic_data import write_databases
+from pyscripts import repository
+from pyscripts.auth import Authenticator
+from pyscripts.storage import JsonStorage
+from pyscripts.storage import set_storage
+from pyscripts.unit_of_work import CountingStorage
+
+wrong_password_attempts = 200
+
+
+def login_calls(number_of_users: int, password=password_for) -> list:
+    def login(user_id: int):
+        return lambda client: client.post(
+            "/login",
+            data={"username": username_for(user_id), "password": password(user_id)},
+            environ_base={"REMOTE_ADDR": address_for(user_id)},
+        )
+
+    return [login(user_id) for user_id in range(1, number_of_users + 1)]
+
+
+def account_calls(cookie: str, count: int) -> list:
+    def account(client):
+        client.set_cookie("session", cookie)
+        return client.get("/account")
+
+    return [account] * count
+
+
+def drive_with_logins(app, number_of_users: int, concurrency: int) -> tuple:
+    """
+    Logs every user in, and while that is running requests a logged in user's account page from one more thread.
+    Returns the stats of the logins and of the account pages.
+    """
+    cookie = log_in(app, [1])[1]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        logins = executor.submit(drive, app, login_calls(number_of_users), concurrency)
+        accounts = drive(app, account_calls(cookie, number_of_users), 1)
+        return logins.result(), accounts
+
+
+def print_stats(name: str, stats: dict):
+    print(
+        f"{name:<32} p50 {stats['p50_ms']:8.1f} ms  p99 {stats['p99_ms']:8.1f} ms  "
+        f"{stats['throughput_per_second']:8.1f} per second  {stats['errors']} refused"
+    )
+
+
+def main():
+    number_of_users = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    workers = os.cpu_count()
+
+    # Imported here, as importing the app sets up its storage and sensor hub
+    import app as app_module
+
+    with tempfile.TemporaryDirectory() as directory:
+        write_databases(directory, users=number_of_users, beverages=10)
+        repository.database_directory = directory
+        set_storage(CountingStorage(JsonStorage()))
+        print(
+            f"{number_of_users} users, {concurrency} at once, {workers} hashing processes"
+        )
+
+        pool = Authenticator(workers=workers)
+        app_module.authenticator = pool
+        print_stats(
+            "first login (migrates to hash)",
+            drive(app_module.app, login_calls(number_of_users), concurrency),
+        )
+        print_stats(
+            "login again, cached",
+            drive(app_module.app, login_calls(number_of_users), concurrency),
+        )
+
+        # New authenticators, so nothing is cached and no attempts have been counted
+        pool.close()
+        app_module.authenticator = Authenticator(workers=0)
+        logins, accounts = drive_with_logins(
+            app_module.app, number_of_users, concurrency
+        )
+        print_stats("login, hashing on request thread", logins)
+        print_stats("  account page meanwhile", accounts)
+        app_module.authenticator = pool = Authenticator(workers=workers)
+        logins, accounts = drive_with_logins(
+            app_module.app, number_of_users, concurrency
+        )
+        print_stats("login, hashing in process pool", logins)
+        print_stats("  account page meanwhile", accounts)
+
+        # Every attempt is for user 1
+        wrong_password = login_calls(1, password=lambda user_id: "wrong")[0]
+        stats = drive(
+            app_module.app, [wrong_password] * wrong_password_attempts, concurrency
+        )
+        print_stats(f"{wrong_password_attempts} wrong passwords, 1 user", stats)
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()
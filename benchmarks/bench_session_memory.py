@@ -0,0 +1,141 @@
+"""
+Memory benchmark for holding every session in memory. Compares the session records as loaded from the JSON database,
+Session objects as they were before they had __slots__ (with a __dict__ and their own bac_to_qualitative dict),
+slotted Session objects, and the JSON sessions table with its indexes. Also times finding a user's latest session by
+scanning Session objects against the sessions table's latest_id_by_user index, which answers it without building a
+Session for every row.
+
+Run from the project root with: python -m benchmarks.bench_session_memory [number of sessions]
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from datetime import timedelta
+
+from pyscripts import repository
+from pyscripts.objects import Session
+from pyscripts.repository import SessionsTable
+
+number_of_sessions = 1_000_000
+number_of_users = 50_000
+
+
+class SessionWithDict:
+    """
+    A session laid out the way Session was before it had __slots__
+    """
+
+    def __init__(self, user_id, start_time, max_alcohol=None, drive_time=None, id=None):
+        self.id = id
+        self.user_id = user_id
+        self.max_alcohol = max_alcohol
+        self.start_time = start_time
+        self.drive_time = drive_time
+        self.bac_to_qualitative = {v: k for k, v in Session.qualitative_to_bac.items()}
+
+
+def make_records(count: int) -> dict[str, dict]:
+    """
+    Returns random session records in the format of the sessions database
+    """
+    rng = random.Random(0)
+    first_start_time = datetime(2023, 1, 1)
+    records = {}
+    for session_id in range(1, count + 1):
+        start_time = first_start_time + timedelta(seconds=rng.randrange(30_000_000))
+        drive_time = start_time + timedelta(hours=rng.randrange(1, 12))
+        records[str(session_id)] = {
+            "user_id": rng.randrange(1, number_of_users + 1),
+            "max_alcohol": rng.choice(list(Session.qualitative_to_bac.values())),
+            "start_time": start_time.isoformat(),
+            "drive_time": drive_time.isoformat() if rng.random() < 0.5 else None,
+        }
+    return records
+
+
+def make_session(session_class, session_id: str, record: dict):
+    drive_time = record["drive_time"]
+    return session_class(
+        id=int(session_id),
+        user_id=int(record["user_id"]),
+        max_alcohol=float(record["max_alcohol"]),
+        start_time=datetime.fromisoformat(record["start_time"]),
+        drive_time=datetime.fromisoformat(drive_time) if drive_time else None,
+    )
+
+
+def measure(build) -> tuple[object, int]:
+    """
+    Returns what build() returns and the number of bytes it allocated
+    """
+    tracemalloc.start()
+    result = build()
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, allocated
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else number_of_sessions
+    print(f"Generating {count:,} session records")
+    _, records_bytes = measure(lambda: make_records(count))
+    records = make_records(count)
+
+    results = {"JSON records (dicts of strings)": records_bytes}
+    for name, session_class in [
+        ("Session objects with __dict__", SessionWithDict),
+        ("Session objects with __slots__", Session),
+    ]:
+        sessions, results[name] = measure(
+            lambda: [
+                make_session(session_class, session_id, record)
+                for session_id, record in records.items()
+            ]
+        )
+        del sessions
+
+    with tempfile.TemporaryDirectory() as directory:
+        repository.database_directory = directory
+        with open(os.path.join(directory, "sessions.json"), "w") as outfile:
+            json.dump(records, outfile)
+        table = SessionsTable("sessions.json")
+        _, results["Sessions table with indexes"] = measure(table.refresh)
+
+        for name, allocated in results.items():
+            print(
+                f"{name:<32} {allocated / 2**20:8.1f} MiB  {allocated / count:6.0f} bytes/session"
+            )
+
+        # Find the latest session of some users, the way get_all_session_objects_from_db was used to, and with the
+        # sessions table's index
+        sessions = [
+            make_session(Session, session_id, record)
+            for session_id, record in records.items()
+        ]
+        user_ids = [record["user_id"] for record in list(records.values())[:10]]
+        started = time.perf_counter()
+        for user_id in user_ids:
+            max(
+                (session for session in sessions if session.user_id == user_id),
+                key=lambda session: session.start_time,
+            )
+        scan_seconds = (time.perf_counter() - started) / len(user_ids)
+        started = time.perf_counter()
+        for user_id in user_ids:
+            table.get_latest_for_user(user_id)
+        index_seconds = (time.perf_counter() - started) / len(user_ids)
+        print(
+            f"Latest session for a user, scanning Session objects: {scan_seconds * 1e3:.1f} ms"
+        )
+        print(
+            f"Latest session for a user, sessions table index:     {index_seconds * 1e6:.1f} us"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,448 @@
+"""
+Load test for the Flask routes and microbenchmarks for the hot paths in pyscripts/objects.py. For each database size,
+synthetic databases are generated in a temporary directory (see benchmarks/synthetic_data.py), and then:
+
+- /login, /account, /create_new_session and /recommendation/<bac> are called through Flask's test client
+  from several threads at once, and the p50/p99 latency and throughput of each route are measured
+- BAC measurements are started and waited for through /get_bac_from_potentiometer, with the sensor hub reading from
+  simulated serial devices, so no hardware (or network) is needed
+- get_current_session, get_all_drinks_from_db and the candidate functions are timed on their own
+
+The results are written as JSON. Pass the JSON of an earlier run with --compare to see what got slower; the exit code
+is 1 if any p50 or p99 latency got slower by more than --threshold. Pass --no-metrics to turn off the instrumentation
+served on /metrics, e.g. to compare against a run with it on and see what it costs.
+
+Run from the project root with: python -m benchmarks.load_test [--sizes 1000 100000 1000000] [--output results.json]
+"""
+
+import argparse
+import concurrent.futures
+import json
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from datetime import timedelta
+from typing import Callable
+
+import numpy as np
+
+from benchmarks.synthetic_data import address_for
+from benchmarks.synthetic_data import password_for
+from benchmarks.synthetic_data import username_for
+from benchmarks.synthetic_data import write_databases
+from pyscripts import repository
+from pyscripts.fake_serial import SimulatedSerialDevice
+from pyscripts.migrate_json_to_sqlite import migrate
+from pyscripts.objects import Drinker
+from pyscripts.objects import get_all_drinks_from_db
+from pyscripts.objects import get_catalog
+from pyscripts.objects import get_drink_candidates_for_drive_time
+from pyscripts.objects import get_drink_candidates_less_than_max_alcohol
+from pyscripts.objects import Session
+from pyscripts.sensor_hub import SensorHub
+from pyscripts.storage import create_storage
+from pyscripts.storage import JsonStorage
+from pyscripts.storage import set_storage
+from pyscripts.unit_of_work import begin_unit_of_work
+from pyscripts.unit_of_work import CountingStorage
+from pyscripts.unit_of_work import end_unit_of_work
+
+default_sizes = [1_000, 100_000, 1_000_000]
+# A bar's menu doesn't have a million drinks, so the catalog stops growing here unless --max-beverages says otherwise
+default_max_beverages = 10_000
+requests_per_route = 500
+concurrency = 8
+microbenchmark_calls = 500
+# Users logged in before the routes are timed. The routes that need a login are called as one of them.
+logged_in_users = 50
+# Simulated breathalyzer stations, and how long each measurement reads the sensor for
+number_of_stations = 2
+measurement_window = 0.2
+measurements = 20
+
+
+def summarize(latencies: list[float], wall_seconds: float, errors: int = 0) -> dict:
+    """
+    Returns the latency percentiles (in milliseconds) and throughput of a batch of calls
+    """
+    latencies_ms = np.array(latencies) * 1e3
+    return {
+        "calls": len(latencies),
+        "errors": errors,
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "mean_ms": float(latencies_ms.mean()),
+        "max_ms": float(latencies_ms.max()),
+        "throughput_per_second": len(latencies) / wall_seconds,
+    }
+
+
+def drive(app, calls: list[Callable], threads: int) -> dict:
+    """
+    Makes the calls from `threads` threads at once, each with its own test client, and returns their latencies and the
+    throughput. Each call takes a test client and returns a response. Responses with an error status count as errors.
+    """
+    local = threading.local()
+
+    def timed(call: Callable) -> tuple[float, bool]:
+        if not hasattr(local, "client"):
+            local.client = app.test_client()
+        started = time.perf_counter()
+        response = call(local.client)
+        return time.perf_counter() - started, response.status_code >= 400
+
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(timed, calls))
+    wall_seconds = time.perf_counter() - started
+    return summarize(
+        [latency for latency, _ in results],
+        wall_seconds,
+        errors=sum(failed for _, failed in results),
+    )
+
+
+def log_in(app, user_ids: list[int]) -> dict[int, str]:
+    """
+    Logs the users in and returns their session cookies, keyed by user id
+    """
+    client = app.test_client()
+    cookies = {}
+    for user_id in user_ids:
+        client.post(
+            "/login",
+            data={
+                "username": username_for(user_id),
+                "password": password_for(user_id),
+            },
+            environ_base={"REMOTE_ADDR": address_for(user_id)},
+        )
+        cookies[user_id] = client.get_cookie("session").value
+    return cookies
+
+
+def route_calls(
+    number_of_users: int, cookies: dict[int, str], count: int, rng: random.Random
+) -> dict:
+    """
+    Returns `count` calls per route. /login is called for random users, and the other routes for random users from
+    `cookies`, who are logged in. The arguments are picked up front, so only the requests are timed.
+    """
+
+    def login(user_id: int):
+        # Each user logs in from their own address, so the per-address login throttling doesn't kick in
+        return lambda client: client.post(
+            "/login",
+            data={
+                "username": username_for(user_id),
+                "password": password_for(user_id),
+            },
+            environ_base={"REMOTE_ADDR": address_for(user_id)},
+        )
+
+    def as_user(user_id: int, call: Callable):
+        def call_as_user(client):
+            client.set_cookie("session", cookies[user_id])
+            return call(client)
+
+        return call_as_user
+
+    def account(user_id: int):
+        return as_user(user_id, lambda client: client.get("/account"))
+
+    def create_new_session(user_id: int):
+        return as_user(
+            user_id,
+            lambda client: client.post(
+                "/create_new_session",
+                data={"max_alcohol": "Drunk", "drive_time": ""},
+            ),
+        )
+
+    def recommendation(user_id: int, current_bac: float):
+        return as_user(
+            user_id, lambda client: client.get(f"/recommendation/{current_bac}")
+        )
+
+    def user_ids():
+        return [rng.randrange(1, number_of_users + 1) for _ in range(count)]
+
+    def logged_in_user_ids():
+        return rng.choices(list(cookies), k=count)
+
+    return {
+        "login": [login(user_id) for user_id in user_ids()],
+        "account": [account(user_id) for user_id in logged_in_user_ids()],
+        "recommendation": [
+            recommendation(user_id, round(rng.uniform(0, 0.08), 3))
+            for user_id in logged_in_user_ids()
+        ],
+        # Last, as it starts new sessions
+        "create_new_session": [
+            create_new_session(user_id) for user_id in logged_in_user_ids()
+        ],
+    }
+
+
+def measure_with_simulated_sensor(app_module, cookies: dict[int, str]) -> dict:
+    """
+    Starts BAC measurements through /get_bac_from_potentiometer and waits for each of them to finish, with the sensor
+    hub reading from simulated serial devices. Returns the latency from starting a measurement to getting its result.
+    """
+    devices = [
+        SimulatedSerialDevice(values=[1500, 2000, 2500], interval=0.01).start()
+        for _ in range(number_of_stations)
+    ]
+    previous_hub = app_module.sensor_hub
+    app_module.sensor_hub = SensorHub(
+        {f"station-{i}": device.port_name for i, device in enumerate(devices)},
+        window=measurement_window,
+    )
+    rng = random.Random(2)
+
+    def measure(client):
+        client.set_cookie("session", cookies[rng.choice(list(cookies))])
+        started = client.post("/get_bac_from_potentiometer")
+        if started.status_code != 202:
+            return started
+        return client.get(started.get_json()["status_url"] + "?wait=30")
+
+    try:
+        return drive(
+            app_module.app,
+            [measure] * measurements,
+            threads=number_of_stations * 2,
+        )
+    finally:
+        app_module.sensor_hub.stop()
+        app_module.sensor_hub = previous_hub
+        for device in devices:
+            device.stop()
+
+
+def microbenchmark(function: Callable, calls: int) -> dict:
+    """
+    Times `calls` calls of the function, each in its own unit of work like a request would be
+    """
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(calls):
+        call_started = time.perf_counter()
+        _, token = begin_unit_of_work()
+        function()
+        end_unit_of_work(token)
+        latencies.append(time.perf_counter() - call_started)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def run_microbenchmarks(number_of_users: int, calls: int) -> dict:
+    rng = random.Random(3)
+    drinkers = [
+        Drinker.get_drinker_from_db(user_id=rng.randrange(1, number_of_users + 1))
+        for _ in range(100)
+    ]
+    sessions = [drinker.get_current_session() for drinker in drinkers]
+    # The same sessions with a drive time, for get_drink_candidates_for_drive_time
+    sessions_with_drive_time = [
+        Session(
+            id=session.id,
+            user_id=session.user_id,
+            start_time=session.start_time,
+            max_alcohol=session.max_alcohol,
+            drive_time=datetime.now() + timedelta(hours=3),
+        )
+        for session in sessions
+    ]
+    # The candidate functions use the cached catalog, so load it before timing them
+    get_catalog()
+
+    def current_session():
+        rng.choice(drinkers).get_current_session()
+
+    def less_than_max_alcohol():
+        index = rng.randrange(len(drinkers))
+        get_drink_candidates_less_than_max_alcohol(
+            drinkers[index], rng.uniform(0, 0.08), current_session=sessions[index]
+        )
+
+    def for_drive_time():
+        index = rng.randrange(len(drinkers))
+        get_drink_candidates_for_drive_time(
+            drinkers[index],
+            rng.uniform(0, 0.08),
+            current_session=sessions_with_drive_time[index],
+        )
+
+    return {
+        "get_current_session": microbenchmark(current_session, calls),
+        "get_all_drinks_from_db": microbenchmark(
+            get_all_drinks_from_db, max(calls // 10, 1)
+        ),
+        "get_drink_candidates_less_than_max_alcohol": microbenchmark(
+            less_than_max_alcohol, calls
+        ),
+        "get_drink_candidates_for_drive_time": microbenchmark(for_drive_time, calls),
+    }
+
+
+def run_size(app_module, size: int, args: argparse.Namespace) -> dict:
+    """
+    Generates databases with `size` rows and runs the load test and microbenchmarks against them
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        started = time.perf_counter()
+        rows = write_databases(
+            directory, users=size, beverages=min(size, args.max_beverages)
+        )
+        generate_seconds = time.perf_counter() - started
+
+        repository.database_directory = directory
+        storage = JsonStorage()
+        if args.storage == "sqlite":
+            sqlite_storage = create_storage(
+                "sqlite", sqlite_path=f"{directory}/breathalyzer.sqlite3"
+            )
+            migrate(storage, sqlite_storage)
+            storage = sqlite_storage
+        set_storage(CountingStorage(storage))
+
+        # The first login reads the tables it needs
+        started = time.perf_counter()
+        cookies = log_in(app_module.app, [1])
+        cold_start_seconds = time.perf_counter() - started
+        cookies.update(
+            log_in(
+                app_module.app,
+                random.Random(3).sample(
+                    range(2, size + 1), min(size - 1, logged_in_users)
+                ),
+            )
+        )
+
+        calls = route_calls(size, cookies, args.requests, random.Random(1))
+        routes = {}
+        for route, calls_for_route in calls.items():
+            routes[route] = drive(app_module.app, calls_for_route, args.concurrency)
+            print_stats(route, routes[route])
+        routes["measurement"] = measure_with_simulated_sensor(app_module, cookies)
+        print_stats("measurement", routes["measurement"])
+
+        microbenchmarks = run_microbenchmarks(size, args.calls)
+        for name, stats in microbenchmarks.items():
+            print_stats(name, stats)
+        storage.close()
+
+    return {
+        "rows": rows,
+        "generate_seconds": generate_seconds,
+        "cold_start_seconds": cold_start_seconds,
+        "routes": routes,
+        "microbenchmarks": microbenchmarks,
+    }
+
+
+def print_stats(name: str, stats: dict):
+    """
+    Prints a line of stats as they come in. Goes to stderr, so that the results can be written to stdout.
+    """
+    print(
+        f"  {name:<44} p50 {stats['p50_ms']:9.3f} ms  p99 {stats['p99_ms']:9.3f} ms  "
+        f"{stats['throughput_per_second']:9.1f}/s  errors {stats['errors']}",
+        file=sys.stderr,
+    )
+
+
+def git_commit() -> str or None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """
+    Prints how each latency changed since the baseline run and returns the ones that got slower by more than
+    `threshold` (e.g. 0.2 for 20%)
+    """
+    regressions = []
+    for size, size_results in results["sizes"].items():
+        baseline_size = baseline.get("sizes", {}).get(size)
+        if baseline_size is None:
+            continue
+        for group in ["routes", "microbenchmarks"]:
+            for name, stats in size_results[group].items():
+                baseline_stats = baseline_size.get(group, {}).get(name)
+                if baseline_stats is None:
+                    continue
+                for metric in ["p50_ms", "p99_ms"]:
+                    change = stats[metric] / baseline_stats[metric] - 1
+                    label = f"{size} {name} {metric}"
+                    print(f"{label:<60} {change:+7.1%}", file=sys.stderr)
+                    if change > threshold:
+                        regressions.append(label)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=default_sizes)
+    parser.add_argument("--max-beverages", type=int, default=default_max_beverages)
+    parser.add_argument("--storage", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--requests", type=int, default=requests_per_route)
+    parser.add_argument("--concurrency", type=int, default=concurrency)
+    parser.add_argument("--calls", type=int, default=microbenchmark_calls)
+    parser.add_argument("--output", help="Where to write the results (default stdout)")
+    parser.add_argument("--compare", help="Results of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--no-metrics", action="store_true")
+    args = parser.parse_args()
+
+    # Imported here, as importing the app sets up its storage and sensor hub
+    import app as app_module
+
+    app_module.metrics.registry.enabled = not args.no_metrics
+
+    results = {
+        "meta": {
+            "started_at": datetime.now().isoformat(),
+            "git_commit": git_commit(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "storage": args.storage,
+            "requests_per_route": args.requests,
+            "concurrency": args.concurrency,
+            "metrics": not args.no_metrics,
+        },
+        "sizes": {},
+    }
+    for size in args.sizes:
+        print(f"{size:,} rows", file=sys.stderr)
+        results["sizes"][str(size)] = run_size(app_module, size, args)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as outfile:
+            outfile.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as infile:
+            regressions = compare(results, json.load(infile), args.threshold)
+        if regressions:
+            print(
+                f"{len(regressions)} regressions over {args.threshold:.0%}",
+                file=sys.stderr,
+            )
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
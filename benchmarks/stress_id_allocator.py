@@ -0,0 +1,69 @@
+"""
+Stress test for the id allocator: many processes, each with many threads, allocate ids from the same counter file at
+the same time. Fails if any id is handed out twice.
+
+Run from the project root with: python -m benchmarks.stress_id_allocator
+"""
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from pyscripts.ids import IdAllocator
+
+number_of_processes = 8
+threads_per_process = 16
+ids_per_thread = 500
+
+
+def allocate_ids(counter_path: str, results: multiprocessing.Queue):
+    """
+    Allocates ids from several threads and puts all of them on the results queue
+    """
+    allocator = IdAllocator(counter_path, seed=lambda: 0)
+    ids_per_thread_list = [[] for _ in range(threads_per_process)]
+
+    def worker(ids: list):
+        for _ in range(ids_per_thread):
+            ids.append(allocator.next_id())
+
+    threads = [
+        threading.Thread(target=worker, args=(ids,)) for ids in ids_per_thread_list
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put([new_id for ids in ids_per_thread_list for new_id in ids])
+
+
+def main() -> int:
+    counter_path = os.path.join(tempfile.mkdtemp(), "stress.id_counter")
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=allocate_ids, args=(counter_path, results))
+        for _ in range(number_of_processes)
+    ]
+
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    # Drain the queue before joining, otherwise a process can block on a full queue
+    all_ids = [new_id for _ in processes for new_id in results.get()]
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+
+    expected = number_of_processes * threads_per_process * ids_per_thread
+    duplicates = len(all_ids) - len(set(all_ids))
+    print(
+        f"Allocated {len(all_ids)} ids (expected {expected}) in {elapsed:.2f}s "
+        f"from {number_of_processes} processes x {threads_per_process} threads, {duplicates} duplicates"
+    )
+    return 0 if duplicates == 0 and len(all_ids) == expected else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
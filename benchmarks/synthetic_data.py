@@ -0,0 +1,127 @@
+"""
+Generates synthetic users.json, sessions.json and beverages.json files in the format of the databases directory, for
+benchmarks and load tests. Every user has one session that started within the last day, so every user has a current
+session.
+
+Run from the project root with: python -m benchmarks.synthetic_data <directory> [number of rows]
+"""
+
+import json
+import os
+import random
+import sys
+from datetime import datetime
+from datetime import timedelta
+
+from pyscripts.objects import Session
+
+beverage_types = {
+    "Beer": (10, 25),
+    "Wine": (15, 25),
+    "Cocktail": (15, 45),
+    "Spirit": (10, 20),
+    "Cider": (10, 20),
+}
+ingredients = ["Ice", "Lime juice", "Soda water", "Tonic water", "Mint", "Sugar"]
+
+
+def password_for(user_id: int) -> str:
+    """
+    Returns the password of a generated user
+    """
+    return f"password{user_id}"
+
+
+def address_for(user_id: int) -> str:
+    """
+    Returns the IP address a generated user makes requests from
+    """
+    return f"10.{user_id >> 16 & 255}.{user_id >> 8 & 255}.{user_id & 255}"
+
+
+def username_for(user_id: int) -> str:
+    """
+    Returns the username of a generated user
+    """
+    return f"drinker{user_id}"
+
+
+def make_users(count: int, rng: random.Random) -> dict[str, dict]:
+    return {
+        str(user_id): {
+            "username": username_for(user_id),
+            "password": password_for(user_id),
+            "dob": datetime(
+                rng.randrange(1960, 2004), rng.randrange(1, 13), rng.randrange(1, 29)
+            ).isoformat(),
+            "sex": rng.choice(["male", "female"]),
+            "weight": str(rng.randrange(50, 120)),
+        }
+        for user_id in range(1, count + 1)
+    }
+
+
+def make_sessions(
+    count: int, number_of_users: int, rng: random.Random
+) -> dict[str, dict]:
+    """
+    Returns `count` sessions. Session i belongs to user i, so with as many sessions as users, every user has one.
+    """
+    now = datetime.now()
+    max_alcohols = list(Session.qualitative_to_bac.values())
+    sessions = {}
+    for session_id in range(1, count + 1):
+        start_time = now - timedelta(seconds=rng.randrange(60, 20 * 3600))
+        drive_time = now + timedelta(seconds=rng.randrange(3600, 12 * 3600))
+        sessions[str(session_id)] = {
+            "user_id": (session_id - 1) % number_of_users + 1,
+            "max_alcohol": rng.choice(max_alcohols),
+            "start_time": start_time.isoformat(),
+            "drive_time": drive_time.isoformat() if rng.random() < 0.5 else None,
+        }
+    return sessions
+
+
+def make_beverages(count: int, rng: random.Random) -> dict[str, dict]:
+    beverages = {}
+    for beverage_id in range(1, count + 1):
+        beverage_type = rng.choice(list(beverage_types))
+        low, high = beverage_types[beverage_type]
+        beverages[str(beverage_id)] = {
+            "name": f"{beverage_type} {beverage_id}",
+            "type": beverage_type,
+            "alcohol_content": str(round(rng.uniform(low, high), 1)),
+            "ingredients": rng.sample(ingredients, 2),
+            "image_path": f"/static/images/{beverage_type.lower()}.jpg",
+        }
+    return beverages
+
+
+def write_databases(
+    directory: str,
+    users: int,
+    sessions: int = None,
+    beverages: int = None,
+    seed: int = 0,
+) -> dict[str, int]:
+    """
+    Writes users.json, sessions.json and beverages.json with the given numbers of rows (as many sessions and beverages
+    as users if not given) into `directory`. Returns the number of rows per file.
+    """
+    rng = random.Random(seed)
+    sessions = users if sessions is None else sessions
+    beverages = users if beverages is None else beverages
+    tables = {
+        "users.json": make_users(users, rng),
+        "sessions.json": make_sessions(sessions, users, rng),
+        "beverages.json": make_beverages(beverages, rng),
+    }
+    for file_name, records in tables.items():
+        with open(os.path.join(directory, file_name), "w") as outfile:
+            json.dump(records, outfile)
+    return {file_name: len(records) for file_name, records in tables.items()}
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    print(write_databases(sys.argv[1], rows))
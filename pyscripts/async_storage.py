@@ -0,0 +1,50 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from pyscripts.storage import get_storage
+
+
+class AsyncStorage:
+    """
+    Awaitable versions of the storage backend's methods, e.g. `await async_storage.get_user(1)`. The JSON files and
+    SQLite can only be read by blocking, so the calls run on a small pool of threads while the event loop carries on
+    with other requests. Each call runs in a copy of the caller's context, so it is counted in the caller's unit of
+    work.
+    """
+
+    def __init__(self, max_threads: int = 8):
+        """
+        :param max_threads: The most storage calls that may run at once. Further calls wait for a free thread.
+        """
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_threads, thread_name_prefix="storage"
+        )
+
+    def __getattr__(self, name: str) -> Callable:
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        async def call(*args, **kwargs):
+            # Looked up on every call, as the storage backend can be switched
+            return await self.run(getattr(get_storage(), name), *args, **kwargs)
+
+        return call
+
+    async def run(self, function: Callable, *args, **kwargs):
+        """
+        Runs a function that reads or writes storage (e.g. Drinker.get_drinker_from_db) on the storage threads and
+        returns its result
+        """
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, functools.partial(context.run, function, *args, **kwargs)
+        )
+
+    def close(self):
+        """
+        Waits for the running calls to finish and stops the threads
+        """
+        self._executor.shutdown()
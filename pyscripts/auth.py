@@ -0,0 +1,272 @@
+import base64
+import collections
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# scrypt cost parameters. n=2**14, r=8 takes about 50 ms and 16 MB per hash.
+scrypt_n = 2**14
+scrypt_r = 8
+scrypt_p = 1
+salt_bytes = 16
+hash_bytes = 32
+_prefix = "scrypt"
+
+
+def hash_password(password: str) -> str:
+    """
+    Returns a salted scrypt hash of the password, as "scrypt$n$r$p$salt$hash" with the salt and hash in base64. This is
+    what is stored in the users database instead of the password.
+    """
+    salt = os.urandom(salt_bytes)
+    key = _scrypt(password, salt, scrypt_n, scrypt_r, scrypt_p, hash_bytes)
+    return "$".join(
+        [
+            _prefix,
+            str(scrypt_n),
+            str(scrypt_r),
+            str(scrypt_p),
+            base64.b64encode(salt).decode(),
+            base64.b64encode(key).decode(),
+        ]
+    )
+
+
+def is_password_hash(stored: str) -> bool:
+    """
+    Returns True if `stored` is a hash made by hash_password, and False if it is a password stored in plain text (as
+    all passwords used to be)
+    """
+    return _parse_hash(stored) is not None
+
+
+def verify_password(password: str, stored: str) -> bool:
+    """
+    Returns True if the password matches the stored hash. Passwords still stored in plain text are compared directly.
+    """
+    parsed = _parse_hash(stored)
+    if parsed is None:
+        return hmac.compare_digest(password.encode(), stored.encode())
+    n, r, p, salt, key = parsed
+    return hmac.compare_digest(_scrypt(password, salt, n, r, p, len(key)), key)
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int, length: int) -> bytes:
+    # scrypt needs 128 * n * r bytes. Allow twice that, as OpenSSL's default limit is too low for bigger n.
+    return hashlib.scrypt(
+        password.encode(),
+        salt=salt,
+        n=n,
+        r=r,
+        p=p,
+        maxmem=256 * n * r + (1 << 20),
+        dklen=length,
+    )
+
+
+def _parse_hash(stored: str) -> tuple[int, int, int, bytes, bytes] or None:
+    parts = stored.split("$")
+    if len(parts) != 6 or parts[0] != _prefix:
+        return None
+    try:
+        return (
+            int(parts[1]),
+            int(parts[2]),
+            int(parts[3]),
+            base64.b64decode(parts[4], validate=True),
+            base64.b64decode(parts[5], validate=True),
+        )
+    except ValueError:
+        return None
+
+
+class LoginThrottled(Exception):
+    """
+    Raised when a username or address has made too many login attempts
+    """
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Too many login attempts, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class HashingBusy(Exception):
+    """
+    Raised when too many password hashes are already waiting for the hashing processes
+    """
+
+
+class TokenBuckets:
+    """
+    A token bucket per key (e.g. per username). Each attempt takes a token, and tokens come back at a steady rate up to
+    the bucket's capacity, so short bursts are allowed but a steady stream of attempts is slowed down to the refill
+    rate.
+    """
+
+    def __init__(self, capacity: float, refill_per_second: float, max_keys=100_000):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.max_keys = max_keys
+        # Key -> (tokens, time they were counted)
+        self._buckets: dict[str, tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def take(self, key: str) -> float:
+        """
+        Takes a token from the key's bucket. Returns 0 if there was one, otherwise the number of seconds until there
+        will be one (and no token is taken).
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, counted_at = self._buckets.get(key, (self.capacity, now))
+            tokens = min(
+                self.capacity, tokens + (now - counted_at) * self.refill_per_second
+            )
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return (1 - tokens) / self.refill_per_second
+            self._buckets[key] = (tokens - 1, now)
+            if len(self._buckets) > self.max_keys:
+                self._forget_full_buckets(now)
+            return 0.0
+
+    def _forget_full_buckets(self, now: float):
+        # A bucket that has filled up again is the same as no bucket, so it can be dropped
+        self._buckets = {
+            key: (tokens, counted_at)
+            for key, (tokens, counted_at) in self._buckets.items()
+            if tokens + (now - counted_at) * self.refill_per_second < self.capacity
+        }
+
+
+class Authenticator:
+    """
+    Checks passwords for the login and register routes. Hashing is slow on purpose, so it is done in a pool of worker
+    processes to keep it off the request threads (and out of the GIL), with a limit on how many hashes may be waiting
+    so a burst of logins can't queue up without bound. Successful checks are remembered for a short while, so logging in
+    again doesn't hash again, and attempts are throttled per username and per address.
+    """
+
+    def __init__(
+        self,
+        workers: int = 2,
+        max_pending: int = 32,
+        pending_timeout: float = 5.0,
+        cache_ttl: float = 300.0,
+        cache_size: int = 10_000,
+        username_buckets: TokenBuckets = None,
+        address_buckets: TokenBuckets = None,
+    ):
+        """
+        :param workers: Number of hashing processes. With 0, hashes are worked out on the calling thread.
+        :param max_pending: The most hashes that may be running or waiting at once
+        :param pending_timeout: Number of seconds to wait for a free place before giving up with HashingBusy
+        :param cache_ttl: Number of seconds a successful check is remembered
+        """
+        self.workers = workers
+        self.pending_timeout = pending_timeout
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        # 5 attempts at once per username, then one every 10 seconds
+        self.username_buckets = username_buckets or TokenBuckets(5, 0.1)
+        # 30 attempts at once per address, then one a second
+        self.address_buckets = address_buckets or TokenBuckets(30, 1.0)
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        # Keyed by an HMAC of the stored hash and the password, so the cache never holds a password. Values are the
+        # times the entries expire.
+        self._cache_key = secrets.token_bytes(32)
+        self._verified: collections.OrderedDict = collections.OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def throttle(self, username: str, address: str = None):
+        """
+        Counts a login attempt. Raises LoginThrottled if the username or address has made too many attempts lately.
+        """
+        retry_after = self.username_buckets.take(f"user:{username}")
+        if not retry_after and address:
+            retry_after = self.address_buckets.take(f"address:{address}")
+        if retry_after:
+            raise LoginThrottled(retry_after)
+
+    def hash(self, password: str) -> str:
+        """
+        Returns the hash to store for a new password
+        """
+        return self._run(hash_password, password)
+
+    def verify(self, drinker, password: str) -> bool:
+        """
+        Returns True if the password is the drinker's. A drinker whose password is still stored in plain text gets it
+        replaced by a hash the first time they log in.
+        """
+        cache_key = self._cache_key_for(drinker, password)
+        if self._is_cached(cache_key):
+            return True
+
+        if is_password_hash(drinker.password):
+            verified = self._run(verify_password, password, drinker.password)
+        else:
+            verified = verify_password(password, drinker.password)
+            if verified:
+                drinker.password = self.hash(password)
+                drinker.save_to_db()
+                cache_key = self._cache_key_for(drinker, password)
+        if verified:
+            self._remember(cache_key)
+        return verified
+
+    def close(self):
+        """
+        Stops the hashing processes
+        """
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def _run(self, function, *args):
+        if self.workers == 0:
+            return function(*args)
+        if not self._pending.acquire(timeout=self.pending_timeout):
+            raise HashingBusy("Too many logins at once, try again shortly")
+        try:
+            return self._get_executor().submit(function, *args).result()
+        finally:
+            self._pending.release()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # Started on first use, so importing the app doesn't start processes
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def _cache_key_for(self, drinker, password: str) -> bytes:
+        return hmac.digest(
+            self._cache_key,
+            f"{drinker.id}\0{drinker.password}\0{password}".encode(),
+            "sha256",
+        )
+
+    def _is_cached(self, cache_key: bytes) -> bool:
+        with self._cache_lock:
+            expires = self._verified.get(cache_key)
+            if expires is None:
+                return False
+            if expires < time.monotonic():
+                del self._verified[cache_key]
+                return False
+            return True
+
+    def _remember(self, cache_key: bytes):
+        with self._cache_lock:
+            self._verified[cache_key] = time.monotonic() + self.cache_ttl
+            self._verified.move_to_end(cache_key)
+            while len(self._verified) > self.cache_size:
+                self._verified.popitem(last=False)
@@ -0,0 +1,112 @@
+import dataclasses
+import threading
+import time
+from typing import Callable
+from typing import Hashable
+from typing import TYPE_CHECKING
+
+from pyscripts.drink_index import AlcoholContentIndex
+
+if TYPE_CHECKING:
+    from pyscripts.objects import Drink
+
+
+@dataclasses.dataclass(frozen=True)
+class CatalogSnapshot:
+    """
+    The beverage catalog as it was at one point in time. A snapshot never changes, so a request that holds on to one
+    sees the same catalog from start to finish, even if the catalog is reloaded in the meantime.
+    """
+
+    # Goes up by one every time the catalog is reloaded
+    version: int
+    drinks: tuple["Drink", ...]
+    # Drink id -> drink
+    drinks_by_id: dict[int, "Drink"]
+    index: AlcoholContentIndex
+    loaded_at: float
+
+
+class CatalogService:
+    """
+    Keeps the parsed beverage catalog in memory, so requests don't have to read and parse the catalog every time.
+
+    Getting the catalog is a read-through: at most once every `ttl` seconds, the service asks the storage backend
+    whether the catalog has changed (for the JSON files this is a stat of the file), and reloads it if it has. In between
+    the cached snapshot is returned straight away, however big the catalog is. A reload builds a whole new snapshot and
+    then swaps it in, so readers only ever see a complete catalog.
+    """
+
+    def __init__(
+        self,
+        load_drinks: Callable[[], list["Drink"]],
+        get_version: Callable[[], Hashable],
+        ttl: float = 1.0,
+    ):
+        """
+        :param load_drinks: Reads and parses the catalog
+        :param get_version: Returns a value that changes whenever the catalog does. Should be much cheaper than
+            load_drinks.
+        :param ttl: Number of seconds to trust the cached catalog for before checking whether it has changed
+        """
+        self.load_drinks = load_drinks
+        self.get_version = get_version
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self._snapshot: CatalogSnapshot or None = None
+        self._source_version = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def snapshot(self) -> CatalogSnapshot:
+        """
+        Returns the current catalog, loading it first if it has changed
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._snapshot is not None and now - self._checked_at < self.ttl:
+                self.hits += 1
+                return self._snapshot
+
+            source_version = self.get_version()
+            self._checked_at = now
+            if self._snapshot is not None and source_version == self._source_version:
+                self.hits += 1
+                return self._snapshot
+
+            self.misses += 1
+            if self._snapshot is not None:
+                self.reloads += 1
+            drinks = tuple(self.load_drinks())
+            self._snapshot = CatalogSnapshot(
+                version=self._snapshot.version + 1 if self._snapshot else 1,
+                drinks=drinks,
+                drinks_by_id={drink.id: drink for drink in drinks},
+                index=AlcoholContentIndex(drinks),
+                loaded_at=now,
+            )
+            self._source_version = source_version
+            return self._snapshot
+
+    def invalidate(self):
+        """
+        Makes the next call to snapshot() check whether the catalog has changed, without waiting for the TTL
+        """
+        with self._lock:
+            # The snapshot is kept, in case the catalog hasn't changed
+            self._checked_at = float("-inf")
+
+    def stats(self) -> dict:
+        """
+        Returns the cache counters and the current catalog version
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "reloads": self.reloads,
+                "version": self._snapshot.version if self._snapshot else None,
+                "drinks": len(self._snapshot.drinks) if self._snapshot else 0,
+            }
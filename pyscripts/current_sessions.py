@@ -0,0 +1,126 @@
+import heapq
+import threading
+from datetime import datetime
+from datetime import timedelta
+from typing import Callable
+from typing import Hashable
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from pyscripts.objects import Session
+
+
+class CurrentSessionIndex:
+    """
+    Remembers each user's current session: their latest session, if it started less than `expire_after` ago.
+
+    A user's session is loaded from storage the first time it is asked for, and sessions saved in this process are put
+    straight into the index. Sessions expire in start time order, so a heap of expiry times is enough to drop them
+    without looking at the sessions that haven't expired. If the storage says sessions have been saved elsewhere, the
+    whole index is dropped and built up again as users are asked for.
+    """
+
+    def __init__(
+        self,
+        load_latest: Callable[[list[int]], dict[int, "Session"]],
+        get_version: Callable[[], Hashable],
+        expire_after: timedelta = timedelta(hours=24),
+    ):
+        """
+        :param load_latest: Returns the given users' latest sessions from storage, keyed by user id. Users without
+            sessions are left out.
+        :param get_version: Returns a value that changes whenever sessions are saved by another process
+        :param expire_after: How long after its start time a session stops being the current session
+        """
+        self.load_latest = load_latest
+        self.get_version = get_version
+        self.expire_after = expire_after
+        # User id -> current session, or None if the user is known to have no current session
+        self._sessions: dict[int, "Session" or None] = {}
+        # (expiry time, user id, session id) for every session in the index
+        self._expiry_heap: list[tuple[datetime, int, int]] = []
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> "Session" or None:
+        """
+        Returns the user's current session, or None if they don't have one
+        """
+        return self.get_many([user_id])[int(user_id)]
+
+    def get_many(self, user_ids: list[int]) -> dict[int, "Session" or None]:
+        """
+        Returns the current session of each of the given users (None if they don't have one), keyed by user id. The
+        users that aren't in the index yet are loaded from storage together.
+        """
+        user_ids = [int(user_id) for user_id in user_ids]
+        with self._lock:
+            self._check_version()
+            self._remove_expired(datetime.now())
+            sessions = {
+                user_id: self._sessions[user_id]
+                for user_id in user_ids
+                if user_id in self._sessions
+            }
+            version = self._version
+        missing = [
+            user_id for user_id in dict.fromkeys(user_ids) if user_id not in sessions
+        ]
+        if not missing:
+            return sessions
+
+        # Load outside the lock, so one slow read doesn't hold up other users
+        loaded = self.load_latest(missing)
+        now = datetime.now()
+        with self._lock:
+            for user_id in missing:
+                session = loaded.get(user_id)
+                if session is not None and not self._is_current(session, now):
+                    session = None
+                # Don't keep the session if the index was dropped while we were loading, as it may be out of date.
+                # Keep what is already there, in case the session was saved while we were loading.
+                if self._version == version and user_id not in self._sessions:
+                    self._add(user_id, session)
+                sessions[user_id] = self._sessions.get(user_id, session)
+        return sessions
+
+    def session_saved(self, session: "Session"):
+        """
+        Updates the index after a session has been saved in this process
+        """
+        user_id = int(session.user_id)
+        with self._lock:
+            # Users who aren't in the index are loaded from storage when they are asked for
+            if user_id not in self._sessions:
+                return
+            current = self._sessions[user_id]
+            if current is None or session.start_time >= current.start_time:
+                self._add(user_id, session)
+
+    def _add(self, user_id: int, session: "Session" or None):
+        if session is not None and not self._is_current(session, datetime.now()):
+            session = None
+        self._sessions[user_id] = session
+        if session is not None:
+            heapq.heappush(
+                self._expiry_heap,
+                (session.start_time + self.expire_after, user_id, session.id),
+            )
+
+    def _is_current(self, session: "Session", now: datetime) -> bool:
+        return now - session.start_time < self.expire_after
+
+    def _remove_expired(self, now: datetime):
+        while self._expiry_heap and self._expiry_heap[0][0] <= now:
+            _, user_id, session_id = heapq.heappop(self._expiry_heap)
+            session = self._sessions.get(user_id)
+            # The user may have started a newer session since this entry was pushed
+            if session is not None and session.id == session_id:
+                self._sessions[user_id] = None
+
+    def _check_version(self):
+        version = self.get_version()
+        if version != self._version:
+            self._sessions.clear()
+            self._expiry_heap.clear()
+            self._version = version
@@ -0,0 +1,37 @@
+import bisect
+from typing import Callable
+from typing import Iterable
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from pyscripts.objects import Drink
+
+
+class AlcoholContentIndex:
+    """
+    The beverage catalog sorted by alcohol content. A drinker's BAC after a drink only goes up with the drink's
+    alcohol content, so the drinks that pass a BAC limit are always a prefix of this list, and the end of the prefix can
+    be found with a binary search instead of checking every drink.
+    """
+
+    def __init__(self, drinks: Iterable["Drink"]):
+        self.drinks = tuple(sorted(drinks, key=lambda drink: drink.alcohol_content))
+        self.alcohol_contents = tuple(drink.alcohol_content for drink in self.drinks)
+
+    def count_passing(
+        self,
+        alcohol_content_limit: float,
+        passes: Callable[["Drink"], bool],
+    ) -> int:
+        """
+        Returns the length of the prefix of drinks that pass the check. `passes` must be true for all drinks up to some
+        alcohol content and false after it. `alcohol_content_limit` is an estimate of that alcohol content, found by
+        solving the check for it. Rounding can put the estimate a drink or two off, so the drinks either side of it are
+        checked with `passes` to get the exact answer.
+        """
+        count = bisect.bisect_left(self.alcohol_contents, alcohol_content_limit)
+        while count > 0 and not passes(self.drinks[count - 1]):
+            count -= 1
+        while count < len(self.drinks) and passes(self.drinks[count]):
+            count += 1
+        return count
@@ -0,0 +1,174 @@
+import collections
+import dataclasses
+import secrets
+import threading
+import time
+from typing import Callable
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from pyscripts.objects import BacCoefficients
+    from pyscripts.objects import Drinker
+    from pyscripts.objects import Session
+
+
+@dataclasses.dataclass(frozen=True)
+class DrinkerContext:
+    """
+    What the pages need to know about a logged in drinker. The current session isn't kept here, as the current session
+    index already has it in memory and keeps it up to date as sessions are started and expire.
+    """
+
+    drinker: "Drinker"
+    coefficients: "BacCoefficients"
+
+    @property
+    def user_id(self) -> int:
+        return self.drinker.id
+
+    @property
+    def current_session(self) -> "Session" or None:
+        return self.drinker.get_current_session()
+
+
+class DrinkerContexts:
+    """
+    Keeps track of who is logged in. Logging in hands out a random token, which the app keeps in its signed session
+    cookie, and each token maps to a user id until it expires or the user logs out. When the app runs in several
+    processes (or is restarted), a token handed out by another process is taken on with resume(). Logging out revokes
+    the token in storage, which every process checks, so a logged out token isn't accepted by any of them.
+
+    The drinkers themselves are kept in a least recently used cache, so a page view only reads the drinker from
+    storage the first time, or when the drinker has been dropped from the cache because too many others were used
+    since. A drinker that is saved (e.g. after a profile change) is dropped from the cache, so it is loaded again.
+    """
+
+    def __init__(
+        self,
+        load_drinker: Callable[[int], "Drinker" or None],
+        revoke_token: Callable[[str, float], None],
+        is_token_revoked: Callable[[str], bool],
+        ttl: float = 12 * 3600,
+        max_drinkers: int = 10_000,
+    ):
+        """
+        :param load_drinker: Returns the drinker with the given id from storage, or None if there isn't one
+        :param revoke_token: Records in storage that a token was logged out of, and when it would have expired
+        :param is_token_revoked: Returns True if the token was logged out of, in any process
+        :param ttl: Number of seconds a token is valid for after logging in
+        :param max_drinkers: The most drinkers to keep in the cache
+        """
+        self.load_drinker = load_drinker
+        self.revoke_token = revoke_token
+        self.is_token_revoked = is_token_revoked
+        self.ttl = ttl
+        self.max_drinkers = max_drinkers
+        # Token -> (user id, time the token expires). Times are in seconds since the epoch, so they can be passed
+        # between processes.
+        self._tokens: dict[str, tuple[int, float]] = {}
+        # User id -> context, least recently used first
+        self._contexts: collections.OrderedDict = collections.OrderedDict()
+        # Goes up every time a drinker is saved
+        self._saves = 0
+        self._lock = threading.Lock()
+
+    def log_in(self, drinker: "Drinker") -> tuple[str, float]:
+        """
+        Starts a logged in session for the drinker. Returns its token and the time it expires, in seconds since the
+        epoch.
+        """
+        token = secrets.token_urlsafe(32)
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._add_token(token, drinker.id, expires_at)
+            self._put(_make_context(drinker))
+        return token, expires_at
+
+    def resume(self, token: str, user_id: int, expires_at: float):
+        """
+        Takes on a token handed out by another process. The caller has to check that the token is genuine, e.g. by
+        reading it from a signed cookie. Tokens that have been logged out of, in any process, aren't taken on.
+        """
+        with self._lock:
+            if token in self._tokens:
+                return
+        if expires_at <= time.time() or self.is_token_revoked(token):
+            return
+        with self._lock:
+            self._add_token(token, int(user_id), expires_at)
+
+    def log_out(self, token: str, expires_at: float = None):
+        """
+        Revokes the token. `expires_at` is when it would have expired, if this process doesn't know the token.
+        """
+        with self._lock:
+            _, known_expires_at = self._tokens.pop(token, (None, None))
+        expires_at = known_expires_at or expires_at or time.time() + self.ttl
+        self.revoke_token(token, expires_at)
+
+    def get(self, token: str) -> DrinkerContext or None:
+        """
+        Returns the context of the drinker logged in with the token, or None if the token isn't valid (any more)
+        """
+        with self._lock:
+            user_id, expires = self._tokens.get(token, (None, 0))
+            if user_id is None:
+                return None
+            if expires <= time.time():
+                del self._tokens[token]
+                return None
+        # Checked on every use, as another process may have logged the token out since
+        if self.is_token_revoked(token):
+            with self._lock:
+                self._tokens.pop(token, None)
+            return None
+        with self._lock:
+            context = self._contexts.get(user_id)
+            if context is not None:
+                self._contexts.move_to_end(user_id)
+                return context
+            saves = self._saves
+
+        # Load outside the lock, so one slow read doesn't hold up other users
+        drinker = self.load_drinker(user_id)
+        if drinker is None:
+            with self._lock:
+                self._tokens.pop(token, None)
+            return None
+        context = _make_context(drinker)
+        with self._lock:
+            # Don't cache the drinker if one was saved while we were loading, as it may be out of date
+            if self._saves == saves:
+                self._put(context)
+        return context
+
+    def drinker_saved(self, drinker: "Drinker"):
+        """
+        Drops the saved drinker from the cache, so it is loaded again on the next page view. Their tokens stay valid.
+        """
+        with self._lock:
+            self._contexts.pop(drinker.id, None)
+            self._saves += 1
+
+    def _add_token(self, token: str, user_id: int, expires_at: float):
+        self._tokens[token] = (user_id, expires_at)
+        if len(self._tokens) > 2 * self.max_drinkers:
+            self._remove_expired_tokens(time.time())
+
+    def _put(self, context: DrinkerContext):
+        self._contexts[context.user_id] = context
+        self._contexts.move_to_end(context.user_id)
+        while len(self._contexts) > self.max_drinkers:
+            self._contexts.popitem(last=False)
+
+    def _remove_expired_tokens(self, now: float):
+        self._tokens = {
+            token: (user_id, expires)
+            for token, (user_id, expires) in self._tokens.items()
+            if expires > now
+        }
+
+
+def _make_context(drinker: "Drinker") -> DrinkerContext:
+    # The coefficients are looked up now, so page views don't have to
+    return DrinkerContext(drinker=drinker, coefficients=drinker.coefficients)
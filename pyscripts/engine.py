@@ -0,0 +1,246 @@
+import dataclasses
+
+import numpy as np
+
+from pyscripts.objects import bac_increase_coefficients
+from pyscripts.objects import Drink
+from pyscripts.objects import Drinker
+from pyscripts.objects import get_catalog
+from pyscripts.objects import legal_driving_limit
+from pyscripts.objects import metabolism_coefficients
+from pyscripts.objects import Session
+from pyscripts.objects import standard_drink_ml
+from pyscripts.ranking import default_strategy
+from pyscripts.ranking import rank_drinks
+
+
+class RecommendationEngine:
+    """
+    Scores the whole beverage catalog for many drinkers at once. The catalog is held as NumPy column arrays, and the
+    results for N drinkers and M drinks are computed in a single vectorized pass as (N, M) arrays, using the same BAC
+    model as Drinker.bac_after_drink and Drinker.number_seconds_until_can_drive.
+    """
+
+    def __init__(self, drinks: list[Drink]):
+        self.drinks = list(drinks)
+        self.ids = np.array([drink.id for drink in self.drinks], dtype=object)
+        self.alcohol_content = np.array(
+            [drink.alcohol_content for drink in self.drinks], dtype=float
+        )
+        self.sorted_by_alcohol_content = bool(
+            np.all(np.diff(self.alcohol_content) >= 0)
+        )
+        # Drink types are stored as codes into self.types, e.g. types[type_codes[i]] == drinks[i].type
+        self.types, self.type_codes = np.unique(
+            np.array([drink.type for drink in self.drinks], dtype=str),
+            return_inverse=True,
+        )
+
+    @staticmethod
+    def drinker_coefficients(
+        sexes: list[str], weights: list[float]
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the BAC increase per standard drink and the BAC metabolized per second for each drinker
+        """
+        is_male = np.asarray(sexes) == "male"
+        weights = np.asarray(weights, dtype=float)
+
+        # Anything other than "male" uses the female coefficients, as in Drinker
+        male_a1, male_a2 = bac_increase_coefficients["male"]
+        female_a1, female_a2 = bac_increase_coefficients["female"]
+        male_b1, male_b2 = metabolism_coefficients["male"]
+        female_b1, female_b2 = metabolism_coefficients["female"]
+        a1 = np.where(is_male, male_a1, female_a1)
+        a2 = np.where(is_male, male_a2, female_a2)
+        b1 = np.where(is_male, male_b1, female_b1)
+        b2 = np.where(is_male, male_b2, female_b2)
+
+        bac_increase_per_drink = a1 * np.exp(a2 * weights)
+        seconds_to_metabolize_one_drink = b1 * np.exp(b2 * weights) * 3600
+        return (
+            bac_increase_per_drink,
+            bac_increase_per_drink / seconds_to_metabolize_one_drink,
+        )
+
+    def bac_after_drinks(
+        self, sexes: list[str], weights: list[float], current_bacs: list[float]
+    ) -> np.ndarray:
+        """
+        Returns an (N drinkers, M drinks) array with each drinker's BAC after each drink
+        """
+        bac_increase_per_drink, _ = self.drinker_coefficients(sexes, weights)
+        return self._bac_after_drinks(bac_increase_per_drink, current_bacs)
+
+    def _bac_after_drinks(
+        self, bac_increase_per_drink: np.ndarray, current_bacs: list[float]
+    ) -> np.ndarray:
+        standard_drinks = self.alcohol_content / standard_drink_ml
+        return (
+            np.asarray(current_bacs, dtype=float)[:, np.newaxis]
+            + bac_increase_per_drink[:, np.newaxis] * standard_drinks[np.newaxis, :]
+        )
+
+    @staticmethod
+    def seconds_until_can_drive(
+        bacs: np.ndarray, bac_metabolized_per_second: np.ndarray
+    ) -> np.ndarray:
+        """
+        Returns the number of seconds until each drinker can drive, or 0 if they can drive now. `bacs` can be one value
+        per drinker, or an (N drinkers, M drinks) array.
+        """
+        bacs = np.asarray(bacs, dtype=float)
+        rate = np.asarray(bac_metabolized_per_second, dtype=float)
+        if bacs.ndim == 2:
+            rate = rate[:, np.newaxis]
+        return np.maximum(bacs - legal_driving_limit, 0) / rate
+
+    def candidate_mask(
+        self,
+        sexes: list[str],
+        weights: list[float],
+        current_bacs: list[float],
+        max_alcohols: list[float],
+        seconds_until_drive_times: list[float or None],
+    ) -> np.ndarray:
+        """
+        Returns an (N drinkers, M drinks) boolean array that is True where the drink keeps the drinker below their max
+        alcohol and, if they have a drive time (not None/NaN), lets them drive by then
+        """
+        bac_increase_per_drink, bac_metabolized_per_second = self.drinker_coefficients(
+            sexes, weights
+        )
+        bac_after_drinks = self._bac_after_drinks(bac_increase_per_drink, current_bacs)
+        mask = bac_after_drinks < np.asarray(max_alcohols, dtype=float)[:, np.newaxis]
+
+        drive_times = np.array(
+            [np.nan if t is None else t for t in seconds_until_drive_times],
+            dtype=float,
+        )
+        seconds_until_can_drive = self.seconds_until_can_drive(
+            bac_after_drinks, bac_metabolized_per_second
+        )
+        # NaN compares as False, so use "not greater than" to let drinkers without a drive time through
+        can_drive_in_time = ~(seconds_until_can_drive > drive_times[:, np.newaxis])
+        return mask & can_drive_in_time
+
+    def candidates_for(
+        self,
+        drinkers: list[Drinker],
+        current_bacs: list[float],
+        sessions: list[Session],
+    ) -> list[list[Drink]]:
+        """
+        Returns the candidate drinks for each drinker, given their current BAC and current session. Drinkers without a
+        session get no candidates.
+        """
+        has_session = [session is not None for session in sessions]
+        mask = self.candidate_mask(
+            sexes=[drinker.sex for drinker in drinkers],
+            weights=[drinker.weight for drinker in drinkers],
+            current_bacs=current_bacs,
+            max_alcohols=[
+                session.max_alcohol if session else 0.0 for session in sessions
+            ],
+            seconds_until_drive_times=[
+                session.seconds_until_drive_time() if session else None
+                for session in sessions
+            ],
+        )
+        if self.sorted_by_alcohol_content:
+            # A drink's BAC (and so the time until the drinker can drive) only goes up with its alcohol content, so the
+            # candidates are the first ones in each row and counting them is enough
+            counts = mask.sum(axis=1)
+            return [
+                self.drinks[:count] if has else []
+                for count, has in zip(counts.tolist(), has_session)
+            ]
+        return [
+            [self.drinks[i] for i in np.flatnonzero(row)] if has else []
+            for row, has in zip(mask, has_session)
+        ]
+
+
+@dataclasses.dataclass
+class GroupRecommendation:
+    """
+    The recommendations for one drinker in a group
+    """
+
+    user_id: int
+    current_bac: float
+    # Best first, see pyscripts/ranking.py
+    drinks: list[Drink]
+    # Why the drinker got no recommendations, if they couldn't be scored
+    error: str = None
+
+
+# The catalog snapshot the cached engine was built from, and the engine itself
+_engine: tuple = (None, None)
+
+
+def get_recommendation_engine() -> RecommendationEngine:
+    """
+    Returns an engine for the current catalog. The engine is only rebuilt when the catalog changes.
+    """
+    global _engine
+    snapshot = get_catalog()
+    engine_snapshot, engine = _engine
+    if engine_snapshot is not snapshot:
+        # The index holds the drinks sorted by alcohol content, so the engine's candidates come out in that order too
+        engine = RecommendationEngine(snapshot.index.drinks)
+        _engine = (snapshot, engine)
+    return engine
+
+
+def recommend_for_group(
+    drinker_bacs: list[tuple[int, float]],
+    k: int = None,
+    strategy: str = default_strategy,
+    seed: int = None,
+) -> list[GroupRecommendation]:
+    """
+    Returns the k best candidate drinks (all of them if k is None) for each (user id, current BAC) pair, in the same
+    order. The candidates are the drinks get_drink_candidates_for_drive_time or
+    get_drink_candidates_less_than_max_alcohol would give each drinker, but all the drinkers and their sessions are
+    read together and the catalog is scored for all of them in one pass. They are then ranked with rank_drinks.
+    """
+    recommendations = [
+        GroupRecommendation(
+            user_id=int(user_id), current_bac=float(current_bac), drinks=[]
+        )
+        for user_id, current_bac in drinker_bacs
+    ]
+    user_ids = [recommendation.user_id for recommendation in recommendations]
+    drinkers = Drinker.get_drinkers_from_db(user_ids)
+    sessions = Drinker.get_current_sessions(
+        [user_id for user_id in user_ids if drinkers[user_id] is not None]
+    )
+
+    scored = []
+    for recommendation in recommendations:
+        if drinkers[recommendation.user_id] is None:
+            recommendation.error = "Unknown user"
+        elif sessions[recommendation.user_id] is None:
+            recommendation.error = "No current session"
+        else:
+            scored.append(recommendation)
+    if not scored:
+        return recommendations
+
+    candidates = get_recommendation_engine().candidates_for(
+        drinkers=[drinkers[recommendation.user_id] for recommendation in scored],
+        current_bacs=[recommendation.current_bac for recommendation in scored],
+        sessions=[sessions[recommendation.user_id] for recommendation in scored],
+    )
+    for recommendation, drinks in zip(scored, candidates):
+        recommendation.drinks = rank_drinks(
+            drinker=drinkers[recommendation.user_id],
+            session=sessions[recommendation.user_id],
+            current_bac=recommendation.current_bac,
+            drinks=drinks,
+            k=len(drinks) if k is None else k,
+            strategy=strategy,
+            seed=seed,
+        )
+    return recommendations
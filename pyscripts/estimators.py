@@ -0,0 +1,174 @@
+import collections
+import dataclasses
+import statistics
+
+
+@dataclasses.dataclass(frozen=True)
+class Estimate:
+    """
+    The result of a sensor measurement, in potentiometer units
+    """
+
+    value: float
+    # How much to trust the value, from 0 (not at all) to 1
+    confidence: float
+    samples: int
+    rejected: int
+    # Whether the reading settled on a plateau before the measurement window ended
+    stable: bool
+
+
+class MaxEstimator:
+    """
+    Takes the highest sample, like the original 50-sample measurement. Never finishes early.
+    """
+
+    def __init__(self):
+        self.peak = None
+        self.samples = 0
+
+    @property
+    def is_stable(self) -> bool:
+        return False
+
+    def add(self, value: float):
+        self.samples += 1
+        if self.peak is None or value > self.peak:
+            self.peak = value
+
+    def estimate(self) -> Estimate or None:
+        if self.peak is None:
+            return None
+        return Estimate(
+            value=self.peak,
+            confidence=1.0,
+            samples=self.samples,
+            rejected=0,
+            stable=False,
+        )
+
+
+class PlateauEstimator:
+    """
+    Estimates the breath reading from a stream of samples, using the same amount of memory however many samples arrive.
+
+    - Outliers are rejected with a Hampel filter: a sample further from the median of the last few samples than
+      `outlier_threshold` times their (scaled) median absolute deviation is replaced by that median, so a single noisy
+      spike can't decide the result. A real change in level moves the median along with it, so it isn't rejected.
+    - The filtered samples are smoothed with an exponential moving average (EMA).
+    - Once the last `plateau_samples` smoothed values are all within `plateau_tolerance` of each other, the reading
+      has plateaued. A slow drift doesn't plateau, as it adds up over the window.
+    - A plateau only ends the measurement once the user is blowing: the reading has risen `min_rise` above the lowest
+      value so far, or is at least `min_level`. An idle sensor reads low and flat, so it doesn't end the measurement
+      before the user has started, while a reading that is already steady and raised ends it straight away.
+
+    The estimate is the highest smoothed value.
+    """
+
+    def __init__(
+        self,
+        median_window: int = 5,
+        smoothing: float = 0.3,
+        outlier_threshold: float = 3.0,
+        min_outlier_deviation: float = 50.0,
+        min_rise: float = 100.0,
+        min_level: float = 300.0,
+        plateau_tolerance: float = 15.0,
+        plateau_samples: int = 8,
+    ):
+        """
+        :param median_window: Number of recent samples the median is taken over
+        :param smoothing: Weight of each new value in the EMA, between 0 and 1
+        :param outlier_threshold: How many (scaled) median absolute deviations from the median a sample may be before
+            it is rejected
+        :param min_outlier_deviation: Samples closer than this to the median (in potentiometer units) are never
+            rejected, so that a flat signal doesn't reject every small change
+        :param min_rise: How far (in potentiometer units) the reading must rise above its lowest value before a plateau
+            counts. Stops a measurement from ending before the user has started blowing.
+        :param min_level: A reading at least this high (in potentiometer units) counts as the user blowing even if it
+            hasn't risen, as an idle sensor reads lower
+        :param plateau_tolerance: How far apart (in potentiometer units) the highest and lowest EMA values of a
+            plateau may be
+        :param plateau_samples: How many samples in a row the EMA must stay within the tolerance
+        """
+        self.median_window = median_window
+        self.smoothing = smoothing
+        self.outlier_threshold = outlier_threshold
+        self.min_outlier_deviation = min_outlier_deviation
+        self.min_rise = min_rise
+        self.min_level = min_level
+        self.plateau_tolerance = plateau_tolerance
+        self.plateau_samples = plateau_samples
+
+        self._recent = collections.deque(maxlen=median_window)
+        # The last plateau_samples EMA values
+        self._recent_emas = collections.deque(maxlen=plateau_samples)
+        self._ema = None
+        self._lowest = None
+        self._peak = None
+        self._plateau_streak = 0
+        self._risen = False
+        self.samples = 0
+        self.rejected = 0
+
+    @property
+    def is_stable(self) -> bool:
+        """
+        Whether the reading has risen and settled, so the measurement can stop
+        """
+        return self._risen and self._plateau_streak >= self.plateau_samples
+
+    def add(self, value: float):
+        self.samples += 1
+        self._recent.append(value)
+        median = statistics.median(self._recent)
+        # 1.4826 scales the median absolute deviation to match a standard deviation for normally distributed noise
+        deviation = 1.4826 * statistics.median(abs(v - median) for v in self._recent)
+        allowed_deviation = max(
+            self.outlier_threshold * deviation, self.min_outlier_deviation
+        )
+        if abs(value - median) > allowed_deviation:
+            self.rejected += 1
+            value = median
+
+        if self._ema is None:
+            self._ema = value
+        else:
+            self._ema += self.smoothing * (value - self._ema)
+        self._peak = self._ema if self._peak is None else max(self._peak, self._ema)
+        self._lowest = (
+            self._ema if self._lowest is None else min(self._lowest, self._ema)
+        )
+        self._recent_emas.append(self._ema)
+
+        if self._ema - self._lowest >= self.min_rise or self._ema >= self.min_level:
+            self._risen = True
+
+        # The streak is how many of the latest EMA values are within the tolerance of each other
+        low = high = self._ema
+        self._plateau_streak = 0
+        for ema in reversed(self._recent_emas):
+            low, high = min(low, ema), max(high, ema)
+            if high - low > self.plateau_tolerance:
+                break
+            self._plateau_streak += 1
+
+    def estimate(self) -> Estimate or None:
+        """
+        Returns the estimate so far, or None if no samples have been accepted
+        """
+        if self._peak is None:
+            return None
+        accepted_fraction = (self.samples - self.rejected) / self.samples
+        # A reading that never settled is less trustworthy, in proportion to how close it got
+        stability = self._plateau_streak / self.plateau_samples
+        if not self._risen:
+            # The reading stayed low and flat: either a zero reading or the user didn't blow
+            stability = min(stability, 0.5)
+        return Estimate(
+            value=self._peak,
+            confidence=round(accepted_fraction * (0.5 + 0.5 * stability), 3),
+            samples=self.samples,
+            rejected=self.rejected,
+            stable=self.is_stable,
+        )
@@ -0,0 +1,80 @@
+import os
+import pty
+import threading
+import time
+from typing import Callable
+from typing import Iterable
+
+
+class SimulatedSerialDevice:
+    """
+    Pretends to be the Arduino: writes one potentiometer reading per line to a pseudo-terminal, which can be opened
+    with serial.Serial(device.port_name) like a real serial port. For tests and benchmarks without the hardware.
+    Only works on systems with pseudo-terminals (Linux, macOS).
+    """
+
+    def __init__(
+        self,
+        values: Iterable[float] or Callable[[], float] = (2000,),
+        interval: float = 0.1,
+    ):
+        """
+        :param values: The readings to send, repeated when they run out, or a function returning the next reading
+        :param interval: Seconds between readings
+        """
+        self.values = values
+        self.interval = interval
+        self._master, self._slave = pty.openpty()
+        self.port_name = os.ttyname(self._slave)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> "SimulatedSerialDevice":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+    def __enter__(self) -> "SimulatedSerialDevice":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _next_values(self):
+        if callable(self.values):
+            while True:
+                yield self.values()
+        values = list(self.values)
+        while True:
+            yield from values
+
+    def _run(self):
+        for value in self._next_values():
+            if self._stopped.wait(self.interval):
+                return
+            os.write(self._master, f"{value}\r\n".encode())
+
+
+class FakeSerial:
+    """
+    An in-memory stand-in for serial.Serial that returns the given readings, for systems without pseudo-terminals.
+    Pass `lambda *args, **kwargs: FakeSerial(values)` as a SensorReader's serial_factory.
+    """
+
+    def __init__(self, values: Iterable[float], interval: float = 0.1):
+        self._values = iter(values)
+        self.interval = interval
+        self.is_open = True
+
+    def readline(self) -> bytes:
+        time.sleep(self.interval)
+        value = next(self._values, None)
+        return b"" if value is None else f"{value}\r\n".encode()
+
+    def close(self):
+        self.is_open = False
@@ -0,0 +1,78 @@
+import os
+import threading
+from typing import Callable
+
+from pyscripts import repository
+from pyscripts.file_lock import atomic_write
+from pyscripts.file_lock import file_lock
+
+
+class IdAllocator:
+    """
+    Hands out unique, increasing ids for new database records. The highest reserved id is kept in a small counter file.
+    Each process reserves a block of ids at a time by bumping the counter under a file lock, and then hands the ids in
+    the block out from memory, so most ids cost no file access at all. Ids that are reserved but not used (e.g. when a
+    process exits) are skipped, so there can be gaps.
+    """
+
+    def __init__(self, path: str, seed: Callable[[], int], block_size: int = 10):
+        """
+        :param path: The counter file
+        :param seed: Returns the highest id already in use. Only called if the counter file doesn't exist yet.
+        :param block_size: How many ids to reserve at a time
+        """
+        self.path = path
+        self.seed = seed
+        self.block_size = block_size
+        self._block = iter(())
+        self._lock = threading.Lock()
+        # A forked child (e.g. a gunicorn worker) must not hand out the ids its parent already reserved
+        os.register_at_fork(after_in_child=self._discard_block)
+
+    def next_id(self) -> int:
+        """
+        Returns a new id
+        """
+        while True:
+            block = self._block
+            # next() on a range iterator can't be interrupted by another thread, so no lock is needed here
+            new_id = next(block, None)
+            if new_id is not None:
+                return new_id
+            with self._lock:
+                # Another thread may have reserved a new block while we were waiting for the lock
+                if self._block is block:
+                    self._block = iter(self._reserve_block())
+
+    def _reserve_block(self) -> range:
+        """
+        Bumps the counter file by a block of ids and returns the reserved ids
+        """
+        with file_lock(f"{self.path}.lock"):
+            try:
+                with open(self.path, "r") as infile:
+                    highest_reserved = int(infile.read())
+            except (FileNotFoundError, ValueError):
+                highest_reserved = self.seed()
+            atomic_write(self.path, str(highest_reserved + self.block_size))
+        return range(highest_reserved + 1, highest_reserved + self.block_size + 1)
+
+    def _discard_block(self):
+        self._lock = threading.Lock()
+        self._block = iter(())
+
+
+_allocators: dict[str, IdAllocator] = {}
+_allocators_lock = threading.Lock()
+
+
+def get_id_allocator(table: str, seed: Callable[[], int]) -> IdAllocator:
+    """
+    Returns the id allocator for the given table ("users" or "sessions"), creating it on first use. The counter file is
+    kept in the databases directory.
+    """
+    path = os.path.join(repository.database_directory, f"{table}.id_counter")
+    with _allocators_lock:
+        if path not in _allocators:
+            _allocators[path] = IdAllocator(path, seed=seed)
+        return _allocators[path]
@@ -0,0 +1,106 @@
+import json
+import logging
+import os
+import threading
+
+from pyscripts.file_lock import file_lock
+
+
+class Journal:
+    """
+    An append-only JSON-lines file. Appending a record is a single write at the end of the file, no matter how big the
+    file is. Every append is made durable with fsync, but the fsyncs are batched (group commit): while one thread is
+    waiting for fsync, other threads keep appending, and the next fsync covers all of them at once.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock_path = f"{path}.lock"
+        self._file = None
+        # Protects the file handle and the write counter
+        self._write_lock = threading.Lock()
+        # Only one thread calls fsync at a time. Threads that queue up here are often covered by the fsync before them.
+        self._sync_lock = threading.Lock()
+        self._written = 0
+        self._synced = 0
+
+    def size(self) -> int:
+        """
+        Returns the size of the journal file in bytes, or 0 if it doesn't exist yet
+        """
+        try:
+            return os.stat(self.path).st_size
+        except FileNotFoundError:
+            return 0
+
+    def append(self, record: dict) -> tuple[int, int]:
+        """
+        Appends a record to the journal and returns once it has been written to disk. Returns the (start, end) byte
+        offsets of the new line.
+        """
+        line = (json.dumps(record) + "\n").encode()
+        with self._write_lock:
+            if self._file is None:
+                self._file = open(self.path, "ab")
+            # Hold the file lock so that the line isn't interleaved with a compaction in another process
+            with file_lock(self.lock_path):
+                start = self._file.seek(0, os.SEEK_END)
+                self._file.write(line)
+                self._file.flush()
+            self._written += 1
+            sequence = self._written
+        self._sync(sequence)
+        return start, start + len(line)
+
+    def _sync(self, sequence: int):
+        """
+        Makes sure that everything up to and including the given write has been fsynced
+        """
+        with self._sync_lock:
+            if self._synced >= sequence:
+                # Another thread's fsync already covered this write
+                return
+            with self._write_lock:
+                target = self._written
+                file_descriptor = self._file.fileno()
+            os.fsync(file_descriptor)
+            self._synced = target
+
+    def read_from(self, offset: int) -> tuple[list[dict], int]:
+        """
+        Reads the records after the given byte offset. Returns the records and the offset to continue from next time.
+        A line that is still being written (no trailing newline yet) is left for the next read.
+        """
+        try:
+            with open(self.path, "rb") as infile:
+                infile.seek(offset)
+                data = infile.read()
+        except FileNotFoundError:
+            return [], 0
+
+        records = []
+        complete_length = data.rfind(b"\n") + 1
+        for line in data[:complete_length].splitlines():
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # A line that was cut off when the process died. Skip it rather than losing the rest of the journal.
+                logging.warning(f"Skipping corrupt line in {self.path}")
+        return records, offset + complete_length
+
+    def truncate(self):
+        """
+        Empties the journal. Must be called while holding the journal's file lock. The file is truncated in place rather
+        than replaced, so handles that other processes have open for appending stay valid.
+        """
+        with open(self.path, "ab") as outfile:
+            outfile.truncate(0)
+            os.fsync(outfile.fileno())
+
+    def close(self):
+        with self._write_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
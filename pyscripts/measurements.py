@@ -0,0 +1,145 @@
+import asyncio
+import json
+import math
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+
+class MeasurementJob:
+    """
+    A BAC measurement running in the background. The request that starts it gets the job's id straight away, and the
+    progress and result are fetched with separate requests.
+    """
+
+    def __init__(self, future: Future, window: float, user_id: int = None):
+        self.id = uuid.uuid4().hex
+        self.future = future
+        self.window = window
+        # The user being measured. Only they may see the result.
+        self.user_id = user_id
+        self.started = time.monotonic()
+
+    @property
+    def status(self) -> str:
+        """
+        Returns "measuring", "done" or "failed"
+        """
+        if not self.future.done():
+            return "measuring"
+        return "failed" if self.future.exception() is not None else "done"
+
+    def progress(self) -> float:
+        """
+        Returns how far through the measurement window the job is, from 0 to 1
+        """
+        if self.future.done():
+            return 1.0
+        return min((time.monotonic() - self.started) / self.window, 0.99)
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Waits up to `timeout` seconds for the measurement to finish. Returns True if it has finished.
+        """
+        try:
+            self.future.exception(timeout=timeout)
+        except FutureTimeoutError:
+            return False
+        return True
+
+    async def wait_async(self, timeout: float) -> bool:
+        """
+        Like wait, for async code. Waits without holding a thread, so many requests can wait at once.
+        """
+        try:
+            # Shielded, so that timing out doesn't cancel the measurement
+            await asyncio.wait_for(
+                asyncio.shield(asyncio.wrap_future(self.future)), timeout
+            )
+        except asyncio.TimeoutError:
+            return False
+        except Exception:
+            # The measurement failed, which also means it has finished
+            pass
+        return True
+
+    def to_dict(self) -> dict:
+        status = self.status
+        result = {"id": self.id, "status": status, "progress": self.progress()}
+        if status == "done":
+            reading = self.future.result()
+            # Round to 3 decimal places, as the page used to get
+            result["bac"] = round(reading.bac, 3)
+            result["confidence"] = reading.confidence
+            result["seconds"] = round(reading.seconds, 2)
+        elif status == "failed":
+            result["error"] = str(self.future.exception())
+        return result
+
+    def to_event(self, final: bool) -> str:
+        """
+        Returns the job's progress as a server-sent event: a "progress" event, or once the job has finished (`final`), a
+        "result" or "failed" event with the final status
+        """
+        data = self.to_dict()
+        if not final:
+            event = "progress"
+        else:
+            event = "result" if data["status"] == "done" else "failed"
+        return "event: {}\ndata: {}\n\n".format(event, json.dumps(data))
+
+
+def wait_seconds(value: str or None, max_wait: float) -> float:
+    """
+    Parses the number of seconds a request asked to wait for a measurement (its ?wait= parameter), between 0 and
+    `max_wait`. No value means no waiting. Raises ValueError if the value isn't a number.
+    """
+    if value is None:
+        return 0.0
+    seconds = float(value)
+    if math.isnan(seconds):
+        raise ValueError(f"Not a number of seconds: {value}")
+    return min(max(seconds, 0.0), max_wait)
+
+
+class MeasurementJobs:
+    """
+    Keeps track of running and recently finished measurement jobs. Finished jobs are forgotten after `keep_for`
+    seconds.
+    """
+
+    def __init__(self, keep_for: float = 300):
+        self.keep_for = keep_for
+        self._jobs: dict[str, MeasurementJob] = {}
+        self._lock = threading.Lock()
+
+    def start(
+        self, future: Future, window: float, user_id: int = None
+    ) -> MeasurementJob:
+        """
+        Registers a measurement of the given user that has been started and returns its job
+        """
+        job = MeasurementJob(future=future, window=window, user_id=user_id)
+        with self._lock:
+            self._remove_expired()
+            self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str, user_id: int = None) -> MeasurementJob or None:
+        """
+        Returns the job with the given id, or None if there is none. With a user id, jobs measuring other users are
+        treated as if they didn't exist.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None or (user_id is not None and job.user_id != user_id):
+            return None
+        return job
+
+    def _remove_expired(self):
+        expired_before = time.monotonic() - self.keep_for
+        for job_id, job in list(self._jobs.items()):
+            if job.future.done() and job.started < expired_before:
+                del self._jobs[job_id]
@@ -0,0 +1,242 @@
+import bisect
+import contextlib
+import threading
+import time
+
+# Upper bounds (in seconds) of the latency histogram buckets, from 0.1 ms to 10 s
+default_buckets = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+class Metric:
+    """
+    A named metric with a value per combination of label values, e.g. one per route. Observing takes a lock and a
+    dict lookup, so the metrics can be updated on every request and every storage call without costing much.
+    """
+
+    type_name = None
+
+    def __init__(self, registry: "Registry", name: str, help: str, labels=()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _label_text(self, label_values: tuple, extra: str = None) -> str:
+        pairs = [
+            f'{label}="{_escape(str(value))}"'
+            for label, value in zip(self.labels, label_values)
+        ]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> list[str]:
+        """
+        Returns the lines of the metric in the Prometheus text format
+        """
+        lines = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        with self._lock:
+            values = {
+                label_values: self._copy(value)
+                for label_values, value in self._values.items()
+            }
+        for label_values, value in sorted(values.items()):
+            lines.extend(self._render_value(label_values, value))
+        return lines
+
+    def _copy(self, value):
+        return value
+
+    def _render_value(self, label_values: tuple, value) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """
+    A count that only goes up, e.g. the number of requests. Its name should end in _total, as the samples are named
+    after the metric and the HELP and TYPE lines have to use the same name.
+    """
+
+    type_name = "counter"
+
+    def inc(self, *label_values, amount: float = 1):
+        if not self.registry.enabled:
+            return
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values) -> float:
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+    def _render_value(self, label_values: tuple, value) -> list[str]:
+        return [f"{self.name}{self._label_text(label_values)} {value}"]
+
+
+class Histogram(Metric):
+    """
+    Counts observations (e.g. durations in seconds) in buckets, and keeps their count and sum, so that percentiles and
+    means can be worked out from it
+    """
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        registry: "Registry",
+        name: str,
+        help: str,
+        labels=(),
+        buckets: tuple = default_buckets,
+    ):
+        super().__init__(registry, name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *label_values):
+        if not self.registry.enabled:
+            return
+        # Each observation is only counted in its own bucket. The buckets are added up when rendering.
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(label_values)
+            if counts is None:
+                # One count per bucket, one for values above the last bucket, then the sum of the values
+                counts = self._values[label_values] = [0] * (len(self.buckets) + 2)
+            counts[bucket] += 1
+            counts[-1] += value
+
+    @contextlib.contextmanager
+    def time(self, *label_values):
+        """
+        Observes how many seconds the body of the with statement takes
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def count(self, *label_values) -> int:
+        with self._lock:
+            counts = self._values.get(label_values)
+            return sum(counts[:-1]) if counts else 0
+
+    def _copy(self, value):
+        return list(value)
+
+    def _render_value(self, label_values: tuple, value) -> list[str]:
+        lines = []
+        cumulative = 0
+        for upper_bound, count in zip(self.buckets + ("+Inf",), value[:-1]):
+            cumulative += count
+            bucket_labels = self._label_text(label_values, 'le="%s"' % upper_bound)
+            lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+        lines.append(f"{self.name}_sum{self._label_text(label_values)} {value[-1]}")
+        lines.append(f"{self.name}_count{self._label_text(label_values)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """
+    Holds the app's metrics and renders them for /metrics. Set `enabled` to False to stop collecting.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self._metrics: list[Metric] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def counter(self, name: str, help: str, labels=()) -> Counter:
+        return Counter(self, name, help, labels)
+
+    def histogram(
+        self, name: str, help: str, labels=(), buckets: tuple = default_buckets
+    ) -> Histogram:
+        return Histogram(self, name, help, labels, buckets)
+
+    def render(self) -> str:
+        """
+        Returns all metrics in the Prometheus text exposition format
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+# The metrics of the app. Modules add their own metrics to it, and app.py serves it on /metrics.
+registry = Registry()
+
+request_seconds = registry.histogram(
+    "breathalyzer_request_seconds",
+    "Time to handle a request, per route",
+    labels=("route", "method"),
+)
+requests = registry.counter(
+    "breathalyzer_requests_total",
+    "Requests handled, per route and status code",
+    labels=("route", "method", "status"),
+)
+storage_seconds = registry.histogram(
+    "breathalyzer_storage_seconds",
+    "Time spent in the storage backend, per operation",
+    labels=("table", "operation"),
+)
+render_seconds = registry.histogram(
+    "breathalyzer_render_seconds",
+    "Time to render a template",
+    labels=("template",),
+)
+recommendation_seconds = registry.histogram(
+    "breathalyzer_recommendation_seconds",
+    "Time to work out recommendations, per step",
+    labels=("step",),
+)
+sensor_read_seconds = registry.histogram(
+    "breathalyzer_sensor_read_seconds",
+    "Time spent waiting for a line from the sensor's serial port",
+    labels=("port",),
+)
+sensor_samples = registry.counter(
+    "breathalyzer_sensor_samples_total",
+    "Samples read from the sensor",
+    labels=("port",),
+)
+sensor_measurement_seconds = registry.histogram(
+    "breathalyzer_sensor_measurement_seconds",
+    "Time from starting a BAC measurement to its result",
+    labels=("port", "result"),
+)
@@ -0,0 +1,69 @@
+"""
+One-shot migration of the JSON databases (databases/*.json) into an SQLite database.
+
+Run from the project root with: python -m pyscripts.migrate_json_to_sqlite [path/to/database.sqlite3]
+Then set storage_backend = "sqlite" in app.py.
+"""
+
+import logging
+import sys
+
+from pyscripts.storage import create_storage
+from pyscripts.storage import JsonStorage
+from pyscripts.storage import SqliteStorage
+from pyscripts.storage import UsernameTaken
+
+
+def duplicate_usernames(users: dict[str, dict]) -> dict[str, list[str]]:
+    """
+    Returns the ids of the users sharing each username that more than one user has, keyed by username. The JSON
+    databases allowed these (the first user with the username was the one who could log in), SQLite doesn't.
+    """
+    ids_by_username = {}
+    for user_id, record in users.items():
+        ids_by_username.setdefault(record["username"], []).append(user_id)
+    return {
+        username: user_ids
+        for username, user_ids in ids_by_username.items()
+        if len(user_ids) > 1
+    }
+
+
+def migrate(source: JsonStorage, target: SqliteStorage) -> dict[str, int]:
+    """
+    Copies all users, sessions, beverages and the drink log from the JSON storage into the SQLite storage in one
+    transaction. Existing rows with the same ids are replaced, so running the migration twice is harmless. Returns the
+    number of records copied per table.
+
+    Raises UsernameTaken, before copying anything, if several users share a username, or if a username belongs to
+    another user in the SQLite database. Rename the users in users.json and run the migration again.
+    """
+    users = source.all_users()
+    duplicates = duplicate_usernames(users)
+    if duplicates:
+        raise UsernameTaken(
+            f"Usernames used by more than one user (username: user ids): {duplicates}"
+        )
+    records = {
+        "users": users,
+        "sessions": source.all_sessions(),
+        "beverages": source.all_beverages(),
+        "drink_log": source.all_drink_log_entries(),
+    }
+    target.import_records(**records)
+    counts = {table: len(table_records) for table, table_records in records.items()}
+    logging.info(f"Migrated {counts}")
+    return counts
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sqlite_path = sys.argv[1] if len(sys.argv) > 1 else None
+    target = create_storage("sqlite", sqlite_path=sqlite_path)
+    try:
+        counts = migrate(JsonStorage(), target)
+    except UsernameTaken as error:
+        sys.exit(f"Nothing was migrated. {error}")
+    finally:
+        target.close()
+    print(f"Migrated {counts} into {target.path}")
@@ -1,72 +1,108 @@
 import dataclasses
-import json
-import logging
+import functools
 import math
-import time
 from datetime import datetime
-from datetime import timedelta
 
-import serial
+from pyscripts.catalog import CatalogService
+from pyscripts.catalog import CatalogSnapshot
+from pyscripts.current_sessions import CurrentSessionIndex
+from pyscripts.drink_index import AlcoholContentIndex
+from pyscripts.drinker_contexts import DrinkerContexts
+from pyscripts.ids import get_id_allocator
+from pyscripts.sensor import measure_bac
+from pyscripts.sensor import measure_bac_async
+from pyscripts.storage import get_storage
+from pyscripts.unit_of_work import load_many_once
+from pyscripts.unit_of_work import load_once
+from pyscripts.unit_of_work import remember
+
+# Parameters of the BAC model, per sex. A standard drink raises BAC by a * exp(b * weight), and it takes
+# c * exp(d * weight) hours to metabolize one standard drink.
+bac_increase_coefficients = {"male": (0.0662, -0.014), "female": (0.1004, -0.016)}
+metabolism_coefficients = {"male": (3.9584, -0.013), "female": (5.1596, -0.014)}
+standard_drink_ml = 30  # 30ml of alcohol is considered a standard drink in our app
+legal_driving_limit = 0.05
+
+
+@dataclasses.dataclass(frozen=True)
+class BacCoefficients:
+    """
+    The parts of the BAC model that only depend on a drinker's sex and weight. Computing them involves math.exp, so
+    they are worked out once per (sex, weight) and cached, see get_bac_coefficients.
+    """
+
+    # Amount BAC raises per standard drink (30 ml of pure alcohol)
+    bac_per_standard_drink: float
+    # Amount of BAC the body metabolizes per second
+    bac_metabolized_per_second: float
+    # Seconds it takes to metabolize 1.0 BAC, i.e. seconds until the legal limit per unit of BAC above it
+    seconds_per_bac: float
 
 
-def get_max_potentiometer_value(serial_port_name: str) -> float:
+@functools.lru_cache(maxsize=1024)
+def get_bac_coefficients(sex: str, weight: float) -> BacCoefficients:
     """
-    Connects to the serial port and collects data for 5 seconds. Returns the maximum value
+    Returns the BAC coefficients for a drinker of the given sex and weight. Anything other than "male" uses the female
+    coefficients.
+    """
+    sex = "male" if sex == "male" else "female"
+    a1, a2 = bac_increase_coefficients[sex]
+    b1, b2 = metabolism_coefficients[sex]
+    # Amount BAC raises per 30 ml of pure alcohol
+    bac_increase_per_drink = a1 * math.exp(a2 * weight)
+    # Seconds to metabolize 30 ml alc. by weight
+    seconds_to_metabolize_one_drink = (b1 * math.exp(b2 * weight)) * 3600
+
+    drinks_metabolized_per_second = 1 / seconds_to_metabolize_one_drink
+    bac_metabolized_per_second = drinks_metabolized_per_second * bac_increase_per_drink
+    return BacCoefficients(
+        bac_per_standard_drink=bac_increase_per_drink,
+        bac_metabolized_per_second=bac_metabolized_per_second,
+        seconds_per_bac=1 / bac_metabolized_per_second,
+    )
+
+
+def get_max_potentiometer_value(serial_port_name: str, window: float = 5.0) -> float:
+    """
+    Collects data from the serial port for up to 5 seconds, stopping early once the reading has settled. Returns the
+    reading converted to BAC. The port is kept open by a background reader (see pyscripts/sensor.py), so this only waits
+    for the measurement itself. Use pyscripts.sensor.measure_bac to start a measurement without waiting for it, and to
+    get the confidence of the reading.
     :param serial_port_name: The name of the serial port
     """
-    # Connect to serial port. This is likely to be different on your computer.
-    serial_port_name = "COM7"
-    ser = serial.Serial(serial_port_name, 9600)
-
-    # Loop that runs for five seconds while data is collected. Decode and remove whitespace
-    data = []
-    for i in range(0, 50):
-        # Read data from serial port
-        data.append(float(ser.readline().decode().strip()))
-        # Wait for 0.1 seconds
-        time.sleep(0.1)
-    # Close serial port
-    ser.close()
-
-    # When turned up all the way the potentiometer reads 4095. This is the maximum value.
-    maximum_possible_potentio_value = 4095
-    maximum_possible_bac = 0.3  # 0.3% BAC, which is close to comatosed
-    maximum_measured = max(data)
-    conversion_to_bac = (
-        maximum_possible_bac / maximum_possible_potentio_value
-    ) * maximum_measured
-    return conversion_to_bac
+    return measure_bac(serial_port_name, window=window).result().bac
+
+
+async def get_max_potentiometer_value_async(
+    serial_port_name: str, window: float = 5.0
+) -> float:
+    """
+    Like get_max_potentiometer_value, for async code. Awaits the reading instead of blocking the thread.
+    """
+    return (await measure_bac_async(serial_port_name, window=window)).bac
 
 
 def get_all_drinkers() -> dict[str, dict]:
     """
     Returns a dictionary of all drinkers from the database.
     """
-    try:
-        with open("databases/users.json", "r") as infile:
-            drinkers = json.load(infile)
-    except Exception:
-        logging.exception("Unable to load database file")
-    return drinkers
+    return dict(get_storage().all_users())
 
 
 def get_all_drinks_from_db() -> list["Drink"]:
     """
     Returns a list of Drink objects from the database.
     """
-    try:
-        with open("databases/beverages.json", "r") as infile:
-            beverages_from_db = json.load(infile)
-    except Exception as e:
-        logging.exception("Unable to load database file", e)
+    beverages_from_db = get_storage().all_beverages()
 
     beverages_list = []
-    for _, beverage in beverages_from_db.items():
+    for beverage_id, beverage in beverages_from_db.items():
         beverages = Drink(
+            id=int(beverage_id),
             name=beverage["name"],
             type=beverage["type"],
             alcohol_content=float(beverage["alcohol_content"]),
-            ingredients=beverage["ingredients"],
+            ingredients=tuple(beverage["ingredients"]),
             image_path=beverage["image_path"],
         )
         beverages_list.append(beverages)
@@ -77,12 +113,7 @@ def get_all_sessions_from_db() -> dict[str, dict]:
     """
     Returns a dictionary of all sessions from the database.
     """
-    try:
-        with open("databases/sessions.json", "r") as infile:
-            sessions_from_db = json.load(infile)
-    except Exception as e:
-        logging.error("Unable to load database file", e)
-    return sessions_from_db
+    return dict(get_storage().all_sessions())
 
 
 def get_all_session_objects_from_db() -> list["Session"]:
@@ -90,79 +121,172 @@ def get_all_session_objects_from_db() -> list["Session"]:
     Returns a list of Session objects from the database.
     """
     # Get all sessions from database
-    sessions_from_db = get_all_sessions_from_db()
+    sessions_from_db = get_storage().all_sessions()
+
+    # Create session objects. Take a copy of the items first, as new sessions may be added while we iterate.
+    return [
+        Session.from_db_record(session_id, session_from_db)
+        for session_id, session_from_db in list(sessions_from_db.items())
+    ]
+
+
+def _catalog_version() -> tuple:
+    storage = get_storage()
+    # The storage backend is part of the version, so switching backends reloads the catalog
+    return storage, storage.beverages_version()
+
+
+# The beverage catalog, parsed once and kept in memory until it changes
+catalog = CatalogService(
+    load_drinks=get_all_drinks_from_db, get_version=_catalog_version
+)
+
+
+def _sessions_version() -> tuple:
+    storage = get_storage()
+    # The storage backend is part of the version, so switching backends drops the index
+    return storage, storage.sessions_version()
+
+
+def _load_latest_sessions(user_ids: list[int]) -> dict[int, "Session"]:
+    # One user at a time is the common case, and the single-user lookup is the cheapest read for it
+    if len(user_ids) == 1:
+        latest = get_storage().get_latest_session_for_user(user_ids[0])
+        return {user_ids[0]: Session.from_db_record(*latest)} if latest else {}
+    latest_sessions = get_storage().get_latest_sessions_for_users(user_ids)
+    return {
+        user_id: Session.from_db_record(*latest)
+        for user_id, latest in latest_sessions.items()
+    }
+
+
+# Each user's current session, kept up to date as sessions are saved
+current_sessions = CurrentSessionIndex(
+    load_latest=_load_latest_sessions, get_version=_sessions_version
+)
+
+
+def _load_drinker(user_id: int) -> "Drinker" or None:
+    return Drinker._load_from_db(user_id=user_id)
 
-    # Create session objects
-    sessions = []
-    for session_id, session_from_db in sessions_from_db.items():
-        if drivetime := session_from_db["drive_time"]:
-            drivetime = datetime.fromisoformat(drivetime)
-        else:
-            drivetime = None
-        session = Session(
-            id=int(session_id),
-            user_id=int(session_from_db["user_id"]),
-            max_alcohol=float(session_from_db["max_alcohol"]),
-            start_time=datetime.fromisoformat(session_from_db["start_time"]),
-            drive_time=drivetime,
-        )
-        sessions.append(session)
-    return sessions
+
+# The logged in drinkers
+drinker_contexts = DrinkerContexts(
+    load_drinker=_load_drinker,
+    revoke_token=lambda token, expires_at: get_storage().revoke_token(
+        token, expires_at
+    ),
+    is_token_revoked=lambda token: get_storage().is_token_revoked(token),
+)
+
+
+def get_catalog() -> CatalogSnapshot:
+    """
+    Returns the current beverage catalog. The same snapshot is used for the whole request.
+    """
+    return load_once("catalog", None, catalog.snapshot)
+
+
+def get_drink_index() -> AlcoholContentIndex:
+    """
+    Returns the beverage catalog indexed by alcohol content. The index is built when the catalog is first loaded and is
+    only rebuilt when the catalog changes.
+    """
+    return get_catalog().index
+
+
+def _count_drinks_less_than_max_alcohol(
+    drinker: "Drinker",
+    current_bac: float,
+    current_session: "Session",
+    index: AlcoholContentIndex,
+) -> int:
+    """
+    Returns how many drinks at the start of the index give a BAC less than the max alcohol for the session
+    """
+
+    def less_than_max_alcohol(drink: Drink) -> bool:
+        bac_after_drink = drinker.bac_after_drink(drink=drink, current_bac=current_bac)
+        return bac_after_drink < current_session.max_alcohol
+
+    # current_bac + bac_per_standard_drink * alcohol_content / standard_drink_ml < max_alcohol, solved for alcohol_content
+    alcohol_content_limit = (
+        (current_session.max_alcohol - current_bac)
+        * standard_drink_ml
+        / drinker.coefficients.bac_per_standard_drink
+    )
+    return index.count_passing(alcohol_content_limit, less_than_max_alcohol)
 
 
 def get_drink_candidates_less_than_max_alcohol(
-    drinker: "Drinker", current_bac: float
+    drinker: "Drinker", current_bac: float, current_session: "Session" = None
 ) -> list:
     """
-    Returns a list of drinks that are less than the max alcohol for the current session. The list isn't sorted.
+    Returns a list of drinks that are less than the max alcohol for the current session. The list is sorted by alcohol
+    content, lowest to highest. Pass the drinker's current session if the caller already has it.
     """
     # Get current session
-    current_session = drinker.get_current_session()
-
-    # Get all drinks from database
-    all_drinks = get_all_drinks_from_db()
-
-    # Get drinks that give a rise in BAC less than the max alcohol for the current session.
-    candidate_drinks = []
-    for drink in all_drinks:
-        # print(drink.name, drinker.bac_after_drink(drink=drink, current_bac=current_bac))
-        if (
-            drinker.bac_after_drink(drink=drink, current_bac=current_bac)
-            < current_session.max_alcohol
-        ):
-            candidate_drinks.append(drink)
-    return candidate_drinks
+    current_session = current_session or drinker.get_current_session()
+
+    # Drinks that give a rise in BAC less than the max alcohol are a prefix of the drinks sorted by alcohol content
+    index = get_drink_index()
+    count = _count_drinks_less_than_max_alcohol(
+        drinker=drinker,
+        current_bac=current_bac,
+        current_session=current_session,
+        index=index,
+    )
+    return list(index.drinks[:count])
 
 
-def get_drink_candidates_for_drive_time(drinker: "Drinker", current_bac: float) -> list:
+def get_drink_candidates_for_drive_time(
+    drinker: "Drinker", current_bac: float, current_session: "Session" = None
+) -> list:
     """
     Returns a list of drinks that are less than the max alcohol for the current session and that will allow the user to
-    drive by the drive time of the current session. The list is sorted by alcohol content, highest to lowest. The list
-    isn't sorted.
+    drive by the drive time of the current session. The list is sorted by alcohol content, lowest to highest. Pass the
+    drinker's current session if the caller already has it.
     """
+    current_session = current_session or drinker.get_current_session()
+    seconds_until_drive_time = current_session.seconds_until_drive_time()
+    # If the drive time has passed, no drink lets the user drive by then
+    if seconds_until_drive_time < 0:
+        return []
+
     # Get drinks that give a rise in BAC less than the max alcohol for the current session.
-    current_session = drinker.get_current_session()
-    drinks_candidates_less_that_max_alcohol = (
-        get_drink_candidates_less_than_max_alcohol(
-            drinker=drinker, current_bac=current_bac
-        )
+    index = get_drink_index()
+    count = _count_drinks_less_than_max_alcohol(
+        drinker=drinker,
+        current_bac=current_bac,
+        current_session=current_session,
+        index=index,
     )
 
-    # Take list from above and select drinks that will allow the user to drive by the drive time of the current session.
-    candidate_drinks = []
-    for drink in drinks_candidates_less_that_max_alcohol:
+    # Of those, select drinks that will allow the user to drive by the drive time of the current session. If the number
+    # of seconds until the user can drive is less than the number of seconds until the drive time, the drink is a
+    # candidate. That is also a prefix of the index.
+    def lets_drinker_drive_in_time(drink: Drink) -> bool:
         bac_after_drink = drinker.bac_after_drink(drink=drink, current_bac=current_bac)
         number_of_seconds_until_can_drive = drinker.number_seconds_until_can_drive(
             current_bac=bac_after_drink
         )
-        # If the number of seconds until the user can drive is less than the number of seconds until the drive time of the
-        # current session, then the drink is a candidate.
-        if (
-            number_of_seconds_until_can_drive
-            > current_session.seconds_until_drive_time()
-        ):
-            candidate_drinks.append(drink)
-    return candidate_drinks
+        return number_of_seconds_until_can_drive <= seconds_until_drive_time
+
+    # The highest BAC the user can have now and still be at the legal limit by the drive time
+    max_bac_after_drink = (
+        legal_driving_limit
+        + seconds_until_drive_time / drinker.coefficients.seconds_per_bac
+    )
+    alcohol_content_limit = (
+        (max_bac_after_drink - current_bac)
+        * standard_drink_ml
+        / drinker.coefficients.bac_per_standard_drink
+    )
+    count = min(
+        count,
+        index.count_passing(alcohol_content_limit, lets_drinker_drive_in_time),
+    )
+    return list(index.drinks[:count])
 
 
 class Drinker:
@@ -170,6 +294,17 @@ class Drinker:
     Corresponds to a user in the database. The user can have multiple sessions.
     """
 
+    # No per-instance __dict__, to keep drinkers small
+    __slots__ = (
+        "id",
+        "username",
+        "password",
+        "dob",
+        "_sex",
+        "_weight",
+        "_coefficients",
+    )
+
     id: int
     username: str
     dob: datetime
@@ -184,151 +319,181 @@ class Drinker:
         self.sex = sex.lower()
         self.weight = weight
 
+    @property
+    def sex(self) -> str:
+        return self._sex
+
+    @sex.setter
+    def sex(self, sex: str):
+        self._sex = sex
+        # The BAC coefficients depend on sex, so they need to be looked up again
+        self._coefficients = None
+
+    @property
+    def weight(self) -> int:
+        return self._weight
+
+    @weight.setter
+    def weight(self, weight: int):
+        self._weight = weight
+        # The BAC coefficients depend on weight, so they need to be looked up again
+        self._coefficients = None
+
+    @property
+    def coefficients(self) -> BacCoefficients:
+        """
+        Returns the BAC coefficients for the drinker's sex and weight
+        """
+        if self._coefficients is None:
+            self._coefficients = get_bac_coefficients(self.sex, self.weight)
+        return self._coefficients
+
     def _get_new_id(self) -> int:
         """
         Returns the next available id for a drinker
         """
-        # Get all drinkers from the database
-        drinkers = get_all_drinkers()
-
-        # If there are any drinkers, return the max id + 1
-        if drinkers:
-            return max([int(k) for k in drinkers.keys()]) + 1
-        else:
-            return 1
+        # Ids are handed out from blocks reserved in a counter file, so no database needs to be read
+        return get_id_allocator("users", seed=get_storage().max_user_id).next_id()
 
     @staticmethod
     def get_drinker_from_db(
         username: str = None, user_id: int = None
     ) -> "Drinker" or None:
         """
-        Returns a Drinker object if the user exists in the database, otherwise returns None
+        Returns a Drinker object if the user exists in the database, otherwise returns None. Within a request the same
+        drinker is only loaded once.
         """
         assert username or user_id, "Must provide either username or user_id"
+        if user_id:
+            return load_once(
+                "drinker",
+                int(user_id),
+                lambda: Drinker._load_from_db(username=username, user_id=user_id),
+            )
+        drinker = load_once(
+            "drinker_by_username",
+            username,
+            lambda: Drinker._load_from_db(username=username),
+        )
+        if drinker is not None:
+            remember("drinker", drinker.id, drinker)
+        return drinker
 
-        # Get all drinkers from the database
-        all_drinkers = get_all_drinkers()
-
-        # Find the drinker with the matching username or id
+    @staticmethod
+    def _load_from_db(username: str = None, user_id: int = None) -> "Drinker" or None:
+        # Find the drinker with the matching id or username using the storage backend's indexes
         selected_id, selected_drinker = None, None
-        for id, drinker in all_drinkers.items():
-            if (user_id and user_id == int(id)) or (
-                username and drinker["username"] == username
-            ):
-                selected_id, selected_drinker = int(id), drinker
-                break
+        if user_id:
+            selected_id, selected_drinker = user_id, get_storage().get_user(user_id)
+        if not selected_drinker and username:
+            selected_id, selected_drinker = get_storage().get_user_by_username(
+                username
+            ) or (None, None)
 
         # If no drinker was found, return None
         if not selected_drinker:
             return None
 
         # Create and return a Drinker object
-        drinker = Drinker(
-            id=int(selected_id),
-            username=selected_drinker["username"],
-            password=selected_drinker["password"],
-            dob=selected_drinker["dob"],
-            sex=selected_drinker["sex"],
-            weight=int(selected_drinker["weight"]),
+        return Drinker.from_db_record(selected_id, selected_drinker)
+
+    @staticmethod
+    def from_db_record(user_id: int or str, user_from_db: dict) -> "Drinker":
+        """
+        Creates a Drinker object from a record in the users database
+        """
+        return Drinker(
+            id=int(user_id),
+            username=user_from_db["username"],
+            password=user_from_db["password"],
+            dob=datetime.fromisoformat(user_from_db["dob"]),
+            sex=user_from_db["sex"],
+            weight=int(user_from_db["weight"]),
         )
-        return drinker
 
-    def get_current_session(self) -> "Session" or None:
+    @staticmethod
+    def get_drinkers_from_db(user_ids: list[int]) -> dict[int, "Drinker" or None]:
         """
-        Gets the current session for the user. If the user has a session that started less than 24 hours ago, it returns
-        that session. Otherwise, it returns None.
+        Returns the drinkers with the given ids, keyed by id, reading them from the database together. Unknown ids map to
+        None.
         """
-        #
-        sessions_from_db = get_all_session_objects_from_db()
 
-        # Get session for user with most recent start time
-        most_recent_session = None
-        # Iterate through all sessions in the database and find the most recent session for the user
-        for session in sessions_from_db:
-            if session.user_id != self.id:
-                continue
-            if most_recent_session is None:
-                most_recent_session = session
-            elif session.start_time > most_recent_session.start_time:
-                most_recent_session = session
+        def load_drinkers(missing_ids: list[int]) -> dict[int, Drinker]:
+            return {
+                user_id: Drinker.from_db_record(user_id, record)
+                for user_id, record in get_storage().get_users(missing_ids).items()
+            }
 
-        # If the most recent session is less than 24 hours ago, return it. Otherwise, return None
-        threshold = timedelta(hours=24)
-        if most_recent_session:
-            time_diff = datetime.now() - most_recent_session.start_time
+        return load_many_once(
+            "drinker", [int(user_id) for user_id in user_ids], load_drinkers
+        )
 
-            if datetime.now() - most_recent_session.start_time < threshold:
-                return most_recent_session
+    def get_current_session(self) -> "Session" or None:
+        """
+        Gets the current session for the user. If the user has a session that started less than 24 hours ago, it returns
+        that session. Otherwise, it returns None.
+        """
+        # The index keeps each user's most recent session until it is 24 hours old
+        return load_once(
+            "current_session", self.id, lambda: current_sessions.get(self.id)
+        )
 
-        return None
+    @staticmethod
+    def get_current_sessions(user_ids: list[int]) -> dict[int, "Session" or None]:
+        """
+        Returns the current session of each of the given users (None if they don't have one), keyed by user id. The
+        sessions that need reading from the database are read together.
+        """
+        return load_many_once(
+            "current_session",
+            [int(user_id) for user_id in user_ids],
+            current_sessions.get_many,
+        )
 
     def bac_after_drink(self, drink: "Drink", current_bac: float) -> float:
         """
         Returns the drinkers BAC after drinking the drink, taking into account the current BAC
         """
-        standard_drinks = (
-            drink.alcohol_content / 30
-        )  # 30ml of alcohol is considered a standard drink in our app
-
-        if self.sex == "male":
-            a, b = 0.0662, -0.014
-        else:  # Female
-            a, b = 0.1004, -0.016
-        bac_increase_per_drink = a * math.exp(b * self.weight)
-
-        return current_bac + (bac_increase_per_drink * standard_drinks)
+        standard_drinks = drink.alcohol_content / standard_drink_ml
+        return current_bac + (
+            self.coefficients.bac_per_standard_drink * standard_drinks
+        )
 
     def number_seconds_until_can_drive(self, current_bac: float) -> float:
         """
         Returns the number of seconds until the person can drive, or 0 if they can drive now
         """
-        if current_bac <= 0.05:  # 0.05 is the legal limit
+        if current_bac <= legal_driving_limit:
             return 0
 
-        # Calculate the BAC per drink for the person and the time it takes to metabolize one drink
-        if self.sex == "male":
-            a1, a2 = 0.0662, -0.014
-            b1, b2 = 3.9584, -0.013
-        else:  # female
-            a1, a2 = 0.1004, -0.016
-            b1, b2 = 5.1596, -0.014
-        # Amount BAC raises per 30 ml of pure alcohol
-        bac_increase_per_drink = a1 * math.exp(a2 * self.weight)
-        # Seconds to metabolize 30 ml alc. by weight
-        seconds_to_metabolize_one_drink = (b1 * math.exp(b2 * self.weight)) * 3600
-
-        # Calculate the current BAC and time to sober
-        drinks_metabolized_per_second = 1 / seconds_to_metabolize_one_drink
-        bac_metabolized_per_second = (
-            drinks_metabolized_per_second * bac_increase_per_drink
-        )
-        seconds_to_sober = (current_bac - 0.05) / bac_metabolized_per_second
+        # Time to sober is linear in how far the BAC is above the legal limit
+        seconds_to_sober = (
+            current_bac - legal_driving_limit
+        ) * self.coefficients.seconds_per_bac
 
         return seconds_to_sober
 
-    def save_to_db(self):
+    def save_to_db(self, new: bool = False):
         """
-        Saves the user to the database
+        Saves the user to the database. Pass new=True for a user that isn't in the database yet, which raises
+        UsernameTaken if someone else has the username.
         """
-        # Load the database
-        drinkers = get_all_drinkers()
-        # Add the user to the database
-        drinkers[str(self.id)] = {
-            "username": self.username,
-            "password": self.password,
-            # Convert datetime to isoformat string
-            "dob": self.dob.isoformat(),
-            "sex": self.sex,
-            "weight": str(self.weight),
-        }
-        # Save the database
-        try:
-            with open("databases/users.json", "w") as outfile:
-                json.dump(drinkers, outfile)
-                logging.info("Saved to database")
-        except Exception:
-            logging.exception("Unable to load database file")
-        return drinkers
+        # Add the user to the database, or update them
+        save = get_storage().add_user if new else get_storage().save_user
+        save(
+            self.id,
+            {
+                "username": self.username,
+                "password": self.password,
+                # Convert datetime to isoformat string
+                "dob": self.dob.isoformat(),
+                "sex": self.sex,
+                "weight": str(self.weight),
+            },
+        )
+        remember("drinker", self.id, self)
+        remember("drinker_by_username", self.username, self)
+        drinker_contexts.drinker_saved(self)
 
     def __str__(self):
         return f"Drinker: {self.username}"
@@ -339,13 +504,17 @@ class Session:
     Represents a session of drinking for a user
     """
 
+    # No per-instance __dict__, to keep sessions small
+    __slots__ = ("id", "user_id", "max_alcohol", "start_time", "drive_time")
+
     qualitative_to_bac: dict = {
         "Tipsy": 0.05,
         "Inbetween": 0.07,
         "Drunk": 0.10,
         "Really Drunk": 0.25,
     }
-    bac_to_qualitative: dict
+    # The same map with keys and values swapped. Shared by all sessions.
+    bac_to_qualitative: dict = {v: k for k, v in qualitative_to_bac.items()}
 
     def __init__(
         self,
@@ -361,8 +530,23 @@ class Session:
         self.max_alcohol = max_alcohol
         self.start_time = start_time
         self.drive_time = drive_time
-        # Create a dict that maps bac to qualitative. Keys and values are swapped.
-        self.bac_to_qualitative = {v: k for k, v in self.qualitative_to_bac.items()}
+
+    @staticmethod
+    def from_db_record(session_id: int or str, session_from_db: dict) -> "Session":
+        """
+        Creates a Session object from a record in the sessions database
+        """
+        if drivetime := session_from_db["drive_time"]:
+            drivetime = datetime.fromisoformat(drivetime)
+        else:
+            drivetime = None
+        return Session(
+            id=int(session_id),
+            user_id=int(session_from_db["user_id"]),
+            max_alcohol=float(session_from_db["max_alcohol"]),
+            start_time=datetime.fromisoformat(session_from_db["start_time"]),
+            drive_time=drivetime,
+        )
 
     def get_qualitative_max_alcohol(self) -> float:
         """
@@ -374,12 +558,8 @@ class Session:
         """
         Returns the next available id for a session
         """
-        sessions = get_all_sessions_from_db()
-        if sessions:
-            # convert keys to ints and return the max + 1
-            return max([int(k) for k in sessions.keys()]) + 1
-        else:
-            return 1
+        # Ids are handed out from blocks reserved in a counter file, so no database needs to be read
+        return get_id_allocator("sessions", seed=get_storage().max_session_id).next_id()
 
     def seconds_until_drive_time(self) -> int or None:
         """
@@ -387,21 +567,19 @@ class Session:
         """
         if self.drive_time:
             time_diff = self.drive_time - datetime.now()
-            return round(time_diff.total_seconds() / 3600)
+            return round(time_diff.total_seconds())
         else:
             return
 
-    def save_to_db(self) -> dict[str, dict] or None:
+    def save_to_db(self, new: bool = False):
         """
-        Saves the session to the database
+        Saves the session to the database. Pass new=True for a session that isn't in the database yet.
         """
         # Check that all required fields are set
         assert self.user_id, "User id must be set"
         assert self.start_time, "Start time must be set"
         assert self.max_alcohol, "Max alcohol must be set"
 
-        # Get all sessions from the database
-        sessions = get_all_sessions_from_db()
         # Convert datetime to isoformat string
         drive_time = self.drive_time.isoformat() if self.drive_time else None
         # Create a dict for the session
@@ -411,30 +589,108 @@ class Session:
             "start_time": self.start_time.isoformat(),
             "drive_time": drive_time,
         }
-        # Add the session to the dict of sessions
-        sessions[str(self.id)] = session
-
-        # Save the sessions to the database
-        try:
-            with open("databases/sessions.json", "w") as outfile:
-                json.dump(sessions, outfile)
-                logging.info("Saved to database")
-        except Exception:
-            logging.exception("Unable to load database file")
-        return sessions
+        # Add the session to the database, or update it
+        if new:
+            get_storage().add_session(self.id, session)
+        else:
+            get_storage().save_session(self.id, session)
+        current_sessions.session_saved(self)
+        remember("current_session", int(self.user_id), self)
+
+    def get_drink_log(self) -> list[dict]:
+        """
+        Returns the drinks and BAC measurements logged for the session, oldest first. Each entry has the "kind"
+        ("drink" or "measurement"), the "time", and the estimated (or measured) "bac" straight after it. The last entry
+        is remembered as the latest one, so estimating the BAC afterwards doesn't read the log again.
+        """
+        entries = get_storage().get_drink_log(self.id)
+        remember("latest_log_entry", int(self.id), entries[-1] if entries else None)
+        return entries
+
+    def get_latest_log_entry(self) -> dict or None:
+        """
+        Returns the most recent entry in the session's drink log, or None if nothing has been logged
+        """
+        return load_once(
+            "latest_log_entry",
+            int(self.id),
+            lambda: get_storage().get_latest_drink_log_entry(self.id),
+        )
+
+    def estimate_bac(self, drinker: Drinker, time: datetime = None) -> float or None:
+        """
+        Returns the drinker's estimated BAC at the given time (default now), or None if nothing has been logged for
+        the session. Each log entry holds the BAC straight after it, so only the latest entry is read, and its BAC is
+        metabolized down to the given time.
+        """
+        latest = self.get_latest_log_entry()
+        if latest is None:
+            return None
+        time = time or datetime.now()
+        # Times before the latest entry count as the time of the latest entry
+        seconds = max(
+            (time - datetime.fromisoformat(latest["time"])).total_seconds(), 0
+        )
+        return max(
+            latest["bac"] - drinker.coefficients.bac_metabolized_per_second * seconds,
+            0,
+        )
+
+    def log_drink(
+        self, drinker: Drinker, drink: "Drink", time: datetime = None
+    ) -> float:
+        """
+        Logs that the drinker had the drink at the given time (default now), and returns their estimated BAC straight
+        after it: the estimate before the drink (0 if nothing has been logged yet) plus what the drink adds. Logging a
+        drink is one read of the latest entry and one append, however many drinks came before. Times before the latest
+        entry count as the time of the latest entry.
+        """
+        time = time or datetime.now()
+        bac = drinker.bac_after_drink(drink, self.estimate_bac(drinker, time) or 0.0)
+        self._log(
+            {
+                "kind": "drink",
+                "time": time.isoformat(),
+                "bac": bac,
+                "drink_id": drink.id,
+                "alcohol_content": drink.alcohol_content,
+            }
+        )
+        return bac
+
+    def log_measurement(self, bac: float, time: datetime = None):
+        """
+        Logs a BAC measured by the sensor (or entered by hand) at the given time (default now). Estimates start again
+        from the measurement, so the sensor is only needed now and then to correct the estimate.
+        """
+        time = time or datetime.now()
+        self._log({"kind": "measurement", "time": time.isoformat(), "bac": float(bac)})
+
+    def _log(self, entry: dict):
+        # Each entry's BAC is worked out from the one before, so the log has to stay in time order. Entries logged
+        # with an earlier time than the latest one (e.g. a drink entered late) are logged at the latest one's time.
+        latest = self.get_latest_log_entry()
+        if latest is not None and datetime.fromisoformat(
+            entry["time"]
+        ) < datetime.fromisoformat(latest["time"]):
+            entry["time"] = latest["time"]
+        entry = {"session_id": int(self.id)} | entry
+        get_storage().append_drink_log_entry(entry)
+        remember("latest_log_entry", int(self.id), entry)
 
     def __str__(self):
         return f"Session: {self.id} - {self.user_id} - {self.start_time} - {self.max_alcohol} - {self.drive_time}"
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(frozen=True, slots=True)
 class Drink:
     """
-    Represents a drink
+    Represents a drink. Drinks are shared by every request that uses the catalog, so they can't be changed.
     """
 
     name: str
     type: str
     alcohol_content: float
-    ingredients: list
+    ingredients: tuple
     image_path: str
+    id: int = None
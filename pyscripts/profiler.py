@@ -0,0 +1,98 @@
+import collections
+import itertools
+import sys
+import threading
+import time
+
+
+class SamplingProfiler:
+    """
+    Profiles one thread (e.g. the one handling a request) by looking at its stack every `interval` seconds from a
+    background thread. The thread being profiled isn't slowed down by tracing, so the profile shows where the time
+    goes in the real code path. Use as a context manager around the code to profile.
+    """
+
+    def __init__(self, thread_id: int = None, interval: float = 0.002):
+        """
+        :param thread_id: The thread to profile. The thread that creates the profiler by default.
+        :param interval: Number of seconds between samples
+        """
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        # Folded stack ("outermost;...;innermost") -> number of samples
+        self.stacks = collections.Counter()
+        self.seconds = 0.0
+        self._stopped = threading.Event()
+        self._thread = None
+        self._started = None
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(
+            target=self._run, name="sampling-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        self.seconds = time.perf_counter() - self._started
+
+    def __enter__(self) -> "SamplingProfiler":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                return
+            self.stacks[_fold(frame)] += 1
+
+    def folded(self) -> str:
+        """
+        Returns the samples as folded stacks, one "frame;frame;... count" line per stack, most sampled first. This is
+        the input format of flamegraph.pl and speedscope.
+        """
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.stacks.most_common()
+        )
+
+
+def _fold(frame) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class RecentProfiles:
+    """
+    Keeps the most recent profiles, so they can be fetched after the request that made them
+    """
+
+    def __init__(self, size: int = 20):
+        self.size = size
+        self._profiles: collections.OrderedDict = collections.OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def add(self, profile: SamplingProfiler, description: str) -> int:
+        """
+        Stores a finished profile and returns its id. The oldest profile is dropped when there are too many.
+        """
+        with self._lock:
+            profile_id = next(self._ids)
+            self._profiles[profile_id] = (description, profile)
+            while len(self._profiles) > self.size:
+                self._profiles.popitem(last=False)
+            return profile_id
+
+    def get(self, profile_id: int) -> tuple[str, SamplingProfiler] or None:
+        with self._lock:
+            return self._profiles.get(profile_id)
@@ -0,0 +1,60 @@
+import dataclasses
+import functools
+import hashlib
+from datetime import datetime
+from datetime import timezone
+from io import BytesIO
+
+import qrcode.image.svg
+
+# Image format -> content type
+content_types = {"png": "image/png", "svg": "image/svg+xml"}
+
+
+@dataclasses.dataclass(frozen=True)
+class QrCodeImage:
+    """
+    An encoded QR code image, ready to be sent in a response
+    """
+
+    body: bytes
+    content_type: str
+    # A hash of the body, so clients can ask whether their copy is still current
+    etag: str
+    # When the image was rendered
+    last_modified: datetime
+
+
+@functools.lru_cache(maxsize=64)
+def get_qr_code_image(
+    data: str, box_size: int = 10, border: int = 5, image_format: str = "png"
+) -> QrCodeImage:
+    """
+    Renders a QR code containing the given data. Rendering is the slow part, so images are cached: the same arguments
+    always give the same image.
+    :param box_size: The size of each box of the QR code, in pixels
+    :param border: The width of the border around the QR code, in boxes
+    :param image_format: "png" or "svg". SVG is much cheaper to render, as it is only text.
+    """
+    if image_format not in content_types:
+        raise ValueError(f"Unsupported QR code format: {image_format}")
+    qr = qrcode.QRCode(version=1, box_size=box_size, border=border)
+    qr.add_data(data)
+    qr.make(fit=True)
+
+    img_buffer = BytesIO()
+    if image_format == "svg":
+        qr.make_image(image_factory=qrcode.image.svg.SvgPathImage).save(img_buffer)
+    else:
+        # Create an image in PIL.Image.Image format
+        img = qr.make_image(fill_color="black", back_color="white")
+        img.save(img_buffer, "PNG")
+    body = img_buffer.getvalue()
+
+    return QrCodeImage(
+        body=body,
+        content_type=content_types[image_format],
+        etag=hashlib.sha1(body).hexdigest(),
+        # HTTP dates only have whole seconds
+        last_modified=datetime.now(timezone.utc).replace(microsecond=0),
+    )
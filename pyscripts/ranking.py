@@ -0,0 +1,111 @@
+import dataclasses
+import heapq
+import random
+
+from pyscripts.objects import Drink
+from pyscripts.objects import Drinker
+from pyscripts.objects import legal_driving_limit
+from pyscripts.objects import Session
+from pyscripts.objects import standard_drink_ml
+
+
+@dataclasses.dataclass(frozen=True)
+class RankingStrategy:
+    """
+    How much each signal counts towards a drink's score. Each signal is between 0 and 1.
+    """
+
+    # Weight of the BAC headroom left below the session's max alcohol after the drink
+    headroom: float
+    # Weight of the time to spare between when the drinker could drive after the drink and the drive time
+    drive_margin: float
+    # Penalty for each better drink of the same type, so the top drinks aren't all one type
+    diversity: float
+
+
+strategies = {
+    # Leaves room below the max alcohol and the drive time, with a mix of drink types
+    "balanced": RankingStrategy(headroom=1.0, drive_margin=1.0, diversity=0.5),
+    # Leaves as much room as possible, whatever the type
+    "safest": RankingStrategy(headroom=1.0, drive_margin=1.0, diversity=0.0),
+    # The strongest drinks that are still allowed, with a mix of drink types
+    "strongest": RankingStrategy(headroom=-1.0, drive_margin=0.0, diversity=0.5),
+    # Any allowed drink, like the original shuffled list
+    "random": RankingStrategy(headroom=0.0, drive_margin=0.0, diversity=0.0),
+}
+default_strategy = "balanced"
+
+# Scores are rounded to this many decimal places, so drinks that score about the same count as ties and are picked
+# between at random
+score_precision = 2
+
+
+def rank_drinks(
+    drinker: Drinker,
+    session: Session,
+    current_bac: float,
+    drinks: list[Drink],
+    k: int = 3,
+    strategy: str = default_strategy,
+    seed: int = None,
+) -> list[Drink]:
+    """
+    Returns the k best of the candidate drinks for the drinker, best first. Selects them with heaps, in O(N log k) for N
+    candidates, instead of sorting or shuffling all of them. Ties are broken at random, using `seed` if it is given so
+    that the same arguments always give the same drinks.
+    """
+    if strategy not in strategies:
+        raise ValueError(f"Unknown ranking strategy: {strategy}")
+    weights = strategies[strategy]
+    rng = random.Random(seed)
+    seconds_until_drive_time = session.seconds_until_drive_time()
+    coefficients = drinker.coefficients
+
+    # (score, tie breaker, drink) for each drink, grouped by type
+    scored_by_type: dict[str, list[tuple[float, float, Drink]]] = {}
+    for drink in drinks:
+        # The same sums as Drinker.bac_after_drink and Drinker.number_seconds_until_can_drive, written out because this
+        # runs for every candidate
+        bac_after_drink = current_bac + (
+            coefficients.bac_per_standard_drink
+            * drink.alcohol_content
+            / standard_drink_ml
+        )
+        # Each signal is between 0 and 1
+        headroom = max(session.max_alcohol - bac_after_drink, 0) / session.max_alcohol
+        if seconds_until_drive_time is not None:
+            seconds_until_can_drive = (
+                max(bac_after_drink - legal_driving_limit, 0)
+                * coefficients.seconds_per_bac
+            )
+            if seconds_until_drive_time > 0:
+                drive_margin = max(
+                    (seconds_until_drive_time - seconds_until_can_drive)
+                    / seconds_until_drive_time,
+                    0,
+                )
+            else:
+                # The drive time is now or has passed, so only drinks that leave the drinker able to drive are safe
+                drive_margin = 1.0 if seconds_until_can_drive == 0 else 0.0
+        else:
+            # No drive time, so there is no time to worry about
+            drive_margin = 1.0
+
+        score = round(
+            weights.headroom * headroom + weights.drive_margin * drive_margin,
+            score_precision,
+        )
+        scored_by_type.setdefault(drink.type, []).append((score, rng.random(), drink))
+
+    # Only the k best of each type can make it into the top k. Each is penalised by the number of better drinks of its
+    # type, so that a second drink of one type has to beat the best drink of another type by the diversity weight.
+    shortlist = []
+    for scored in scored_by_type.values():
+        best_of_type = heapq.nlargest(k, scored, key=lambda item: item[:2])
+        for rank_in_type, (score, tie_breaker, drink) in enumerate(best_of_type):
+            shortlist.append(
+                (score - weights.diversity * rank_in_type, tie_breaker, drink)
+            )
+    return [
+        drink for _, _, drink in heapq.nlargest(k, shortlist, key=lambda item: item[:2])
+    ]
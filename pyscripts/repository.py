@@ -0,0 +1,620 @@
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from pyscripts.file_lock import atomic_write
+from pyscripts.file_lock import file_lock
+from pyscripts.journal import Journal
+
+# Directory that holds the JSON "databases". Paths are relative to where the app is run from (see README)
+database_directory = "databases"
+
+
+class TableView:
+    """
+    A table's records together with their indexes. When a table is reloaded, a new view is built and swapped in with a
+    single assignment, so readers that hold on to a view never see records and indexes that don't match, or an index
+    that is half built. New records are added to the current view in place, record first, so they are only indexed
+    once they can be looked up.
+    """
+
+    def __init__(self, records: dict[str, dict]):
+        self.records = records
+        self.max_id = 0
+
+
+class JsonTable:
+    """
+    An in-memory copy of one of the JSON database files. The file is parsed once and kept together with hash indexes.
+    Every access checks the file's modification time and size (a single os.stat call), so edits made to the file by
+    another process or by hand are picked up on the next read.
+    """
+
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self._view = self._build_view({})
+        # Bumped every time the file is (re)loaded, so callers can cheaply tell whether anything changed
+        self.version = 0
+        # False (rather than None, which means "no file") so that the first access always loads the file
+        self._signature = False
+        self._lock = threading.RLock()
+
+    @property
+    def path(self) -> str:
+        return os.path.join(database_directory, self.file_name)
+
+    @property
+    def records(self) -> dict[str, dict]:
+        return self._view.records
+
+    def _file_signature(self) -> tuple or None:
+        """
+        Returns (path, mtime, size) of the file, or None if the file doesn't exist
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return self.path, stat.st_mtime_ns, stat.st_size
+
+    def refresh(self):
+        """
+        Reloads the file and rebuilds the indexes if the file has changed since it was last loaded
+        """
+        signature = self._file_signature()
+        if signature == self._signature:
+            return
+        with self._lock:
+            # Another thread may have reloaded the file while we were waiting for the lock
+            signature = self._file_signature()
+            if signature == self._signature:
+                return
+            self._view = self._build_view(
+                self._load_file() if signature is not None else {}
+            )
+            self._signature = signature
+            self.version += 1
+
+    def _load_file(self) -> dict[str, dict]:
+        """
+        Parses the file. Returns an empty table if the file can't be read.
+        """
+        try:
+            with open(self.path, "r") as infile:
+                return json.load(infile)
+        except Exception:
+            logging.exception("Unable to load database file")
+            return {}
+
+    def all(self) -> dict[str, dict]:
+        """
+        Returns all records in the table, keyed by id. The dict is shared, so it must not be modified.
+        """
+        self.refresh()
+        return self.records
+
+    def get(self, record_id: int) -> dict or None:
+        """
+        Returns the record with the given id, or None if there is no such record
+        """
+        self.refresh()
+        return self.records.get(str(record_id))
+
+    def get_many(self, record_ids: list[int]) -> dict[int, dict]:
+        """
+        Returns the records with the given ids, keyed by id. Ids without a record are left out.
+        """
+        self.refresh()
+        records = self.records
+        return {
+            int(record_id): records[str(record_id)]
+            for record_id in record_ids
+            if str(record_id) in records
+        }
+
+    def max_id(self) -> int:
+        """
+        Returns the highest id in the table, or 0 if the table is empty
+        """
+        self.refresh()
+        return self._view.max_id
+
+    def put(self, record_id: int, record: dict):
+        """
+        Adds (or replaces) a record and writes the table back to the file
+        """
+        with self._lock:
+            self.refresh()
+            records = dict(self.records)
+            records[str(record_id)] = record
+            try:
+                atomic_write(self.path, json.dumps(records))
+                logging.info("Saved to database")
+            except Exception:
+                logging.exception("Unable to save database file")
+                return
+            self._view = self._build_view(records)
+            self._signature = self._file_signature()
+
+    def add(self, record_id: int, record: dict) -> str or None:
+        """
+        Adds a new record, unless another record already has the same value in a unique field. Returns None if the
+        record was added, otherwise the name of the field ("id", or e.g. "username" for users).
+        """
+        with self._lock:
+            self.refresh()
+            if str(record_id) in self.records:
+                return "id"
+            return self.put(record_id, record)
+
+    def _set_record(self, record_id: str, record: dict):
+        """
+        Stores the record in memory and updates the indexes. A new record is added to the current view, a replaced one
+        means building a new view.
+        """
+        view = self._view
+        if record_id in view.records:
+            self._view = self._build_view(view.records | {record_id: record})
+        else:
+            view.records[record_id] = record
+            self._add_to_indexes(view, record_id, record)
+
+    def _build_view(self, records: dict[str, dict]) -> TableView:
+        """
+        Returns a new view of the records, with all of their indexes built
+        """
+        view = self._empty_view(records)
+        for record_id, record in records.items():
+            self._add_to_indexes(view, record_id, record)
+        return view
+
+    def _empty_view(self, records: dict[str, dict]) -> TableView:
+        """
+        Returns a view of the records with empty indexes. Tables with indexes of their own add them here.
+        """
+        return TableView(records)
+
+    def _add_to_indexes(self, view: TableView, record_id: str, record: dict):
+        view.max_id = max(view.max_id, int(record_id))
+
+
+class UsersTable(JsonTable):
+    """
+    The users table, indexed by id and by username
+    """
+
+    def _empty_view(self, records: dict[str, dict]) -> TableView:
+        view = super()._empty_view(records)
+        view.ids_by_username: dict[str, str] = {}
+        return view
+
+    def _add_to_indexes(self, view: TableView, record_id: str, record: dict):
+        super()._add_to_indexes(view, record_id, record)
+        # If a username appears twice, the first one wins (like the old linear scan)
+        view.ids_by_username.setdefault(record["username"], record_id)
+
+    def put(self, record_id: int, record: dict) -> str or None:
+        """
+        Adds (or replaces) a user, unless another user has the same username. Returns None if the user was saved,
+        otherwise "username".
+        """
+        with self._lock:
+            self.refresh()
+            owner_id = self._view.ids_by_username.get(record["username"])
+            if owner_id is not None and owner_id != str(record_id):
+                return "username"
+            super().put(record_id, record)
+
+    def get_by_username(self, username: str) -> tuple[int, dict] or None:
+        """
+        Returns (id, record) for the user with the given username, or None if there is no such user
+        """
+        self.refresh()
+        view = self._view
+        record_id = view.ids_by_username.get(username)
+        if record_id is None:
+            return None
+        return int(record_id), view.records[record_id]
+
+
+class SessionsTable(JsonTable):
+    """
+    The sessions table, indexed by id, by user id and by (user id, start time).
+
+    New sessions aren't written to sessions.json straight away. They are appended to a journal
+    (sessions.journal.jsonl) instead, so saving a session costs the same however many sessions there are. The table is
+    sessions.json (the snapshot) with the journal replayed on top. Once the journal holds `compact_after` sessions, it
+    is compacted: the full table is written to a new snapshot, which atomically replaces sessions.json, and the journal
+    is emptied.
+    """
+
+    compact_after = 1000
+
+    def __init__(self, file_name: str):
+        super().__init__(file_name)
+        self.journal = Journal(
+            os.path.join(
+                database_directory, file_name.replace(".json", ".journal.jsonl")
+            )
+        )
+        # How far into the journal we have read, and how many sessions were read from it since the last snapshot
+        self._journal_offset = 0
+        self._journal_entries = 0
+
+    def refresh(self):
+        """
+        Reloads the snapshot and the journal if the snapshot has changed. If only the journal has grown, just the new
+        entries at the end of it are read.
+        """
+        signature = self._file_signature()
+        journal_size = self.journal.size()
+        if signature == self._signature and journal_size == self._journal_offset:
+            return
+        with self._lock:
+            signature = self._file_signature()
+            journal_size = self.journal.size()
+            if signature != self._signature or journal_size < self._journal_offset:
+                # The snapshot was compacted or edited. Lock so that it isn't compacted again while we read it.
+                with file_lock(self.journal.lock_path):
+                    self._reload()
+            elif journal_size > self._journal_offset:
+                self._replay_journal_tail()
+
+    def _reload(self):
+        """
+        Loads the snapshot and replays the whole journal on top of it. Must be called while holding the journal lock.
+        """
+        self._signature = self._file_signature()
+        records = self._load_file() if self._signature is not None else {}
+        entries, self._journal_offset = self.journal.read_from(0)
+        for entry in entries:
+            records[entry["id"]] = entry["session"]
+        self._journal_entries = len(entries)
+        self._view = self._build_view(records)
+        self.version += 1
+
+    def _replay_journal_tail(self):
+        """
+        Applies the journal entries that were appended since the last read
+        """
+        entries, self._journal_offset = self.journal.read_from(self._journal_offset)
+        for entry in entries:
+            # Our own appends have already been applied, so skip sessions we already have
+            if self.records.get(entry["id"]) != entry["session"]:
+                self._set_record(entry["id"], entry["session"])
+        self._journal_entries += len(entries)
+        self.version += 1
+
+    def put(self, record_id: int, record: dict):
+        """
+        Adds (or replaces) a session by appending it to the journal
+        """
+        with self._lock:
+            self.refresh()
+            start, end = self.journal.append({"id": str(record_id), "session": record})
+            self._set_record(str(record_id), record)
+            # If nobody else appended since our last read, there is nothing to replay up to the end of our entry
+            if start == self._journal_offset:
+                self._journal_offset = end
+                self._journal_entries += 1
+            if self._journal_entries >= self.compact_after:
+                self.compact()
+
+    def compact(self):
+        """
+        Writes all sessions to a new snapshot and empties the journal
+        """
+        with self._lock, file_lock(self.journal.lock_path):
+            # Pick up anything other processes appended, so that it ends up in the snapshot
+            self._reload()
+            atomic_write(self.path, json.dumps(self.records))
+            self.journal.truncate()
+            self._signature = self._file_signature()
+            self._journal_offset = 0
+            self._journal_entries = 0
+            logging.info("Compacted sessions journal")
+
+    def _empty_view(self, records: dict[str, dict]) -> TableView:
+        view = super()._empty_view(records)
+        view.ids_by_user: dict[int, list[str]] = {}
+        view.ids_by_user_and_start_time: dict[tuple[int, datetime], str] = {}
+        view.latest_id_by_user: dict[int, str] = {}
+        return view
+
+    def _add_to_indexes(self, view: TableView, record_id: str, record: dict):
+        super()._add_to_indexes(view, record_id, record)
+        # The user id is stored as a string when the session comes from a form, so normalise it here
+        user_id = int(record["user_id"])
+        start_time = datetime.fromisoformat(record["start_time"])
+        view.ids_by_user.setdefault(user_id, []).append(record_id)
+        view.ids_by_user_and_start_time[(user_id, start_time)] = record_id
+
+        latest_id = view.latest_id_by_user.get(user_id)
+        if latest_id is None or start_time > datetime.fromisoformat(
+            view.records[latest_id]["start_time"]
+        ):
+            view.latest_id_by_user[user_id] = record_id
+
+    def get_for_user(self, user_id: int) -> dict[str, dict]:
+        """
+        Returns all sessions for the given user, keyed by session id
+        """
+        self.refresh()
+        view = self._view
+        return {
+            record_id: view.records[record_id]
+            for record_id in view.ids_by_user.get(int(user_id), [])
+        }
+
+    def get_by_user_and_start_time(
+        self, user_id: int, start_time: datetime
+    ) -> tuple[int, dict] or None:
+        """
+        Returns (id, record) for the session that the user started at the given time, or None
+        """
+        self.refresh()
+        view = self._view
+        record_id = view.ids_by_user_and_start_time.get((int(user_id), start_time))
+        if record_id is None:
+            return None
+        return int(record_id), view.records[record_id]
+
+    def get_latest_for_user(self, user_id: int) -> tuple[int, dict] or None:
+        """
+        Returns (id, record) for the user's session with the most recent start time, or None if they have no sessions
+        """
+        self.refresh()
+        view = self._view
+        record_id = view.latest_id_by_user.get(int(user_id))
+        if record_id is None:
+            return None
+        return int(record_id), view.records[record_id]
+
+    def get_latest_for_users(self, user_ids: list[int]) -> dict[int, tuple[int, dict]]:
+        """
+        Returns (id, record) for each user's session with the most recent start time, keyed by user id. Users without
+        sessions are left out.
+        """
+        self.refresh()
+        view = self._view
+        latest = {}
+        for user_id in user_ids:
+            record_id = view.latest_id_by_user.get(int(user_id))
+            if record_id is not None:
+                latest[int(user_id)] = int(record_id), view.records[record_id]
+        return latest
+
+
+class JournaledTable:
+    """
+    A table that is a snapshot (a JSON file) plus a journal of the entries added since (a JSON-lines file next to it),
+    like the sessions table. Adding an entry is a single append however big the table is, and entries appended by
+    other processes are read from the end of the journal when the table is next used. Once the journal holds
+    `compact_after` entries, the whole table is written to a new snapshot and the journal is emptied, so the journal
+    doesn't grow without bound.
+
+    Subclasses keep the entries in memory however suits them, by implementing _clear, _apply, _load_snapshot and
+    _snapshot.
+    """
+
+    compact_after = 1000
+
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self.journal = Journal(
+            os.path.join(database_directory, file_name.replace(".json", ".jsonl"))
+        )
+        # False (rather than None, which means "no snapshot") so that the first access always loads the table
+        self._signature = False
+        # How far into the journal we have read, and how many entries were read from it since the last snapshot
+        self._journal_offset = 0
+        self._journal_entries = 0
+        self._lock = threading.RLock()
+        self._clear()
+
+    @property
+    def path(self) -> str:
+        return os.path.join(database_directory, self.file_name)
+
+    def _file_signature(self) -> tuple or None:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return self.path, stat.st_mtime_ns, stat.st_size
+
+    def refresh(self):
+        """
+        Reloads the snapshot and the journal if the snapshot has changed. If only the journal has grown, just the new
+        entries at the end of it are read.
+        """
+        signature = self._file_signature()
+        journal_size = self.journal.size()
+        if signature == self._signature and journal_size == self._journal_offset:
+            return
+        with self._lock:
+            signature = self._file_signature()
+            journal_size = self.journal.size()
+            if signature != self._signature or journal_size < self._journal_offset:
+                # The snapshot was compacted or edited. Lock so that it isn't compacted again while we read it.
+                with file_lock(self.journal.lock_path):
+                    self._reload()
+            elif journal_size > self._journal_offset:
+                entries, self._journal_offset = self.journal.read_from(
+                    self._journal_offset
+                )
+                for entry in entries:
+                    self._apply(entry)
+                self._journal_entries += len(entries)
+
+    def _reload(self):
+        """
+        Loads the snapshot and replays the whole journal on top of it. Must be called while holding the journal lock.
+        """
+        self._signature = self._file_signature()
+        self._clear()
+        if self._signature is not None:
+            try:
+                with open(self.path, "r") as infile:
+                    self._load_snapshot(json.load(infile))
+            except Exception:
+                logging.exception("Unable to load database file")
+                self._clear()
+        entries, self._journal_offset = self.journal.read_from(0)
+        for entry in entries:
+            self._apply(entry)
+        self._journal_entries = len(entries)
+
+    def append(self, entry: dict):
+        """
+        Adds an entry to the end of the journal
+        """
+        with self._lock:
+            self.refresh()
+            start, end = self.journal.append(entry)
+            # If nobody else appended since our last read, the new entry is the next one and can be applied straight
+            # away. Otherwise it is picked up with theirs on the next refresh.
+            if start == self._journal_offset:
+                self._apply(entry)
+                self._journal_offset = end
+                self._journal_entries += 1
+            if self._journal_entries >= self.compact_after:
+                self.compact()
+
+    def compact(self):
+        """
+        Writes the whole table to a new snapshot and empties the journal
+        """
+        with self._lock, file_lock(self.journal.lock_path):
+            # Pick up anything other processes appended, so that it ends up in the snapshot
+            self._reload()
+            atomic_write(self.path, json.dumps(self._snapshot()))
+            self.journal.truncate()
+            self._signature = self._file_signature()
+            self._journal_offset = 0
+            self._journal_entries = 0
+            logging.info(f"Compacted {self.journal.path}")
+
+    def _clear(self):
+        """
+        Empties the in-memory table
+        """
+        raise NotImplementedError
+
+    def _apply(self, entry: dict):
+        """
+        Adds a journal entry to the in-memory table
+        """
+        raise NotImplementedError
+
+    def _load_snapshot(self, data):
+        """
+        Fills the in-memory table from a snapshot written by _snapshot
+        """
+        raise NotImplementedError
+
+    def _snapshot(self):
+        """
+        Returns the in-memory table as something json.dumps can write
+        """
+        raise NotImplementedError
+
+
+class DrinkLogTable(JournaledTable):
+    """
+    The drink log: what each session's drinker has drunk and what the sensor measured, in the order it was logged.
+    Entries are only ever added, so logging one is a single append to the journal (drink_log.jsonl), however long the
+    log is. The snapshot (drink_log.json) holds each session's entries. Entries are kept in memory per session.
+    """
+
+    def _clear(self):
+        # Session id -> the session's entries, oldest first
+        self.entries_by_session: dict[int, list[dict]] = {}
+
+    def _apply(self, entry: dict):
+        self.entries_by_session.setdefault(int(entry["session_id"]), []).append(entry)
+
+    def _load_snapshot(self, data: dict[str, list[dict]]):
+        self.entries_by_session = {
+            int(session_id): entries for session_id, entries in data.items()
+        }
+
+    def _snapshot(self) -> dict[int, list[dict]]:
+        return self.entries_by_session
+
+    def get_for_session(self, session_id: int) -> list[dict]:
+        """
+        Returns the session's entries, oldest first
+        """
+        self.refresh()
+        return list(self.entries_by_session.get(int(session_id), []))
+
+    def get_latest_for_session(self, session_id: int) -> dict or None:
+        """
+        Returns the session's most recent entry, or None if nothing has been logged for the session
+        """
+        self.refresh()
+        entries = self.entries_by_session.get(int(session_id))
+        return entries[-1] if entries else None
+
+    def all(self) -> list[dict]:
+        """
+        Returns every entry, grouped by session
+        """
+        self.refresh()
+        return [
+            entry for entries in self.entries_by_session.values() for entry in entries
+        ]
+
+
+class RevokedTokensTable(JournaledTable):
+    """
+    Login tokens that have been logged out of, with the time each would have expired. Shared by all processes through
+    a journal (revoked_tokens.jsonl), like the drink log. Expired tokens can't be used anyway, so they are skipped when
+    the journal is read and left out of the snapshot (revoked_tokens.json) when it is compacted.
+    """
+
+    def _clear(self):
+        # Token -> time it expires, in seconds since the epoch
+        self.expires_at: dict[str, float] = {}
+
+    def _apply(self, entry: dict):
+        if entry["expires_at"] > time.time():
+            self.expires_at[entry["token"]] = entry["expires_at"]
+
+    def _load_snapshot(self, data: dict[str, float]):
+        now = time.time()
+        self.expires_at = {
+            token: expires_at for token, expires_at in data.items() if expires_at > now
+        }
+
+    def _snapshot(self) -> dict[str, float]:
+        now = time.time()
+        return {
+            token: expires_at
+            for token, expires_at in self.expires_at.items()
+            if expires_at > now
+        }
+
+    def add(self, token: str, expires_at: float):
+        self.append({"token": token, "expires_at": expires_at})
+
+    def contains(self, token: str) -> bool:
+        self.refresh()
+        return token in self.expires_at
+
+
+class Repository:
+    """
+    Holds one in-memory table per JSON database file
+    """
+
+    def __init__(self):
+        self.users = UsersTable("users.json")
+        self.sessions = SessionsTable("sessions.json")
+        self.beverages = JsonTable("beverages.json")
+        self.drink_log = DrinkLogTable("drink_log.json")
+        self.revoked_tokens = RevokedTokensTable("revoked_tokens.json")
@@ -0,0 +1,264 @@
+import asyncio
+import collections
+import dataclasses
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable
+
+import serial
+
+from pyscripts import metrics
+from pyscripts.estimators import Estimate
+from pyscripts.estimators import PlateauEstimator
+
+# When turned up all the way the potentiometer reads 4095. This is the maximum value.
+maximum_possible_potentio_value = 4095
+maximum_possible_bac = 0.3  # 0.3% BAC, which is close to comatosed
+
+
+def potentiometer_value_to_bac(value: float) -> float:
+    """
+    Converts a potentiometer reading to a BAC
+    """
+    return (maximum_possible_bac / maximum_possible_potentio_value) * value
+
+
+@dataclasses.dataclass(frozen=True)
+class BacReading:
+    """
+    A BAC measured by the sensor
+    """
+
+    bac: float
+    # How much to trust the reading, from 0 (not at all) to 1
+    confidence: float
+    samples: int
+    # How long the measurement took. Less than the window if the reading settled early.
+    seconds: float
+
+
+def estimate_to_bac_reading(estimate: Estimate, seconds: float) -> BacReading:
+    return BacReading(
+        bac=potentiometer_value_to_bac(estimate.value),
+        confidence=estimate.confidence,
+        samples=estimate.samples,
+        seconds=seconds,
+    )
+
+
+class _Measurement:
+    """
+    A measurement in progress: samples are fed to the estimator until the deadline, or until the estimator is stable
+    """
+
+    def __init__(self, deadline: float, estimator):
+        self.started = time.monotonic()
+        self.deadline = deadline
+        self.estimator = estimator
+        self.future = Future()
+
+
+class SensorReader:
+    """
+    Keeps a serial port open and reads samples from it on a background thread. The most recent samples are kept in a
+    ring buffer, and measurements are answered from the stream of samples, so a request never has to open the port
+    or wait on it itself.
+    """
+
+    def __init__(
+        self,
+        serial_port_name: str,
+        baudrate: int = 9600,
+        buffer_size: int = 600,
+        serial_factory: Callable = serial.Serial,
+    ):
+        """
+        :param serial_port_name: The name of the serial port, e.g. "COM7" or "/dev/ttyUSB0"
+        :param buffer_size: How many of the most recent samples to keep
+        :param serial_factory: Opens the port. Tests can pass a stand-in for serial.Serial.
+        """
+        self.serial_port_name = serial_port_name
+        self.baudrate = baudrate
+        self.serial_factory = serial_factory
+        # (time, value) pairs. A deque with maxlen drops the oldest sample when a new one arrives.
+        self.samples = collections.deque(maxlen=buffer_size)
+        self._measurements: list[_Measurement] = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Starts the background thread that reads from the port
+        """
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run, name=f"sensor-{self.serial_port_name}", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stops reading and closes the port. Measurements still in progress fail.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            measurements, self._measurements = self._measurements, []
+        for measurement in measurements:
+            measurement.future.set_exception(
+                RuntimeError(f"Sensor {self.serial_port_name} was stopped")
+            )
+
+    def measure(self, window: float = 5.0, estimator=None) -> Future:
+        """
+        Starts measuring and returns straight away. The samples read over the next `window` seconds are fed to the
+        estimator (a PlateauEstimator by default), and the returned future is resolved with its Estimate. The
+        measurement finishes early if the estimator says the reading is stable.
+        """
+        self.start()
+        measurement = _Measurement(
+            deadline=time.monotonic() + window,
+            estimator=estimator or PlateauEstimator(),
+        )
+        with self._lock:
+            self._measurements.append(measurement)
+        return measurement.future
+
+    def peak_over_last(self, seconds: float) -> float or None:
+        """
+        Returns the highest value read in the last `seconds` seconds, or None if there were no samples
+        """
+        since = time.monotonic() - seconds
+        values = [
+            value for sample_time, value in list(self.samples) if sample_time >= since
+        ]
+        return max(values) if values else None
+
+    def _run(self):
+        port = None
+        while not self._stopped.is_set():
+            try:
+                if port is None:
+                    # A timeout lets the loop finish measurements and notice stop() even if the device goes quiet
+                    port = self.serial_factory(
+                        self.serial_port_name, self.baudrate, timeout=0.2
+                    )
+                with metrics.sensor_read_seconds.time(self.serial_port_name):
+                    line = port.readline()
+            except (serial.SerialException, OSError):
+                logging.exception(f"Unable to read from {self.serial_port_name}")
+                if port is not None:
+                    port.close()
+                    port = None
+                self._stopped.wait(1)
+                self._finish_measurements()
+                continue
+
+            if line:
+                try:
+                    self._add_sample(float(line.decode().strip()))
+                except ValueError:
+                    logging.warning(f"Ignoring malformed sample {line!r}")
+            self._finish_measurements()
+        if port is not None:
+            port.close()
+
+    def _add_sample(self, value: float):
+        now = time.monotonic()
+        self.samples.append((now, value))
+        metrics.sensor_samples.inc(self.serial_port_name)
+        with self._lock:
+            for measurement in self._measurements:
+                if now <= measurement.deadline:
+                    measurement.estimator.add(value)
+
+    def _finish_measurements(self):
+        """
+        Resolves the measurements whose window has passed or whose reading is stable
+        """
+        now = time.monotonic()
+        with self._lock:
+            finished = [
+                m
+                for m in self._measurements
+                if m.deadline <= now or m.estimator.is_stable
+            ]
+            if not finished:
+                return
+            self._measurements = [m for m in self._measurements if m not in finished]
+        for measurement in finished:
+            estimate = measurement.estimator.estimate()
+            metrics.sensor_measurement_seconds.observe(
+                now - measurement.started,
+                self.serial_port_name,
+                "no_samples" if estimate is None else "ok",
+            )
+            if estimate is None:
+                measurement.future.set_exception(
+                    TimeoutError(f"No samples from {self.serial_port_name}")
+                )
+            else:
+                measurement.future.set_result(estimate)
+
+
+_readers: dict[str, SensorReader] = {}
+_readers_lock = threading.Lock()
+
+
+def get_sensor_reader(serial_port_name: str) -> SensorReader:
+    """
+    Returns the running reader for the given port, starting it on first use
+    """
+    with _readers_lock:
+        if serial_port_name not in _readers:
+            _readers[serial_port_name] = SensorReader(serial_port_name)
+            _readers[serial_port_name].start()
+        return _readers[serial_port_name]
+
+
+def measure_bac(serial_port_name: str, window: float = 5.0) -> Future:
+    """
+    Starts a measurement on the given port and returns straight away. The returned future is resolved with a
+    BacReading once the reading has settled, or after at most `window` seconds.
+    """
+    started = time.monotonic()
+    estimate = get_sensor_reader(serial_port_name).measure(window)
+    reading = Future()
+
+    def convert_to_bac(finished: Future):
+        if finished.exception() is not None:
+            reading.set_exception(finished.exception())
+        else:
+            reading.set_result(
+                estimate_to_bac_reading(
+                    finished.result(), seconds=time.monotonic() - started
+                )
+            )
+
+    estimate.add_done_callback(convert_to_bac)
+    return reading
+
+
+async def measure_bac_async(serial_port_name: str, window: float = 5.0) -> BacReading:
+    """
+    Measures on the given port like measure_bac, and waits for the BacReading without blocking the event loop, so one
+    process can wait on many measurements at once
+    """
+    return await asyncio.wrap_future(measure_bac(serial_port_name, window))
+
+
+def stop_all_sensor_readers():
+    """
+    Stops all readers and closes their ports
+    """
+    with _readers_lock:
+        readers = list(_readers.values())
+        _readers.clear()
+    for reader in readers:
+        reader.stop()
@@ -0,0 +1,182 @@
+import collections
+import statistics
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable
+
+import serial
+
+from pyscripts.sensor import estimate_to_bac_reading
+from pyscripts.sensor import SensorReader
+
+
+class Station:
+    """
+    One breathalyzer station: a serial device with its own reader thread. A station runs one measurement at a time.
+    """
+
+    def __init__(self, name: str, reader: SensorReader):
+        self.name = name
+        self.reader = reader
+        self.busy = False
+        self.measurements = 0
+        self.failures = 0
+        # Seconds from a request being submitted to its result, for the most recent measurements
+        self.latencies = collections.deque(maxlen=200)
+        self.created = time.monotonic()
+
+    def stats(self) -> dict:
+        latencies = list(self.latencies)
+        minutes = (time.monotonic() - self.created) / 60
+        return {
+            "port": self.reader.serial_port_name,
+            "busy": self.busy,
+            "measurements": self.measurements,
+            "failures": self.failures,
+            "measurements_per_minute": self.measurements / minutes if minutes else 0.0,
+            "mean_latency": statistics.fmean(latencies) if latencies else None,
+            "p95_latency": (
+                statistics.quantiles(latencies, n=20)[-1]
+                if len(latencies) > 1
+                else (latencies[0] if latencies else None)
+            ),
+        }
+
+
+class _Request:
+    def __init__(self, station_name: str or None, window: float):
+        self.station_name = station_name
+        self.window = window
+        self.submitted = time.monotonic()
+        self.future = Future()
+
+
+class SensorHub:
+    """
+    Manages several breathalyzer stations at once. Measurement requests go to a free station (or to the station the
+    request asks for), and wait in a queue when every suitable station is busy.
+    """
+
+    def __init__(
+        self,
+        serial_port_names: dict[str, str],
+        window: float = 5.0,
+        serial_factory: Callable = serial.Serial,
+    ):
+        """
+        :param serial_port_names: Station name -> serial port name, e.g. {"bar": "COM7", "door": "COM8"}
+        :param window: Default number of seconds to measure for
+        :param serial_factory: Opens the ports. Tests can pass a stand-in for serial.Serial.
+        """
+        self.window = window
+        self.stations = {
+            name: Station(name, SensorReader(port_name, serial_factory=serial_factory))
+            for name, port_name in serial_port_names.items()
+        }
+        self._queue: collections.deque[_Request] = collections.deque()
+        self._lock = threading.Lock()
+        # Set by stop(), after which no more measurements are started
+        self._stopped = False
+
+    def submit(self, station_name: str = None, window: float = None) -> Future:
+        """
+        Requests a BAC measurement and returns straight away. The returned future is resolved with a BacReading once a
+        station has measured it. Pass a station name to use that station only.
+        """
+        if station_name is not None and station_name not in self.stations:
+            raise KeyError(f"Unknown station: {station_name}")
+        request = _Request(station_name, window or self.window)
+        with self._lock:
+            if self._stopped:
+                request.future.set_exception(RuntimeError("Sensor hub was stopped"))
+                return request.future
+            station = self._free_station_for(request)
+            if station is None:
+                self._queue.append(request)
+            else:
+                station.busy = True
+        if station is not None:
+            self._start(station, request)
+        return request.future
+
+    def queued(self) -> int:
+        """
+        Returns the number of requests waiting for a station
+        """
+        return len(self._queue)
+
+    def stats(self) -> dict:
+        """
+        Returns per-station throughput and latency, and the length of the queue
+        """
+        return {
+            "queued": self.queued(),
+            "stations": {
+                name: station.stats() for name, station in self.stations.items()
+            },
+        }
+
+    def stop(self):
+        """
+        Stops all stations and closes their ports. Queued requests and measurements in progress fail, and requests
+        submitted afterwards fail straight away.
+        """
+        # Stopped first, so the measurements failed by stopping the readers don't hand their station to a queued
+        # request, which would start the reader (and open its port) again
+        with self._lock:
+            self._stopped = True
+            queued, self._queue = list(self._queue), collections.deque()
+        for request in queued:
+            request.future.set_exception(RuntimeError("Sensor hub was stopped"))
+        for station in self.stations.values():
+            station.reader.stop()
+
+    def _free_station_for(self, request: _Request) -> Station or None:
+        if request.station_name is not None:
+            station = self.stations[request.station_name]
+            return None if station.busy else station
+        return next(
+            (station for station in self.stations.values() if not station.busy), None
+        )
+
+    def _start(self, station: Station, request: _Request):
+        started = time.monotonic()
+        estimate = station.reader.measure(request.window)
+        estimate.add_done_callback(
+            lambda finished: self._finish(station, request, started, finished)
+        )
+
+    def _finish(
+        self, station: Station, request: _Request, started: float, finished: Future
+    ):
+        now = time.monotonic()
+        station.latencies.append(now - request.submitted)
+        if finished.exception() is not None:
+            station.failures += 1
+            request.future.set_exception(finished.exception())
+        else:
+            station.measurements += 1
+            request.future.set_result(
+                estimate_to_bac_reading(finished.result(), seconds=now - started)
+            )
+
+        # Hand the station to the first queued request that can use it
+        with self._lock:
+            if self._stopped:
+                station.busy = False
+                return
+            next_request = next(
+                (
+                    queued
+                    for queued in self._queue
+                    if queued.station_name in (None, station.name)
+                ),
+                None,
+            )
+            if next_request is None:
+                station.busy = False
+            else:
+                self._queue.remove(next_request)
+        if next_request is not None:
+            self._start(station, next_request)
@@ -0,0 +1,752 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from pyscripts import repository
+from pyscripts.repository import Repository
+
+
+class RecordExists(Exception):
+    """
+    Raised when adding a record whose id is already in use
+    """
+
+
+class UsernameTaken(RecordExists):
+    """
+    Raised when adding or saving a user whose username another user already has
+    """
+
+
+class StorageBackend:
+    """
+    Interface for the places where users, sessions and beverages are stored. Records are passed around as dicts in the
+    same format as the original JSON databases, so the objects in pyscripts/objects.py don't need to know which
+    backend is in use.
+    """
+
+    def get_user(self, user_id: int) -> dict or None:
+        """
+        Returns the user record with the given id, or None if there is no such user
+        """
+        raise NotImplementedError
+
+    def get_user_by_username(self, username: str) -> tuple[int, dict] or None:
+        """
+        Returns (id, record) for the user with the given username, or None if there is no such user
+        """
+        raise NotImplementedError
+
+    def get_users(self, user_ids: list[int]) -> dict[int, dict]:
+        """
+        Returns the records of the given users, keyed by user id, in one read. Unknown users are left out.
+        """
+        raise NotImplementedError
+
+    def all_users(self) -> dict[str, dict]:
+        """
+        Returns all user records, keyed by id
+        """
+        raise NotImplementedError
+
+    def max_user_id(self) -> int:
+        """
+        Returns the highest user id, or 0 if there are no users
+        """
+        raise NotImplementedError
+
+    def add_user(self, user_id: int, record: dict):
+        """
+        Adds a new user record. Raises UsernameTaken if another user has the username, or RecordExists if the id is
+        in use.
+        """
+        raise NotImplementedError
+
+    def save_user(self, user_id: int, record: dict):
+        """
+        Replaces an existing user record. Raises UsernameTaken if another user has the username.
+        """
+        raise NotImplementedError
+
+    def all_sessions(self) -> dict[str, dict]:
+        """
+        Returns all session records, keyed by id
+        """
+        raise NotImplementedError
+
+    def get_latest_session_for_user(self, user_id: int) -> tuple[int, dict] or None:
+        """
+        Returns (id, record) for the user's session with the most recent start time, or None if they have no sessions
+        """
+        raise NotImplementedError
+
+    def get_latest_sessions_for_users(
+        self, user_ids: list[int]
+    ) -> dict[int, tuple[int, dict]]:
+        """
+        Returns (id, record) for each user's session with the most recent start time, keyed by user id, in one read.
+        Users without sessions are left out.
+        """
+        raise NotImplementedError
+
+    def max_session_id(self) -> int:
+        """
+        Returns the highest session id, or 0 if there are no sessions
+        """
+        raise NotImplementedError
+
+    def add_session(self, session_id: int, record: dict):
+        """
+        Adds a new session record. Raises RecordExists if the id is in use.
+        """
+        raise NotImplementedError
+
+    def save_session(self, session_id: int, record: dict):
+        """
+        Replaces an existing session record
+        """
+        raise NotImplementedError
+
+    def sessions_version(self) -> int:
+        """
+        Returns a number that changes whenever sessions are saved by another process (or edited by hand), so that
+        anything computed from them can be kept until they are. It doesn't change for sessions saved through this
+        backend, as whoever saves them can update what they computed themselves.
+        """
+        raise NotImplementedError
+
+    def append_drink_log_entry(self, record: dict):
+        """
+        Adds an entry (a drink or a BAC measurement, with its "session_id") to the end of the drink log
+        """
+        raise NotImplementedError
+
+    def get_drink_log(self, session_id: int) -> list[dict]:
+        """
+        Returns the drink log entries of the given session, oldest first
+        """
+        raise NotImplementedError
+
+    def get_latest_drink_log_entry(self, session_id: int) -> dict or None:
+        """
+        Returns the session's most recent drink log entry, or None if nothing has been logged for it
+        """
+        raise NotImplementedError
+
+    def all_drink_log_entries(self) -> list[dict]:
+        """
+        Returns every drink log entry. Entries of the same session are in the order they were logged.
+        """
+        raise NotImplementedError
+
+    def all_beverages(self) -> dict[str, dict]:
+        """
+        Returns all beverage records, keyed by id
+        """
+        raise NotImplementedError
+
+    def beverages_version(self) -> int:
+        """
+        Returns a number that changes whenever the beverages change, so that anything computed from the catalog can be
+        kept until it does
+        """
+        raise NotImplementedError
+
+    def revoke_token(self, token: str, expires_at: float):
+        """
+        Records that a login token was logged out of, so that no process accepts it again. `expires_at` is when the
+        token would have expired (in seconds since the epoch), after which it doesn't need to be kept.
+        """
+        raise NotImplementedError
+
+    def is_token_revoked(self, token: str) -> bool:
+        """
+        Returns True if the login token was logged out of, by any process
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Releases any resources (files, connections) held by the backend
+        """
+
+
+class JsonStorage(StorageBackend):
+    """
+    Stores everything in the JSON files in the databases directory, using the indexed in-memory repository
+    """
+
+    def __init__(self, repository: Repository = None):
+        self.repository = repository or Repository()
+
+    def get_user(self, user_id: int) -> dict or None:
+        return self.repository.users.get(user_id)
+
+    def get_user_by_username(self, username: str) -> tuple[int, dict] or None:
+        return self.repository.users.get_by_username(username)
+
+    def get_users(self, user_ids: list[int]) -> dict[int, dict]:
+        return self.repository.users.get_many(user_ids)
+
+    def all_users(self) -> dict[str, dict]:
+        return self.repository.users.all()
+
+    def max_user_id(self) -> int:
+        return self.repository.users.max_id()
+
+    def add_user(self, user_id: int, record: dict):
+        conflict = self.repository.users.add(user_id, record)
+        if conflict == "username":
+            raise UsernameTaken(f"Username {record['username']} already exists")
+        elif conflict is not None:
+            raise RecordExists(f"User {user_id} already exists")
+
+    def save_user(self, user_id: int, record: dict):
+        if self.repository.users.put(user_id, record) is not None:
+            raise UsernameTaken(f"Username {record['username']} already exists")
+
+    def all_sessions(self) -> dict[str, dict]:
+        return self.repository.sessions.all()
+
+    def get_latest_session_for_user(self, user_id: int) -> tuple[int, dict] or None:
+        return self.repository.sessions.get_latest_for_user(user_id)
+
+    def get_latest_sessions_for_users(
+        self, user_ids: list[int]
+    ) -> dict[int, tuple[int, dict]]:
+        return self.repository.sessions.get_latest_for_users(user_ids)
+
+    def max_session_id(self) -> int:
+        return self.repository.sessions.max_id()
+
+    def add_session(self, session_id: int, record: dict):
+        if self.repository.sessions.add(session_id, record) is not None:
+            raise RecordExists(f"Session {session_id} already exists")
+
+    def save_session(self, session_id: int, record: dict):
+        self.repository.sessions.put(session_id, record)
+
+    def sessions_version(self) -> int:
+        # The sessions table doesn't bump its version for our own saves, only when it reads someone else's
+        self.repository.sessions.refresh()
+        return self.repository.sessions.version
+
+    def append_drink_log_entry(self, record: dict):
+        self.repository.drink_log.append(record)
+
+    def get_drink_log(self, session_id: int) -> list[dict]:
+        return self.repository.drink_log.get_for_session(session_id)
+
+    def get_latest_drink_log_entry(self, session_id: int) -> dict or None:
+        return self.repository.drink_log.get_latest_for_session(session_id)
+
+    def all_drink_log_entries(self) -> list[dict]:
+        return self.repository.drink_log.all()
+
+    def all_beverages(self) -> dict[str, dict]:
+        return self.repository.beverages.all()
+
+    def beverages_version(self) -> int:
+        self.repository.beverages.refresh()
+        return self.repository.beverages.version
+
+    def revoke_token(self, token: str, expires_at: float):
+        self.repository.revoked_tokens.add(token, expires_at)
+
+    def is_token_revoked(self, token: str) -> bool:
+        return self.repository.revoked_tokens.contains(token)
+
+
+class SqliteStorage(StorageBackend):
+    """
+    Stores everything in a single SQLite database. The database runs in WAL mode so that several processes (e.g.
+    gunicorn workers) can read while one of them writes, and inserts only touch the new row. sqlite3 connections can't
+    be shared between threads, so every thread gets its own connection. The SQL statements are module constants with
+    placeholders, so sqlite3's statement cache prepares each of them once per connection.
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            username TEXT NOT NULL,
+            password TEXT NOT NULL,
+            dob TEXT NOT NULL,
+            sex TEXT NOT NULL,
+            weight TEXT NOT NULL
+        );
+        DROP INDEX IF EXISTS users_username;
+        CREATE UNIQUE INDEX IF NOT EXISTS users_username_unique ON users (username);
+        CREATE TABLE IF NOT EXISTS sessions (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            max_alcohol REAL NOT NULL,
+            start_time TEXT NOT NULL,
+            drive_time TEXT
+        );
+        CREATE INDEX IF NOT EXISTS sessions_user_id_start_time ON sessions (user_id, start_time);
+        CREATE TABLE IF NOT EXISTS beverages (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            type TEXT NOT NULL,
+            alcohol_content TEXT NOT NULL,
+            ingredients TEXT NOT NULL,
+            image_path TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS drink_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            time TEXT NOT NULL,
+            bac REAL NOT NULL,
+            drink_id INTEGER,
+            alcohol_content REAL
+        );
+        CREATE INDEX IF NOT EXISTS drink_log_session_id ON drink_log (session_id, id);
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO table_versions (name, version) VALUES ('beverages', 0);
+        INSERT OR IGNORE INTO table_versions (name, version) VALUES ('sessions', 0);
+        CREATE TABLE IF NOT EXISTS revoked_tokens (
+            token TEXT PRIMARY KEY,
+            expires_at REAL NOT NULL
+        );
+        CREATE TRIGGER IF NOT EXISTS sessions_insert AFTER INSERT ON sessions BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'sessions';
+        END;
+        CREATE TRIGGER IF NOT EXISTS sessions_update AFTER UPDATE ON sessions BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'sessions';
+        END;
+        CREATE TRIGGER IF NOT EXISTS sessions_delete AFTER DELETE ON sessions BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'sessions';
+        END;
+        CREATE TRIGGER IF NOT EXISTS beverages_insert AFTER INSERT ON beverages BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'beverages';
+        END;
+        CREATE TRIGGER IF NOT EXISTS beverages_update AFTER UPDATE ON beverages BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'beverages';
+        END;
+        CREATE TRIGGER IF NOT EXISTS beverages_delete AFTER DELETE ON beverages BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'beverages';
+        END;
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        # The triggers bump the sessions version for our own saves too. Counting them lets sessions_version leave them
+        # out, and the lock keeps a save and its count together, so a version is never read in between.
+        self._own_session_saves = 0
+        self._session_saves_lock = threading.Lock()
+        # Create the tables up front, so that the first request doesn't have to
+        with self._connection() as connection:
+            connection.executescript(self.schema)
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Returns the connection for the current thread, opening it if needed
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Each connection is only used by its own thread, but close() closes all of them from whichever thread
+            # calls it
+            connection = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            # In WAL mode NORMAL is still safe against corruption, and avoids an fsync on every commit
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    def get_user(self, user_id: int) -> dict or None:
+        row = self._connection().execute(SELECT_USER_BY_ID, (int(user_id),)).fetchone()
+        return _user_row_to_record(row) if row else None
+
+    def get_user_by_username(self, username: str) -> tuple[int, dict] or None:
+        row = (
+            self._connection().execute(SELECT_USER_BY_USERNAME, (username,)).fetchone()
+        )
+        return (row["id"], _user_row_to_record(row)) if row else None
+
+    def get_users(self, user_ids: list[int]) -> dict[int, dict]:
+        users = {}
+        for chunk in _chunks([int(user_id) for user_id in user_ids]):
+            rows = self._connection().execute(
+                SELECT_USERS_BY_IDS.format(placeholders=_placeholders(chunk)), chunk
+            )
+            users.update((row["id"], _user_row_to_record(row)) for row in rows)
+        return users
+
+    def all_users(self) -> dict[str, dict]:
+        rows = self._connection().execute(SELECT_ALL_USERS)
+        return {str(row["id"]): _user_row_to_record(row) for row in rows}
+
+    def max_user_id(self) -> int:
+        return self._connection().execute(SELECT_MAX_USER_ID).fetchone()[0]
+
+    def add_user(self, user_id: int, record: dict):
+        try:
+            with self._connection() as connection:
+                connection.execute(INSERT_USER, _user_record_to_row(user_id, record))
+        except sqlite3.IntegrityError as error:
+            raise _user_conflict(error, record) from error
+
+    def save_user(self, user_id: int, record: dict):
+        try:
+            with self._connection() as connection:
+                updated = connection.execute(
+                    UPDATE_USER,
+                    _user_record_to_row(user_id, record)[1:] + (int(user_id),),
+                ).rowcount
+        except sqlite3.IntegrityError as error:
+            raise _user_conflict(error, record) from error
+        if not updated:
+            raise KeyError(f"No user with id {user_id}")
+
+    def all_sessions(self) -> dict[str, dict]:
+        rows = self._connection().execute(SELECT_ALL_SESSIONS)
+        return {str(row["id"]): _session_row_to_record(row) for row in rows}
+
+    def get_latest_session_for_user(self, user_id: int) -> tuple[int, dict] or None:
+        row = (
+            self._connection()
+            .execute(SELECT_LATEST_SESSION_FOR_USER, (int(user_id),))
+            .fetchone()
+        )
+        return (row["id"], _session_row_to_record(row)) if row else None
+
+    def get_latest_sessions_for_users(
+        self, user_ids: list[int]
+    ) -> dict[int, tuple[int, dict]]:
+        latest = {}
+        for chunk in _chunks([int(user_id) for user_id in user_ids]):
+            rows = self._connection().execute(
+                SELECT_LATEST_SESSIONS_FOR_USERS.format(
+                    placeholders=_placeholders(chunk)
+                ),
+                chunk,
+            )
+            latest.update(
+                (row["user_id"], (row["id"], _session_row_to_record(row)))
+                for row in rows
+            )
+        return latest
+
+    def max_session_id(self) -> int:
+        return self._connection().execute(SELECT_MAX_SESSION_ID).fetchone()[0]
+
+    def add_session(self, session_id: int, record: dict):
+        with self._session_saves_lock:
+            try:
+                with self._connection() as connection:
+                    connection.execute(
+                        INSERT_SESSION, _session_record_to_row(session_id, record)
+                    )
+            except sqlite3.IntegrityError as error:
+                raise RecordExists(f"Session {session_id} already exists") from error
+            self._own_session_saves += 1
+
+    def save_session(self, session_id: int, record: dict):
+        with self._session_saves_lock:
+            with self._connection() as connection:
+                updated = connection.execute(
+                    UPDATE_SESSION,
+                    _session_record_to_row(session_id, record)[1:] + (int(session_id),),
+                ).rowcount
+            self._own_session_saves += updated
+        if not updated:
+            raise KeyError(f"No session with id {session_id}")
+
+    def sessions_version(self) -> int:
+        # Kept up to date by triggers on the sessions table, less the saves made through this backend
+        with self._session_saves_lock:
+            version = (
+                self._connection()
+                .execute(SELECT_TABLE_VERSION, ("sessions",))
+                .fetchone()[0]
+            )
+            return version - self._own_session_saves
+
+    def append_drink_log_entry(self, record: dict):
+        with self._connection() as connection:
+            connection.execute(INSERT_DRINK_LOG_ENTRY, _drink_log_record_to_row(record))
+
+    def get_drink_log(self, session_id: int) -> list[dict]:
+        rows = self._connection().execute(
+            SELECT_DRINK_LOG_FOR_SESSION, (int(session_id),)
+        )
+        return [_drink_log_row_to_record(row) for row in rows]
+
+    def get_latest_drink_log_entry(self, session_id: int) -> dict or None:
+        row = (
+            self._connection()
+            .execute(SELECT_LATEST_DRINK_LOG_ENTRY, (int(session_id),))
+            .fetchone()
+        )
+        return _drink_log_row_to_record(row) if row else None
+
+    def all_drink_log_entries(self) -> list[dict]:
+        rows = self._connection().execute(SELECT_ALL_DRINK_LOG_ENTRIES)
+        return [_drink_log_row_to_record(row) for row in rows]
+
+    def all_beverages(self) -> dict[str, dict]:
+        rows = self._connection().execute(SELECT_ALL_BEVERAGES)
+        return {str(row["id"]): _beverage_row_to_record(row) for row in rows}
+
+    def beverages_version(self) -> int:
+        # Kept up to date by triggers on the beverages table
+        return (
+            self._connection()
+            .execute(SELECT_TABLE_VERSION, ("beverages",))
+            .fetchone()[0]
+        )
+
+    def revoke_token(self, token: str, expires_at: float):
+        with self._connection() as connection:
+            # Tokens that have expired since can't be used anyway
+            connection.execute(DELETE_EXPIRED_REVOKED_TOKENS, (time.time(),))
+            connection.execute(INSERT_REVOKED_TOKEN, (token, expires_at))
+
+    def is_token_revoked(self, token: str) -> bool:
+        return (
+            self._connection().execute(SELECT_REVOKED_TOKEN, (token,)).fetchone()
+            is not None
+        )
+
+    def import_records(
+        self,
+        users: dict[str, dict],
+        sessions: dict[str, dict],
+        beverages: dict[str, dict],
+        drink_log: list[dict] = None,
+    ):
+        """
+        Adds (or replaces) many records at once, in a single transaction. Used by the JSON to SQLite migration. Drink
+        log entries have no ids of their own, so if `drink_log` is given it replaces the whole drink log. Raises
+        UsernameTaken, and writes nothing, if a user's username belongs to a user with another id.
+        """
+        try:
+            with self._connection() as connection:
+                connection.executemany(
+                    UPSERT_USER, [_user_record_to_row(*item) for item in users.items()]
+                )
+                connection.executemany(
+                    UPSERT_SESSION,
+                    [_session_record_to_row(*item) for item in sessions.items()],
+                )
+                connection.executemany(
+                    UPSERT_BEVERAGE,
+                    [_beverage_record_to_row(*item) for item in beverages.items()],
+                )
+                if drink_log is not None:
+                    connection.execute(DELETE_DRINK_LOG)
+                    connection.executemany(
+                        INSERT_DRINK_LOG_ENTRY,
+                        [_drink_log_record_to_row(record) for record in drink_log],
+                    )
+        except sqlite3.IntegrityError as error:
+            raise UsernameTaken(
+                f"A username is already used by a user with another id: {error}"
+            ) from error
+
+    def close(self):
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+        self._local = threading.local()
+
+
+SELECT_USER_BY_ID = "SELECT * FROM users WHERE id = ?"
+SELECT_USERS_BY_IDS = "SELECT * FROM users WHERE id IN ({placeholders})"
+SELECT_USER_BY_USERNAME = "SELECT * FROM users WHERE username = ? ORDER BY id LIMIT 1"
+SELECT_ALL_USERS = "SELECT * FROM users ORDER BY id"
+SELECT_MAX_USER_ID = "SELECT COALESCE(MAX(id), 0) FROM users"
+# Only used by import_records. Users with an id that is already in use are updated in place. A username that belongs to
+# a user with another id breaks the unique index, rather than replacing (and so deleting) that user's row.
+UPSERT_USER = (
+    "INSERT INTO users (id, username, password, dob, sex, weight) VALUES (?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (id) DO UPDATE SET username = excluded.username, password = excluded.password, dob = excluded.dob, "
+    "sex = excluded.sex, weight = excluded.weight"
+)
+INSERT_USER = "INSERT INTO users (id, username, password, dob, sex, weight) VALUES (?, ?, ?, ?, ?, ?)"
+UPDATE_USER = "UPDATE users SET username = ?, password = ?, dob = ?, sex = ?, weight = ? WHERE id = ?"
+SELECT_ALL_SESSIONS = "SELECT * FROM sessions ORDER BY id"
+SELECT_LATEST_SESSION_FOR_USER = (
+    "SELECT * FROM sessions WHERE user_id = ? ORDER BY start_time DESC LIMIT 1"
+)
+# The row number picks each user's latest session, like SELECT_LATEST_SESSION_FOR_USER does for one user
+SELECT_LATEST_SESSIONS_FOR_USERS = """
+    SELECT * FROM (
+        SELECT *, ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY start_time DESC) AS row_number
+        FROM sessions WHERE user_id IN ({placeholders})
+    ) WHERE row_number = 1
+"""
+SELECT_MAX_SESSION_ID = "SELECT COALESCE(MAX(id), 0) FROM sessions"
+UPSERT_SESSION = "INSERT OR REPLACE INTO sessions (id, user_id, max_alcohol, start_time, drive_time) VALUES (?, ?, ?, ?, ?)"
+INSERT_SESSION = "INSERT INTO sessions (id, user_id, max_alcohol, start_time, drive_time) VALUES (?, ?, ?, ?, ?)"
+UPDATE_SESSION = "UPDATE sessions SET user_id = ?, max_alcohol = ?, start_time = ?, drive_time = ? WHERE id = ?"
+INSERT_DRINK_LOG_ENTRY = "INSERT INTO drink_log (session_id, kind, time, bac, drink_id, alcohol_content) VALUES (?, ?, ?, ?, ?, ?)"
+SELECT_DRINK_LOG_FOR_SESSION = (
+    "SELECT * FROM drink_log WHERE session_id = ? ORDER BY id"
+)
+SELECT_LATEST_DRINK_LOG_ENTRY = (
+    "SELECT * FROM drink_log WHERE session_id = ? ORDER BY id DESC LIMIT 1"
+)
+SELECT_ALL_DRINK_LOG_ENTRIES = "SELECT * FROM drink_log ORDER BY id"
+DELETE_DRINK_LOG = "DELETE FROM drink_log"
+SELECT_ALL_BEVERAGES = "SELECT * FROM beverages ORDER BY id"
+SELECT_TABLE_VERSION = "SELECT version FROM table_versions WHERE name = ?"
+INSERT_REVOKED_TOKEN = (
+    "INSERT OR REPLACE INTO revoked_tokens (token, expires_at) VALUES (?, ?)"
+)
+SELECT_REVOKED_TOKEN = "SELECT 1 FROM revoked_tokens WHERE token = ?"
+DELETE_EXPIRED_REVOKED_TOKENS = "DELETE FROM revoked_tokens WHERE expires_at <= ?"
+UPSERT_BEVERAGE = "INSERT OR REPLACE INTO beverages (id, name, type, alcohol_content, ingredients, image_path) VALUES (?, ?, ?, ?, ?, ?)"
+
+
+# SQLite limits the number of parameters in a query, so long lists of ids are queried in chunks of this size
+max_ids_per_query = 500
+
+
+def _chunks(ids: list[int]) -> list[list[int]]:
+    return [
+        ids[start : start + max_ids_per_query]
+        for start in range(0, len(ids), max_ids_per_query)
+    ]
+
+
+def _placeholders(ids: list[int]) -> str:
+    return ", ".join("?" * len(ids))
+
+
+def _user_conflict(error: sqlite3.IntegrityError, record: dict) -> RecordExists:
+    """
+    Returns the error to raise for a write that broke the uniqueness of a user's id or username
+    """
+    if "users.username" in str(error):
+        return UsernameTaken(f"Username {record['username']} already exists")
+    return RecordExists(str(error))
+
+
+def _user_record_to_row(user_id: int or str, record: dict) -> tuple:
+    return (
+        int(user_id),
+        record["username"],
+        record["password"],
+        record["dob"],
+        record["sex"],
+        str(record["weight"]),
+    )
+
+
+def _session_record_to_row(session_id: int or str, record: dict) -> tuple:
+    return (
+        int(session_id),
+        int(record["user_id"]),
+        float(record["max_alcohol"]),
+        record["start_time"],
+        record["drive_time"],
+    )
+
+
+def _beverage_record_to_row(beverage_id: int or str, record: dict) -> tuple:
+    return (
+        int(beverage_id),
+        record["name"],
+        record["type"],
+        str(record["alcohol_content"]),
+        json.dumps(record["ingredients"]),
+        record["image_path"],
+    )
+
+
+def _drink_log_record_to_row(record: dict) -> tuple:
+    return (
+        int(record["session_id"]),
+        record["kind"],
+        record["time"],
+        float(record["bac"]),
+        record.get("drink_id"),
+        record.get("alcohol_content"),
+    )
+
+
+def _user_row_to_record(row: sqlite3.Row) -> dict:
+    return {
+        "username": row["username"],
+        "password": row["password"],
+        "dob": row["dob"],
+        "sex": row["sex"],
+        "weight": row["weight"],
+    }
+
+
+def _session_row_to_record(row: sqlite3.Row) -> dict:
+    return {
+        "user_id": row["user_id"],
+        "max_alcohol": row["max_alcohol"],
+        "start_time": row["start_time"],
+        "drive_time": row["drive_time"],
+    }
+
+
+def _drink_log_row_to_record(row: sqlite3.Row) -> dict:
+    return {
+        "session_id": row["session_id"],
+        "kind": row["kind"],
+        "time": row["time"],
+        "bac": row["bac"],
+        "drink_id": row["drink_id"],
+        "alcohol_content": row["alcohol_content"],
+    }
+
+
+def _beverage_row_to_record(row: sqlite3.Row) -> dict:
+    return {
+        "name": row["name"],
+        "type": row["type"],
+        "alcohol_content": row["alcohol_content"],
+        "ingredients": json.loads(row["ingredients"]),
+        "image_path": row["image_path"],
+    }
+
+
+# The backend used by the app. Defaults to the JSON files, use set_storage() to switch (see app.py)
+_storage: StorageBackend = JsonStorage()
+
+
+def get_storage() -> StorageBackend:
+    """
+    Returns the storage backend used by the app
+    """
+    return _storage
+
+
+def set_storage(storage: StorageBackend):
+    """
+    Sets the storage backend used by the app
+    """
+    global _storage
+    _storage = storage
+
+
+def create_storage(backend: str, sqlite_path: str = None) -> StorageBackend:
+    """
+    Creates a storage backend by name ("json" or "sqlite")
+    """
+    if backend == "json":
+        return JsonStorage()
+    elif backend == "sqlite":
+        return SqliteStorage(
+            sqlite_path
+            or os.path.join(repository.database_directory, "breathalyzer.sqlite3")
+        )
+    raise ValueError(f"Unknown storage backend: {backend}")
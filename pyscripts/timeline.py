@@ -0,0 +1,301 @@
+from datetime import datetime
+
+import numpy as np
+
+from pyscripts.objects import Drink
+from pyscripts.objects import Drinker
+from pyscripts.objects import get_catalog
+from pyscripts.objects import legal_driving_limit
+from pyscripts.objects import Session
+from pyscripts.objects import standard_drink_ml
+
+
+def _searchsorted_rows(
+    sorted_rows: np.ndarray, values: np.ndarray, side: str = "left"
+) -> np.ndarray:
+    """
+    np.searchsorted for each row of `sorted_rows` with the same row of `values`, in one call. Each row is shifted up
+    past the one before it, so the rows can be searched as one flat sorted array.
+    """
+    rows, columns = sorted_rows.shape
+    if columns == 0:
+        return np.zeros(values.shape, dtype=int)
+    low = min(sorted_rows.min(), values.min())
+    high = max(sorted_rows.max(), values.max())
+    row_offsets = (high - low + 1) * np.arange(rows)[:, np.newaxis]
+    indices = np.searchsorted(
+        (sorted_rows + row_offsets).ravel(), (values + row_offsets).ravel(), side=side
+    ).reshape(values.shape)
+    return indices - columns * np.arange(rows)[:, np.newaxis]
+
+
+class BacTimelines:
+    """
+    The BAC over time of N drinkers, each with a session start time and a sequence of timestamped drinks.
+
+    Uses the same model as Drinker: a drink raises BAC straight away by bac_per_standard_drink per standard drink, and
+    BAC goes down by bac_metabolized_per_second until it reaches 0. Without the floor at 0, BAC would be the "free"
+    curve X(t) = initial BAC + the drinks had by t - rate * (t - start), which is a straight line between drinks. The
+    floor only lifts the curve by how far X has dipped below 0 so far, so BAC(t) = X(t) - min(0, lowest X up to t).
+    X is lowest just before a drink or at t itself, so the whole curve comes from cumulative sums and minimums over the
+    drinks, and every drinker, drink and time is worked out with array operations.
+
+    Times are held as seconds since each drinker's start time. Drinkers with fewer drinks are padded with empty drinks
+    at their start time, which don't change their BAC.
+    """
+
+    def __init__(
+        self,
+        bac_per_standard_drink: np.ndarray,
+        bac_metabolized_per_second: np.ndarray,
+        start_times: np.ndarray,
+        drink_times: np.ndarray,
+        alcohol_contents: np.ndarray,
+        initial_bacs: np.ndarray = None,
+    ):
+        """
+        :param bac_per_standard_drink: (N,) BAC increase per standard drink, per drinker
+        :param bac_metabolized_per_second: (N,) BAC metabolized per second, per drinker
+        :param start_times: (N,) session start times, as POSIX timestamps
+        :param drink_times: (N, D) times of the drinks, as POSIX timestamps. Drinks before the start time count as
+            being had at the start time.
+        :param alcohol_contents: (N, D) ml of alcohol in each drink. Use 0 for padding.
+        :param initial_bacs: (N,) BAC at the start time, 0 if not given
+        """
+        self.bac_per_standard_drink = np.asarray(bac_per_standard_drink, dtype=float)
+        self.rate = np.asarray(bac_metabolized_per_second, dtype=float)
+        self.start_times = np.asarray(start_times, dtype=float)
+        count = len(self.start_times)
+        self.initial_bacs = (
+            np.zeros(count)
+            if initial_bacs is None
+            else np.asarray(initial_bacs, dtype=float)
+        )
+
+        drink_times = np.asarray(drink_times, dtype=float).reshape(count, -1)
+        alcohol_contents = np.asarray(alcohol_contents, dtype=float).reshape(count, -1)
+        relative_times = np.maximum(drink_times - self.start_times[:, np.newaxis], 0)
+        order = np.argsort(relative_times, axis=1, kind="stable")
+        # (N, D) drink times in seconds since the start, sorted, and the BAC each drink adds
+        self.drink_times = np.take_along_axis(relative_times, order, axis=1)
+        self.jumps = (
+            np.take_along_axis(alcohol_contents, order, axis=1)
+            / standard_drink_ml
+            * self.bac_per_standard_drink[:, np.newaxis]
+        )
+
+    @classmethod
+    def from_drinkers(
+        cls,
+        drinkers: list[Drinker],
+        start_times: list[datetime],
+        drinks: list[list[tuple[datetime, Drink]]],
+        initial_bacs: list[float] = None,
+    ) -> "BacTimelines":
+        """
+        Builds the timelines of the drinkers from their session start times and the (time, drink) pairs each of them
+        has had or plans to have
+        """
+        longest = max((len(had) for had in drinks), default=0)
+        start_timestamps = np.array([start.timestamp() for start in start_times])
+        drink_times = np.repeat(start_timestamps[:, np.newaxis], longest, axis=1)
+        alcohol_contents = np.zeros((len(drinkers), longest))
+        for row, had in enumerate(drinks):
+            if had:
+                drink_times[row, : len(had)] = [time.timestamp() for time, _ in had]
+                alcohol_contents[row, : len(had)] = [
+                    drink.alcohol_content for _, drink in had
+                ]
+        return cls(
+            bac_per_standard_drink=[
+                drinker.coefficients.bac_per_standard_drink for drinker in drinkers
+            ],
+            bac_metabolized_per_second=[
+                drinker.coefficients.bac_metabolized_per_second for drinker in drinkers
+            ],
+            start_times=start_timestamps,
+            drink_times=drink_times,
+            alcohol_contents=alcohol_contents,
+            initial_bacs=initial_bacs,
+        )
+
+    def _free_curve(self, horizons: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the alcohol had by the start of each stretch between drinks (W, so X(t) = W - rate * t on the stretch)
+        and the lowest X up to the start of each stretch (including the initial BAC), both (N, D + 1). Drinks after the
+        horizon (N,) are left out.
+        """
+        counted = self.drink_times <= horizons[:, np.newaxis]
+        alcohol_had = np.concatenate(
+            [
+                self.initial_bacs[:, np.newaxis],
+                self.initial_bacs[:, np.newaxis]
+                + np.cumsum(np.where(counted, self.jumps, 0), axis=1),
+            ],
+            axis=1,
+        )
+        # X just before each drink, i.e. at the end of each stretch but the last. Stretches after the horizon end at
+        # the horizon.
+        ends = alcohol_had[:, :-1] - self.rate[:, np.newaxis] * np.minimum(
+            self.drink_times, horizons[:, np.newaxis]
+        )
+        lowest_before = np.minimum.accumulate(
+            np.concatenate([self.initial_bacs[:, np.newaxis], ends], axis=1), axis=1
+        )
+        return alcohol_had, lowest_before
+
+    def bac_at(self, times) -> np.ndarray:
+        """
+        Returns each drinker's BAC at the given POSIX timestamps, as an (N, G) array. `times` is one grid for every
+        drinker (G,) or a grid per drinker (N, G). Times before a drinker's start time count as the start time.
+        """
+        times = np.asarray(times, dtype=float)
+        grid = np.broadcast_to(
+            times if times.ndim == 2 else times[np.newaxis, :],
+            (len(self.start_times), times.shape[-1]),
+        )
+        relative = np.maximum(grid - self.start_times[:, np.newaxis], 0)
+        alcohol_had, lowest_before = self._free_curve(relative.max(axis=1))
+        # The stretch each time falls in is the number of drinks had by then
+        stretch = _searchsorted_rows(self.drink_times, relative, side="right")
+        free = (
+            np.take_along_axis(alcohol_had, stretch, axis=1)
+            - self.rate[:, np.newaxis] * relative
+        )
+        lowest = np.minimum(np.take_along_axis(lowest_before, stretch, axis=1), free)
+        return free - np.minimum(lowest, 0)
+
+    def bac_curve(
+        self, end_time: datetime, step_seconds: float = 60
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns a time grid from the earliest start time to `end_time`, every `step_seconds`, as POSIX timestamps, and
+        each drinker's BAC on it as an (N, G) array
+        """
+        times = np.arange(
+            self.start_times.min(), end_time.timestamp() + step_seconds, step_seconds
+        )
+        return times, self.bac_at(times)
+
+    def latest_drink_times(
+        self, alcohol_contents, drive_times, earliest_times=None
+    ) -> np.ndarray:
+        """
+        Returns, for each drinker and each of M drinks, the latest time the drink can be had, on top of the drinker's
+        other drinks, and still be at or below the legal driving limit at the drive time. The result is an (N, M) array
+        of POSIX timestamps, NaN where even having the drink at the earliest time is too much.
+
+        Having a drink later never lowers BAC at the drive time, so the times the drink can be had run from the
+        earliest time up to the latest one. With the drink at time s, BAC at the drive time T is
+        X(T) + a - min(0, lowest X before s, lowest X from s to T + a) for a drink that adds a. The lowest X before s
+        only goes down as s gets later, so the latest time is where it first drops below X(T) + a - limit, which is
+        found for every drink with one search over the drinker's stretches between drinks.
+
+        :param alcohol_contents: (M,) ml of alcohol in each drink
+        :param drive_times: (N,) drive time of each drinker, as POSIX timestamps
+        :param earliest_times: (N,) earliest time each drinker can have the drink, as POSIX timestamps. Defaults to
+            now, or the start time if that is later.
+        """
+        count = len(self.start_times)
+        horizons = np.asarray(drive_times, dtype=float) - self.start_times
+        if earliest_times is None:
+            earliest_times = np.full(count, datetime.now().timestamp())
+        earliest = np.maximum(
+            np.asarray(earliest_times, dtype=float) - self.start_times, 0
+        )
+        rate = self.rate[:, np.newaxis]
+        # Drinks after the drive time don't matter, so their stretches are cut down to nothing at the drive time
+        stretch_starts = np.minimum(
+            np.concatenate([np.zeros((count, 1)), self.drink_times], axis=1),
+            horizons[:, np.newaxis],
+        )
+        alcohol_had, lowest_before = self._free_curve(horizons)
+        # X(T), and X at the end of each stretch
+        free_at_drive_time = alcohol_had[:, -1] - self.rate * horizons
+        stretch_ends = np.concatenate(
+            [stretch_starts[:, 1:], horizons[:, np.newaxis]], axis=1
+        )
+        lowest_by_end = np.minimum(
+            lowest_before,
+            np.minimum.accumulate(alcohol_had - rate * stretch_ends, axis=1),
+        )
+        lowest_after_end = np.minimum.accumulate(
+            (alcohol_had - rate * stretch_ends)[:, ::-1], axis=1
+        )[:, ::-1]
+
+        # (N, M) BAC each drink adds, and the lowest X before the drink can be and keep BAC(T) at the limit
+        added = (
+            self.bac_per_standard_drink[:, np.newaxis]
+            * np.asarray(alcohol_contents, dtype=float)[np.newaxis, :]
+            / standard_drink_ml
+        )
+        lowest_allowed = free_at_drive_time[:, np.newaxis] + added - legal_driving_limit
+
+        # The first stretch by the end of which X has dropped below the lowest allowed. lowest_by_end goes down along
+        # each row, so its negative can be searched.
+        stretch = _searchsorted_rows(-lowest_by_end, -lowest_allowed, side="right")
+        last_stretch = stretch >= alcohol_had.shape[1]
+        stretch = np.minimum(stretch, alcohol_had.shape[1] - 1)
+        # X(s) = W - rate * s on the stretch, so X reaches the lowest allowed at s = (W - lowest allowed) / rate
+        latest = np.where(
+            last_stretch,
+            horizons[:, np.newaxis],
+            (np.take_along_axis(alcohol_had, stretch, axis=1) - lowest_allowed) / rate,
+        )
+        latest = np.clip(latest, earliest[:, np.newaxis], horizons[:, np.newaxis])
+
+        # Whether the drink can be had at all: BAC at the drive time with the drink had at the earliest time
+        first = _searchsorted_rows(
+            stretch_starts, earliest[:, np.newaxis], side="right"
+        )
+        first = np.maximum(first - 1, 0)
+        free_at_earliest = (
+            np.take_along_axis(alcohol_had, first, axis=1)[:, 0] - self.rate * earliest
+        )
+        lowest_before_earliest = np.minimum(
+            np.take_along_axis(lowest_before, first, axis=1)[:, 0], free_at_earliest
+        )
+        lowest_from_earliest = np.take_along_axis(lowest_after_end, first, axis=1)[:, 0]
+        bac_at_drive_time = (
+            free_at_drive_time[:, np.newaxis]
+            + added
+            - np.minimum(
+                np.minimum(lowest_before_earliest, 0)[:, np.newaxis],
+                lowest_from_earliest[:, np.newaxis] + added,
+            )
+        )
+        possible = (bac_at_drive_time <= legal_driving_limit + 1e-12) & (
+            earliest <= horizons
+        )[:, np.newaxis]
+        return np.where(possible, latest + self.start_times[:, np.newaxis], np.nan)
+
+
+def latest_times_to_drink(
+    drinker: Drinker,
+    session: Session,
+    drinks_had: list[tuple[datetime, Drink]],
+    drinks: list[Drink] = None,
+    initial_bac: float = 0.0,
+) -> list[tuple[Drink, datetime or None]]:
+    """
+    Returns the latest time the drinker can have each drink (the whole catalog if `drinks` is None) on top of the
+    drinks they have had or plan to have in the session, and still be able to drive at the session's drive time. The
+    time is None if the drink would stop them from driving by then, and for every drink if the session has no drive
+    time.
+    """
+    if drinks is None:
+        drinks = list(get_catalog().drinks)
+    if session.drive_time is None:
+        return [(drink, None) for drink in drinks]
+
+    timelines = BacTimelines.from_drinkers(
+        [drinker], [session.start_time], [drinks_had], initial_bacs=[initial_bac]
+    )
+    latest = timelines.latest_drink_times(
+        alcohol_contents=[drink.alcohol_content for drink in drinks],
+        drive_times=[session.drive_time.timestamp()],
+    )[0]
+    return [
+        (drink, None if np.isnan(time) else datetime.fromtimestamp(time))
+        for drink, time in zip(drinks, latest.tolist())
+    ]
@@ -0,0 +1,253 @@
+import collections
+import contextvars
+import threading
+import time
+from typing import Callable
+from typing import Hashable
+
+from pyscripts import metrics
+from pyscripts.storage import StorageBackend
+
+
+class UnitOfWork:
+    """
+    Everything loaded while handling one request. Drinkers, sessions and the catalog snapshot are kept in an identity
+    map, so however many times a request asks for the same one, it is only loaded once and the same object is returned
+    every time.
+    """
+
+    def __init__(self):
+        # (entity type, key) -> entity
+        self.identity_map: dict[tuple[str, Hashable], object] = {}
+        # Table name -> number of reads from the storage backend
+        self.storage_reads = collections.Counter()
+
+    def get_or_load(self, entity_type: str, key: Hashable, load: Callable):
+        """
+        Returns the entity if it has been loaded before in this unit of work. Otherwise loads it with `load()` and
+        remembers it, even if it is None.
+        """
+        entity_key = (entity_type, key)
+        if entity_key not in self.identity_map:
+            self.identity_map[entity_key] = load()
+        return self.identity_map[entity_key]
+
+    def get_or_load_many(
+        self, entity_type: str, keys: list[Hashable], load_many: Callable
+    ) -> dict:
+        """
+        Like get_or_load, for many entities at once. The ones that haven't been loaded yet are loaded together with
+        `load_many(keys)`, which returns a dict of the entities it found.
+        """
+        missing = [
+            key
+            for key in dict.fromkeys(keys)
+            if (entity_type, key) not in self.identity_map
+        ]
+        if missing:
+            loaded = load_many(missing)
+            for key in missing:
+                self.identity_map[(entity_type, key)] = loaded.get(key)
+        return {key: self.identity_map[(entity_type, key)] for key in keys}
+
+    def put(self, entity_type: str, key: Hashable, entity):
+        """
+        Remembers an entity that was created or saved during the unit of work
+        """
+        self.identity_map[(entity_type, key)] = entity
+
+
+_current_unit_of_work: contextvars.ContextVar = contextvars.ContextVar(
+    "unit_of_work", default=None
+)
+
+
+def begin_unit_of_work() -> tuple[UnitOfWork, contextvars.Token]:
+    """
+    Starts a unit of work for the current context (e.g. the current request). Pass the returned token to
+    end_unit_of_work when it is done.
+    """
+    unit_of_work = UnitOfWork()
+    return unit_of_work, _current_unit_of_work.set(unit_of_work)
+
+
+def end_unit_of_work(token: contextvars.Token):
+    _current_unit_of_work.reset(token)
+
+
+def get_unit_of_work() -> UnitOfWork or None:
+    """
+    Returns the unit of work for the current context, or None if there isn't one
+    """
+    return _current_unit_of_work.get()
+
+
+def load_once(entity_type: str, key: Hashable, load: Callable):
+    """
+    Loads an entity through the current unit of work, so it is only loaded once per unit of work. Outside a unit of
+    work the entity is just loaded.
+    """
+    unit_of_work = get_unit_of_work()
+    if unit_of_work is None:
+        return load()
+    return unit_of_work.get_or_load(entity_type, key, load)
+
+
+def load_many_once(entity_type: str, keys: list[Hashable], load_many: Callable) -> dict:
+    """
+    Loads many entities through the current unit of work, see UnitOfWork.get_or_load_many. Entities that aren't found
+    are None.
+    """
+    unit_of_work = get_unit_of_work()
+    if unit_of_work is None:
+        loaded = load_many(list(dict.fromkeys(keys)))
+        return {key: loaded.get(key) for key in keys}
+    return unit_of_work.get_or_load_many(entity_type, keys, load_many)
+
+
+def remember(entity_type: str, key: Hashable, entity):
+    """
+    Puts a created or saved entity into the current unit of work, if there is one
+    """
+    unit_of_work = get_unit_of_work()
+    if unit_of_work is not None:
+        unit_of_work.put(entity_type, key, entity)
+
+
+class CountingStorage(StorageBackend):
+    """
+    Wraps a storage backend and counts the reads made during each unit of work, per table. Also times every call to the
+    backend for the storage metrics.
+    """
+
+    def __init__(self, storage: StorageBackend):
+        self.storage = storage
+
+    def _count(self, table: str):
+        unit_of_work = get_unit_of_work()
+        if unit_of_work is not None:
+            unit_of_work.storage_reads[table] += 1
+
+    def _read(self, table: str, operation: str, *args):
+        self._count(table)
+        return self._call(table, operation, *args)
+
+    def _call(self, table: str, operation: str, *args):
+        started = time.perf_counter()
+        try:
+            return getattr(self.storage, operation)(*args)
+        finally:
+            metrics.storage_seconds.observe(
+                time.perf_counter() - started, table, operation
+            )
+
+    def get_user(self, user_id: int) -> dict or None:
+        return self._read("users", "get_user", user_id)
+
+    def get_user_by_username(self, username: str) -> tuple[int, dict] or None:
+        return self._read("users", "get_user_by_username", username)
+
+    def get_users(self, user_ids: list[int]) -> dict[int, dict]:
+        return self._read("users", "get_users", user_ids)
+
+    def all_users(self) -> dict[str, dict]:
+        return self._read("users", "all_users")
+
+    def max_user_id(self) -> int:
+        return self._read("users", "max_user_id")
+
+    def add_user(self, user_id: int, record: dict):
+        self._call("users", "add_user", user_id, record)
+
+    def save_user(self, user_id: int, record: dict):
+        self._call("users", "save_user", user_id, record)
+
+    def all_sessions(self) -> dict[str, dict]:
+        return self._read("sessions", "all_sessions")
+
+    def get_latest_session_for_user(self, user_id: int) -> tuple[int, dict] or None:
+        return self._read("sessions", "get_latest_session_for_user", user_id)
+
+    def get_latest_sessions_for_users(
+        self, user_ids: list[int]
+    ) -> dict[int, tuple[int, dict]]:
+        return self._read("sessions", "get_latest_sessions_for_users", user_ids)
+
+    def max_session_id(self) -> int:
+        return self._read("sessions", "max_session_id")
+
+    def add_session(self, session_id: int, record: dict):
+        self._call("sessions", "add_session", session_id, record)
+
+    def save_session(self, session_id: int, record: dict):
+        self._call("sessions", "save_session", session_id, record)
+
+    def sessions_version(self) -> int:
+        # Only checks whether anything changed, so it isn't counted as a read
+        return self.storage.sessions_version()
+
+    def append_drink_log_entry(self, record: dict):
+        self._call("drink_log", "append_drink_log_entry", record)
+
+    def get_drink_log(self, session_id: int) -> list[dict]:
+        return self._read("drink_log", "get_drink_log", session_id)
+
+    def get_latest_drink_log_entry(self, session_id: int) -> dict or None:
+        return self._read("drink_log", "get_latest_drink_log_entry", session_id)
+
+    def all_drink_log_entries(self) -> list[dict]:
+        return self._read("drink_log", "all_drink_log_entries")
+
+    def all_beverages(self) -> dict[str, dict]:
+        return self._read("beverages", "all_beverages")
+
+    def beverages_version(self) -> int:
+        return self.storage.beverages_version()
+
+    def revoke_token(self, token: str, expires_at: float):
+        self._call("revoked_tokens", "revoke_token", token, expires_at)
+
+    def is_token_revoked(self, token: str) -> bool:
+        return self._read("revoked_tokens", "is_token_revoked", token)
+
+    def close(self):
+        self.storage.close()
+
+
+class StorageReadStats:
+    """
+    Collects the number of storage reads made by each route, per table
+    """
+
+    def __init__(self):
+        self._routes: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def record(self, route: str, storage_reads: collections.Counter):
+        with self._lock:
+            stats = self._routes.setdefault(
+                route,
+                {"requests": 0, "reads": collections.Counter(), "max": {}},
+            )
+            stats["requests"] += 1
+            stats["reads"].update(storage_reads)
+            for table, reads in storage_reads.items():
+                stats["max"][table] = max(stats["max"].get(table, 0), reads)
+
+    def summary(self) -> dict:
+        """
+        Returns, per route, the number of requests, the mean reads per request and the most reads in one request, per
+        table
+        """
+        with self._lock:
+            return {
+                route: {
+                    "requests": stats["requests"],
+                    "mean_reads": {
+                        table: reads / stats["requests"]
+                        for table, reads in stats["reads"].items()
+                    },
+                    "max_reads": dict(stats["max"]),
+                }
+                for route, stats in self._routes.items()
+            }